@@ -33,16 +33,23 @@
         
         # Datos base
         'data/sequence_data.xml',
+        'data/ir_cron_data.xml',
         
         # Reportes
         'reports/specimen_report.xml',
+        'reports/qr_label_sheet.xml',
         
         # Vistas Backend
         'views/specimen_views.xml',
+        'views/taxon_views.xml',
         'views/collection_site_views.xml',
         'views/image_views.xml',
         'views/qr_code_views.xml',
         'views/history_log_views.xml',
+        'views/image_job_views.xml',
+        'views/dwca_export_views.xml',
+        'views/qr_batch_views.xml',
+        'views/import_job_views.xml',
         'views/herbario_menus.xml',
         
         # Vistas Website
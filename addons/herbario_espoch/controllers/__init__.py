@@ -1 +1,2 @@
-from . import main
\ No newline at end of file
+from . import main
+from . import upload
\ No newline at end of file
@@ -1,7 +1,48 @@
-from odoo import http
+from odoo import http, api
 from odoo.http import request
+from odoo.tools import SQL, split_every
+from odoo.addons.herbario_espoch.models.image import IMAGE_VARIANT_FIELDS
+from odoo.addons.herbario_espoch.models.page_cache import (
+    CSRF_PLACEHOLDER, SURROGATE_ALL_SPECIMENS, family_surrogate_key, specimen_surrogate_key,
+)
+from werkzeug.exceptions import NotFound
+from collections import defaultdict
+from io import StringIO
+from urllib.parse import urlencode
+import csv
 import json
 import base64
+import os
+import zlib
+
+# Caché para URLs sin hash de contenido (las URLs con hash son inmutables)
+IMAGE_CACHE_MAX_AGE = 3600
+# Caché de las respuestas del mapa agrupado (segundos)
+MAP_CACHE_MAX_AGE = 300
+
+# Listados paginados por cursor
+REPOSITORY_PER_PAGE = 12
+GALLERY_PER_PAGE = 20
+API_MAX_LIMIT = 100
+COUNT_MODES = ('none', 'approx', 'auto', 'exact')
+# Claves de orden por opción de la URL; la última es única (id o código)
+REPOSITORY_SORT_KEYS = {
+    '': [('id', 'desc')],
+    'date_asc': [('id', 'asc')],
+    'name_asc': [('nombre_cientifico', 'asc'), ('id', 'asc')],
+    'name_desc': [('nombre_cientifico', 'desc'), ('id', 'desc')],
+    'code_asc': [('codigo_herbario', 'asc')],
+}
+# Argumentos de la URL que forman parte de la clave de caché del repositorio
+REPOSITORY_CACHE_ARGS = ('search', 'familia', 'genero', 'pais', 'provincia', 'localidad',
+                         'colector', 'autor', 'sort', 'cursor')
+
+# Exportación por lotes
+EXPORT_BATCH_SIZE = 500
+EXPORT_SPECIMEN_FIELDS = ['codigo_herbario', 'nombre_cientifico', 'familia', 'genero', 'especie',
+                          'autor_cientifico', 'determinado_por', 'descripcion_especie']
+EXPORT_SITE_FIELDS = ['localidad', 'provincia', 'pais', 'latitud', 'longitud', 'colector',
+                      'fecha_recoleccion']
 
 
 class HerbarioController(http.Controller):
@@ -11,92 +52,58 @@ class HerbarioController(http.Controller):
     @http.route(['/herbario', '/herbario/'], type='http', auth='public', website=True)
     def herbario_home(self, **kw):
         """Página principal del herbario"""
-        Specimen = request.env['herbario.specimen'].sudo()
-        
-        # Estadísticas generales
-        total_specimens = Specimen.search_count([('es_publico', '=', True), ('status', '=', 'activo')])
-        total_families = len(Specimen.search([('es_publico', '=', True), ('status', '=', 'activo')]).mapped('familia'))
-        total_images = request.env['herbario.image'].sudo().search_count([
-            ('specimen_id.es_publico', '=', True),
-            ('deleted_at', '=', False)
-        ])
-        
-        # Últimos especímenes agregados
-        recent_specimens = Specimen.search([
-            ('es_publico', '=', True),
-            ('status', '=', 'activo')
-        ], limit=6, order='created_at desc')
-        
-        return request.render('herbario_espoch.herbario_home', {
-            'total_specimens': total_specimens,
-            'total_families': total_families,
-            'total_images': total_images,
-            'recent_specimens': recent_specimens,
-        })
+        def render():
+            Specimen = request.env['herbario.specimen'].sudo()
+            
+            # Estadísticas generales
+            stats = request.env['herbario.statistics.cube'].sudo().get_summary()['stats']
+            
+            # Últimos especímenes agregados
+            recent_specimens = Specimen.search([
+                ('es_publico', '=', True),
+                ('status', '=', 'activo')
+            ], limit=6, order='created_at desc')
+            
+            return request.render('herbario_espoch.herbario_home', {
+                'total_specimens': stats['total_specimens'],
+                'total_families': stats['total_families'],
+                'total_images': stats['total_images'],
+                'recent_specimens': recent_specimens,
+            })
+        return self._cached_page([SURROGATE_ALL_SPECIMENS], render)
 
     # ==================== ESTADÍSTICAS ====================
     
     @http.route(['/herbario/estadisticas'], type='http', auth='public', website=True)
     def herbario_stats(self, **kw):
-        """Página de estadísticas con gráficos"""
-        Specimen = request.env['herbario.specimen'].sudo()
-        CollectionSite = request.env['herbario.collection.site'].sudo()
-        
-        specimens = Specimen.search([('es_publico', '=', True), ('status', '=', 'activo')])
-        
-        # Estadísticas generales
-        stats = {
-            'total_specimens': len(specimens),
-            'total_families': len(specimens.mapped('familia')),
-            'total_genera': len(specimens.mapped('genero')),
-            'total_species': len(specimens.mapped('especie')),
-            'total_locations': CollectionSite.search_count([('specimen_id.es_publico', '=', True)]),
-            'total_images': request.env['herbario.image'].sudo().search_count([
-                ('specimen_id.es_publico', '=', True),
-                ('deleted_at', '=', False)
-            ]),
-        }
-        
-        # Top 10 familias más representadas
-        families_data = {}
-        for spec in specimens:
-            families_data[spec.familia] = families_data.get(spec.familia, 0) + 1
-        top_families = sorted(families_data.items(), key=lambda x: x[1], reverse=True)[:10]
-        
-        # Especímenes por provincia
-        locations = CollectionSite.search([('specimen_id.es_publico', '=', True)])
-        provinces_data = {}
-        for loc in locations:
-            provinces_data[loc.provincia] = provinces_data.get(loc.provincia, 0) + 1
-        top_provinces = sorted(provinces_data.items(), key=lambda x: x[1], reverse=True)[:10]
-        
-        # Especímenes por año de recolección
-        years_data = {}
-        for loc in locations:
-            if loc.fecha_recoleccion:
-                year = loc.fecha_recoleccion.year
-                years_data[year] = years_data.get(year, 0) + 1
-        years_sorted = sorted(years_data.items())
-        
-        # Coordenadas para el mapa
-        map_locations = []
-        for loc in locations:
-            if loc.latitud and loc.longitud:
-                map_locations.append({
-                    'lat': loc.latitud,
-                    'lng': loc.longitud,
-                    'name': loc.specimen_id.nombre_cientifico,
-                    'locality': loc.localidad,
-                    'provincia': loc.provincia,
-                })
-        
-        return request.render('herbario_espoch.herbario_statistics', {
-            'stats': stats,
-            'top_families': top_families,
-            'top_provinces': top_provinces,
-            'years_data': years_sorted,
-            'map_locations': json.dumps(map_locations),
-        })
+        """Página de estadísticas con gráficos (leídas del cubo precalculado)"""
+        def render():
+            summary = request.env['herbario.statistics.cube'].sudo().get_summary()
+            
+            return request.render('herbario_espoch.herbario_statistics', {
+                'stats': summary['stats'],
+                'top_families': json.dumps(summary['families']),
+                'top_provinces': json.dumps(summary['provinces']),
+                'years_data': json.dumps(summary['years']),
+                'altitude_data': json.dumps(summary['altitude_bands']),
+            })
+        return self._cached_page([SURROGATE_ALL_SPECIMENS], render)
+
+    # ==================== MAPA ====================
+
+    @http.route(['/herbario/api/map/clusters'], type='http', auth='public', methods=['GET'])
+    def herbario_map_clusters(self, bbox='', zoom=7, provincia='', familia='', **kw):
+        """Ubicaciones agrupadas del área visible del mapa (bbox=oeste,sur,este,norte)"""
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+            zoom = int(zoom)
+        except ValueError:
+            return request.make_json_response({'error': 'Parámetros bbox/zoom inválidos'}, status=400)
+        data = request.env['herbario.collection.site'].sudo().get_map_clusters(
+            (west, south, east, north), zoom, provincia=provincia or None, familia=familia or None)
+        return request.make_json_response(data, headers=[
+            ('Cache-Control', f'public, max-age={MAP_CACHE_MAX_AGE}'),
+        ])
 
     # ==================== REPOSITORIO CON FILTROS ====================
     @http.route([
@@ -105,158 +112,190 @@ class HerbarioController(http.Controller):
     ], type='http', auth='public', website=True)
     def herbario_repository(self, page=1, search='', familia='', genero='', 
                            pais='', provincia='', localidad='', colector='', 
-                           autor='', sort='', **kwargs):
-        """Repositorio con filtros avanzados"""
-        
+                           autor='', sort='', cursor='', **kwargs):
+        """Repositorio con filtros avanzados (paginación por cursor)"""
+        url_args = {'search': search, 'familia': familia, 'genero': genero,
+                    'pais': pais, 'provincia': provincia, 'localidad': localidad,
+                    'colector': colector, 'autor': autor, 'sort': sort}
+        filters = {'familia': familia, 'genero': genero, 'autor': autor, 'pais': pais,
+                   'provincia': provincia, 'localidad': localidad, 'colector': colector}
+        if page > 1:
+            # Las URLs por número de página se sustituyeron por cursores: se traducen
+            # una vez al cursor equivalente (302, los enlaces antiguos no se cachean)
+            query, keys, sort_tag = self._repository_query(filters, search, sort)
+            cursor = request.env['herbario.keyset.pager'].sudo().cursor_at(
+                query, keys, (page - 1) * REPOSITORY_PER_PAGE, tag=sort_tag)
+            return request.redirect(self._listing_url('/herbario/repositorio', url_args, cursor), code=302)
+
+        def render():
+            result = self._repository_page(filters, search, sort, cursor, REPOSITORY_PER_PAGE)
+            
+            # Datos para filtros: valores con su número de especímenes bajo los filtros actuales
+            facets = request.env['herbario.facet.engine'].sudo().facet_counts(filters, text=search)
+            
+            values = dict(url_args, **{
+                'specimens': result['specimens'],
+                'total_results': result['total'],
+                'total_exact': result['total_exact'],
+                'keyset_pager': self._keyset_pager_urls('/herbario/repositorio', url_args, result),
+                'families': facets['familia'],
+                'genera': facets['genero'],
+                'countries': facets['pais'],
+                'provinces': facets['provincia'],
+                'collectors': facets['colector'],
+            })
+            return request.render('herbario_espoch.herbario_repository', values)
+        return self._cached_page([SURROGATE_ALL_SPECIMENS], render, cache_args=REPOSITORY_CACHE_ARGS)
+
+    def _repository_query(self, filters, search, sort):
+        """Consulta de especímenes con sus claves de orden y la etiqueta del orden para el cursor"""
         Specimen = request.env['herbario.specimen'].sudo()
-        
-        # Construir dominio de búsqueda
-        domain = [('es_publico', '=', True), ('status', '=', 'activo')]
-        
+        domain = request.env['herbario.facet.engine'].sudo().build_domain(filters)
+        # La búsqueda de texto usa el motor tsvector/trigramas
         if search:
-            domain += ['|', '|',
-                      ('nombre_cientifico', 'ilike', search),
-                      ('familia', 'ilike', search),
-                      ('genero', 'ilike', search)]
-        
-        if familia:
-            domain += [('familia', '=', familia)]
-        
-        if genero:
-            domain += [('genero', '=', genero)]
-        
-        if autor:
-            domain += [('autor_cientifico', 'ilike', autor)]
-        
-        # Filtros de ubicación
-        if pais or provincia or localidad or colector:
-            site_domain = []
-            if pais:
-                site_domain.append(('pais', '=', pais))
-            if provincia:
-                site_domain.append(('provincia', '=', provincia))
-            if localidad:
-                site_domain.append(('localidad', 'ilike', localidad))
-            if colector:
-                site_domain.append(('colector', 'ilike', colector))
-            
-            sites = request.env['herbario.collection.site'].sudo().search(site_domain)
-            specimen_ids = sites.mapped('specimen_id').ids
-            if specimen_ids:
-                domain += [('id', 'in', specimen_ids)]
-            else:
-                domain += [('id', '=', False)]  # No results
-        
-        # Ordenamiento
-        order = 'id desc'
-        if sort == 'date_asc':
-            order = 'id asc'
-        elif sort == 'name_asc':
-            order = 'nombre_cientifico asc'
-        elif sort == 'name_desc':
-            order = 'nombre_cientifico desc'
-        elif sort == 'code_asc':
-            order = 'codigo_herbario asc'
-        
-        # Obtener especímenes
-        specimens_count = Specimen.search_count(domain)
-        
-        # Paginación
-        per_page = 12
-        pager = request.website.pager(
-            url='/herbario/repositorio',
-            total=specimens_count,
-            page=page,
-            step=per_page,
-            url_args={'search': search, 'familia': familia, 'genero': genero,
-                     'pais': pais, 'provincia': provincia, 'localidad': localidad,
-                     'colector': colector, 'autor': autor, 'sort': sort}
-        )
-        
-        specimens = Specimen.search(domain, limit=per_page, offset=pager['offset'], order=order)
-        
-        # Datos para filtros
-        all_specimens = Specimen.search([('es_publico', '=', True), ('status', '=', 'activo')])
-        families = sorted(set(all_specimens.mapped('familia')))
-        genera = sorted(set(all_specimens.mapped('genero')))
-        
-        all_sites = request.env['herbario.collection.site'].sudo().search([])
-        countries = sorted(set(all_sites.mapped('pais')))
-        provinces = sorted(set(all_sites.mapped('provincia')))
-        collectors = sorted(set(all_sites.mapped('colector')))
-        
-        return request.render('herbario_espoch.herbario_repository', {
-            'specimens': specimens,
-            'total_results': specimens_count,
-            'pager': pager,
-            'search': search,
-            'familia': familia,
-            'genero': genero,
-            'pais': pais,
-            'provincia': provincia,
-            'localidad': localidad,
-            'colector': colector,
-            'autor': autor,
-            'sort': sort,
-            'families': families,
-            'genera': genera,
-            'countries': countries,
-            'provinces': provinces,
-            'collectors': collectors,
-        })
+            query, rank = request.env['herbario.search.engine'].sudo()._build_query(search, domain)
+        else:
+            query, rank = Specimen._search(domain), None
+        if search and not sort:
+            # Sin orden explícito se ordena por relevancia
+            return query, [(SQL("(%s)::float8", rank), 'desc'), ('id', 'desc')], 'relevance'
+        sort_tag = sort if sort in REPOSITORY_SORT_KEYS else ''
+        return query, REPOSITORY_SORT_KEYS[sort_tag], sort_tag
+
+    def _repository_page(self, filters, search, sort, cursor, limit, count_mode='auto'):
+        """Página de especímenes con su total (exacto o estimado según ``count_mode``)"""
+        Specimen = request.env['herbario.specimen'].sudo()
+        Pager = request.env['herbario.keyset.pager'].sudo()
+
+        total, total_exact = None, False
+        if count_mode != 'none':
+            total, total_exact = Pager.count(self._repository_query(filters, search, sort)[0], mode=count_mode)
+
+        query, keys, sort_tag = self._repository_query(filters, search, sort)
+        page = Pager.paginate(query, keys, cursor=cursor, limit=limit, tag=sort_tag)
+        return dict(page, specimens=Specimen.browse(page['ids']), total=total, total_exact=total_exact)
 
     # ==================== GALERÍA ====================
     @http.route([
         '/herbario/galeria',
         '/herbario/galeria/page/<int:page>'
     ], type='http', auth='public', website=True)
-    def herbario_gallery(self, page=1, search='', familia='', tipo_imagen='', **kwargs):
-        """Galería de imágenes con filtros"""
-        
-        Image = request.env['herbario.image'].sudo()
+    def herbario_gallery(self, page=1, search='', familia='', tipo_imagen='', cursor='', **kwargs):
+        """Galería de imágenes con filtros (paginación por cursor)"""
+        url_args = {'search': search, 'familia': familia, 'tipo_imagen': tipo_imagen}
+        if page > 1:
+            cursor = request.env['herbario.keyset.pager'].sudo().cursor_at(
+                request.env['herbario.image'].sudo()._search(self._gallery_domain(search, familia, tipo_imagen)),
+                [('id', 'desc')], (page - 1) * GALLERY_PER_PAGE)
+            return request.redirect(self._listing_url('/herbario/galeria', url_args, cursor), code=302)
         
-        # Construir dominio
-        domain = [('specimen_id.es_publico', '=', True), ('specimen_id.status', '=', 'activo')]
-        
-        if search:
-            domain += [('specimen_id.nombre_cientifico', 'ilike', search)]
-        
-        if familia:
-            domain += [('specimen_id.familia', '=', familia)]
-        
-        if tipo_imagen:
-            domain += [('image_type', '=', tipo_imagen)]
-        
-        # Contar imágenes
-        images_count = Image.search_count(domain)
-        
-        # Paginación
-        per_page = 20
-        pager = request.website.pager(
-            url='/herbario/galeria',
-            total=images_count,
-            page=page,
-            step=per_page,
-            url_args={'search': search, 'familia': familia, 'tipo_imagen': tipo_imagen}
-        )
-        
-        images = Image.search(domain, limit=per_page, offset=pager['offset'], order='id desc')
+        result = self._gallery_page(search, familia, tipo_imagen, cursor, GALLERY_PER_PAGE)
         
         # Datos para filtros
-        all_specimens = request.env['herbario.specimen'].sudo().search([
-            ('es_publico', '=', True), ('status', '=', 'activo')
-        ])
-        families = sorted(set(all_specimens.mapped('familia')))
+        families = request.env['herbario.taxon'].sudo().get_family_names(with_images=True)
+        if familia and familia not in families:
+            families = sorted(families + [familia], key=str.lower)
         
         return request.render('herbario_espoch.herbario_gallery', {
-            'images': images,
-            'pager': pager,
+            'images': result['images'],
+            'keyset_pager': self._keyset_pager_urls('/herbario/galeria', url_args, result),
             'search': search,
             'familia': familia,
             'tipo_imagen': tipo_imagen,
             'families': families,
         })
 
+    def _gallery_domain(self, search, familia, tipo_imagen):
+        """Imágenes publicadas (``is_published`` evita unir con el espécimen sin filtros)"""
+        domain = [('is_published', '=', True)]
+        if search:
+            domain += [('specimen_id.nombre_cientifico', 'ilike', search)]
+        if familia:
+            domain += [('specimen_id.familia', '=', familia)]
+        if tipo_imagen:
+            domain += [('image_type', '=', tipo_imagen)]
+        return domain
+
+    def _gallery_page(self, search, familia, tipo_imagen, cursor, limit, count_mode='none'):
+        """Página de imágenes publicadas"""
+        Image = request.env['herbario.image'].sudo()
+        Pager = request.env['herbario.keyset.pager'].sudo()
+        domain = self._gallery_domain(search, familia, tipo_imagen)
+
+        total, total_exact = None, False
+        if count_mode != 'none':
+            total, total_exact = Pager.count(Image._search(domain), mode=count_mode)
+        page = Pager.paginate(Image._search(domain), [('id', 'desc')], cursor=cursor, limit=limit)
+        return dict(page, images=Image.browse(page['ids']), total=total, total_exact=total_exact)
+
+    def _listing_url(self, url, url_args, cursor=None):
+        args = {key: value for key, value in url_args.items() if value}
+        if cursor:
+            args['cursor'] = cursor
+        return f'{url}?{urlencode(args)}' if args else url
+
+    def _keyset_pager_urls(self, url, url_args, page):
+        """Enlaces anterior/siguiente para la plantilla herbario_keyset_pager"""
+        return {
+            'prev_url': page['prev_cursor'] and self._listing_url(url, url_args, page['prev_cursor']),
+            'next_url': page['next_cursor'] and self._listing_url(url, url_args, page['next_cursor']),
+        }
+
+    def _api_limit(self, limit, default):
+        try:
+            return max(1, min(int(limit), API_MAX_LIMIT))
+        except (TypeError, ValueError):
+            return default
+
+    @http.route(['/herbario/api/specimens'], type='http', auth='public', methods=['GET'])
+    def herbario_api_specimens(self, search='', familia='', genero='', pais='', provincia='',
+                               localidad='', colector='', autor='', sort='', cursor='',
+                               limit=REPOSITORY_PER_PAGE, count='none', **kw):
+        """Listado JSON del repositorio con cursor (scroll infinito y clientes externos)"""
+        filters = {'familia': familia, 'genero': genero, 'autor': autor, 'pais': pais,
+                   'provincia': provincia, 'localidad': localidad, 'colector': colector}
+        limit = self._api_limit(limit, REPOSITORY_PER_PAGE)
+        result = self._repository_page(filters, search, sort, cursor, limit,
+                                       count_mode=count if count in COUNT_MODES else 'none')
+        return request.make_json_response({
+            'items': [{
+                'id': spec.id,
+                'codigo': spec.codigo_herbario,
+                'nombre_cientifico': spec.nombre_cientifico,
+                'familia': spec.familia,
+                'genero': spec.genero,
+                'url': f'/herbario/specimen/{spec.id}',
+                'thumbnail': spec.primary_image_id._get_image_url('thumb') if spec.primary_image_id else None,
+            } for spec in result['specimens']],
+            'next_cursor': result['next_cursor'],
+            'prev_cursor': result['prev_cursor'],
+            'total': result['total'],
+            'total_exact': result['total_exact'],
+        })
+
+    @http.route(['/herbario/api/images'], type='http', auth='public', methods=['GET'])
+    def herbario_api_images(self, search='', familia='', tipo_imagen='', cursor='',
+                            limit=GALLERY_PER_PAGE, count='none', **kw):
+        """Listado JSON de la galería con cursor"""
+        limit = self._api_limit(limit, GALLERY_PER_PAGE)
+        result = self._gallery_page(search, familia, tipo_imagen, cursor, limit,
+                                    count_mode=count if count in COUNT_MODES else 'none')
+        return request.make_json_response({
+            'items': [{
+                'id': image.id,
+                'specimen_id': image.specimen_id.id,
+                'nombre_cientifico': image.specimen_id.nombre_cientifico,
+                'image_type': image.image_type,
+                'thumbnail': image._get_image_url('thumb'),
+                'medium': image._get_image_url('medium'),
+                'full': image._get_image_url('full'),
+            } for image in result['images']],
+            'next_cursor': result['next_cursor'],
+            'prev_cursor': result['prev_cursor'],
+            'total': result['total'],
+            'total_exact': result['total_exact'],
+        })
+
     # ==================== DETALLE DE ESPÉCIMEN ====================
     
     @http.route(['/herbario/specimen/<int:specimen_id>'], type='http', auth='public', website=True)
@@ -273,51 +312,164 @@ class HerbarioController(http.Controller):
         if kw.get('from_qr'):
             qr_code = specimen.qr_code_id.filtered(lambda qr: not qr.obsolete)
             if qr_code:
-                qr_code.register_scan()
-        
-        # Especímenes relacionados (misma familia)
-        related_specimens = Specimen.search([
-            ('familia', '=', specimen.familia),
-            ('id', '!=', specimen.id),
-            ('es_publico', '=', True),
-            ('status', '=', 'activo')
-        ], limit=4)
-        
-        return request.render('herbario_espoch.herbario_specimen_detail', {
-            'specimen': specimen,
-            'related_specimens': related_specimens,
-        })
+                qr_code.register_scan(
+                    ip_address=request.httprequest.remote_addr,
+                    user_agent=(request.httprequest.user_agent.string or '')[:255],
+                )
+        
+        def render():
+            # Especímenes relacionados (precalculados por similitud dentro de la familia)
+            related_specimens = request.env['herbario.related.engine'].sudo().get_related(specimen.id)
+            
+            return request.render('herbario_espoch.herbario_specimen_detail', {
+                'specimen': specimen,
+                'related_specimens': related_specimens,
+            })
+        surrogate_keys = [specimen_surrogate_key(specimen.id)]
+        if specimen.familia:
+            surrogate_keys.append(family_surrogate_key(specimen.familia))
+        return self._cached_page(surrogate_keys, render)
+
+    # ==================== CACHÉ DE PÁGINAS ====================
+
+    def _page_cacheable(self):
+        """Solo visitantes anónimos con GET: el HTML no depende de la sesión"""
+        return (request.httprequest.method == 'GET'
+                and request.env.user._is_public()
+                and not request.session.debug)
+
+    def _page_cache_headers(self, etag):
+        # El navegador revalida siempre; con el ETag la respuesta suele ser un 304
+        return [('ETag', f'"{etag}"'), ('Cache-Control', 'public, no-cache')]
+
+    def _cached_page(self, surrogate_keys, render, cache_args=()):
+        """
+        Sirve una página pública desde la caché compartida
+
+        La clave es ruta + argumentos de ``cache_args`` + idioma + sitio web. Una
+        página en caché se sirve (o se responde 304 si coincide
+        ``If-None-Match``) sin consultas al ORM ni QWeb. Si no está, se
+        renderiza y se guarda con sus claves sustitutas, que las escrituras de
+        los modelos invalidan; el ETag es el hash del HTML guardado, en el que el
+        token CSRF de la sesión se sustituye por un marcador.
+        """
+        if not self._page_cacheable():
+            return render()
+        PageCache = request.env['herbario.page.cache'].sudo()
+        cache_key = PageCache._make_key(request.httprequest.path, request.httprequest.args,
+                                        request.lang.code, request.website.id, cache_args)
+        if_none_match = request.httprequest.if_none_match
+        csrf_token = request.csrf_token()
+
+        cached = PageCache._get(cache_key)
+        if cached:
+            etag, html = cached
+            if if_none_match.contains(etag):
+                return request.make_response('', headers=self._page_cache_headers(etag), status=304)
+            return request.make_response(
+                html.replace(CSRF_PLACEHOLDER, csrf_token),
+                headers=self._page_cache_headers(etag) + [('Content-Type', 'text/html; charset=utf-8')],
+            )
+
+        # Instantánea con la que se renderiza: el guardado se descarta si otra
+        # transacción invisible para ella invalidó la página
+        snapshot = PageCache._get_snapshot()
+        response = render()
+        if response.status_code != 200 or not response.is_qweb:
+            return response
+        response.flatten()
+        html = response.get_data(as_text=True).replace(csrf_token, CSRF_PLACEHOLDER)
+        etag = PageCache._make_etag(html)
+        PageCache._store(cache_key, etag, html, surrogate_keys, snapshot)
+        if if_none_match.contains(etag):
+            return request.make_response('', headers=self._page_cache_headers(etag), status=304)
+        response.headers.update(self._page_cache_headers(etag))
+        return response
+
+    # ==================== IMÁGENES ====================
+
+    @http.route([
+        '/herbario/image/<int:image_id>/<string:variant>',
+        '/herbario/image/<int:image_id>/<string:variant>/<string:unique>',
+    ], type='http', auth='public', methods=['GET'])
+    def herbario_image(self, image_id, variant='medium', unique=None, **kw):
+        """Sirve una variante (thumb, medium, full) de una imagen con ETag y caché HTTP"""
+        field_name = IMAGE_VARIANT_FIELDS.get(variant)
+        if not field_name:
+            raise NotFound()
+        image = self._get_public_image(image_id)
+
+        # Mientras la cola genera la miniatura se sirve un marcador sin caché
+        ready = variant == 'full' or image._derivatives_ready()
+        max_age = IMAGE_CACHE_MAX_AGE if ready else 0
+
+        # El ETag se deriva del hash del contenido: se responde 304 sin leer el binario
+        etag = f'{image.file_hash or image.id}-{variant}' + ('' if ready else '-pending')
+        immutable = ready and bool(unique) and unique == image.file_hash
+        if request.httprequest.if_none_match.contains(etag):
+            cache_control = f'public, max-age={31536000 if immutable else max_age}'
+            if immutable:
+                cache_control += ', immutable'
+            return request.make_response('', headers=[
+                ('ETag', f'"{etag}"'),
+                ('Cache-Control', cache_control),
+            ], status=304)
+
+        stream = request.env['ir.binary']._get_image_stream_from(
+            image, field_name, placeholder='web/static/img/placeholder.png')
+        stream.etag = etag
+        stream.public = True
+        stream.max_age = max_age
+        return stream.get_response(immutable=immutable)
+
+    @http.route(['/herbario/image/<int:image_id>/tiles/<string:unique>/info.json'],
+                type='http', auth='public', methods=['GET'])
+    def herbario_image_tiles_info(self, image_id, unique, **kw):
+        """Descriptor de la pirámide de teselas para el visor de zoom"""
+        image = self._get_public_image(image_id)
+        if not image.has_tiles or unique != image.file_hash:
+            raise NotFound()
+        return request.make_json_response(image._get_tiles_info(), headers=[
+            ('Cache-Control', 'public, max-age=31536000, immutable'),
+        ])
+
+    @http.route(['/herbario/image/<int:image_id>/tiles/<string:unique>/<int:level>/<int:col>_<int:row>.jpg'],
+                type='http', auth='public', methods=['GET'])
+    def herbario_image_tile(self, image_id, unique, level, col, row, **kw):
+        """Sirve una tesela de la pirámide; la URL incluye el hash, por lo que es inmutable"""
+        image = self._get_public_image(image_id)
+        if not image.has_tiles or unique != image.file_hash:
+            raise NotFound()
+
+        etag = f'{image.file_hash}-{level}-{col}-{row}'
+        headers = [
+            ('ETag', f'"{etag}"'),
+            ('Cache-Control', 'public, max-age=31536000, immutable'),
+        ]
+        if request.httprequest.if_none_match.contains(etag):
+            return request.make_response('', headers=headers, status=304)
+
+        tile_path = os.path.join(image._get_tile_dir(), str(level), f'{col}_{row}.jpg')
+        if not os.path.isfile(tile_path):
+            raise NotFound()
+        with open(tile_path, 'rb') as tile_file:
+            data = tile_file.read()
+        return request.make_response(data, headers=headers + [('Content-Type', 'image/jpeg')])
+
+    def _get_public_image(self, image_id):
+        """Imagen visible en el portal público o 404"""
+        image = request.env['herbario.image'].sudo().browse(image_id).exists()
+        if (not image or image.deleted_at
+                or not image.specimen_id.es_publico or image.specimen_id.status != 'activo'):
+            raise NotFound()
+        return image
 
     # ==================== BÚSQUEDA AJAX ====================
     
     @http.route(['/herbario/api/search'], type='json', auth='public', methods=['POST'])
     def herbario_api_search(self, query, limit=10):
         """API de búsqueda para autocompletado"""
-        Specimen = request.env['herbario.specimen'].sudo()
-        
-        domain = [
-            ('es_publico', '=', True),
-            ('status', '=', 'activo'),
-            '|', '|', '|',
-            ('nombre_cientifico', 'ilike', query),
-            ('familia', 'ilike', query),
-            ('genero', 'ilike', query),
-            ('especie', 'ilike', query)
-        ]
-        
-        specimens = Specimen.search(domain, limit=limit)
-        
-        results = []
-        for spec in specimens:
-            results.append({
-                'id': spec.id,
-                'nombre_cientifico': spec.nombre_cientifico,
-                'familia': spec.familia,
-                'codigo': spec.codigo_herbario,
-                'url': f'/herbario/specimen/{spec.id}'
-            })
-        
-        return results
+        return request.env['herbario.search.engine'].sudo().autocomplete(query, limit=limit)
 
     # ==================== ABOUT ====================
     
@@ -331,87 +483,172 @@ class HerbarioController(http.Controller):
     @http.route(['/herbario/api/export/<string:format>'], type='http', auth='user', methods=['GET'])
     def herbario_export_data(self, format='csv', familia=None, **kw):
         """Exporta datos del herbario (requiere login)"""
-        Specimen = request.env['herbario.specimen'].sudo()
-        
         domain = [('es_publico', '=', True), ('status', '=', 'activo')]
         if familia:
             domain.append(('familia', '=', familia))
         
-        specimens = Specimen.search(domain, order='codigo_herbario asc')
-        
         if format == 'csv':
-            return self._export_csv(specimens)
+            return self._export_csv(domain)
         elif format == 'json':
-            return self._export_json(specimens)
+            return self._export_json(domain)
         else:
             return request.redirect('/herbario/repositorio')
 
-    def _export_csv(self, specimens):
-        """Exporta a CSV"""
-        import csv
-        from io import StringIO
-        
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Encabezados
-        headers = ['Código', 'Nombre Científico', 'Familia', 'Género', 'Especie', 
-                  'Autor', 'Determinado Por', 'Descripción']
-        writer.writerow(headers)
-        
-        # Datos
-        for spec in specimens:
-            writer.writerow([
-                spec.codigo_herbario,
-                spec.nombre_cientifico,
-                spec.familia,
-                spec.genero,
-                spec.especie,
-                spec.autor_cientifico or '',
-                spec.determinado_por or '',
-                spec.descripcion_especie or ''
-            ])
-        
-        content = output.getvalue()
-        output.close()
+    def _iter_export_batches(self, registry, uid, context, domain, with_sites=True):
+        """
+        Genera lotes (especímenes, ubicaciones por espécimen) para la exportación
+
+        La respuesta se envía después de cerrar la petición, cuando ``request`` ya
+        no está disponible: el registro, el usuario y el contexto se leen al
+        construir la respuesta y aquí solo se abre un cursor propio. Cada lote se
+        lee con una consulta de especímenes y otra de ubicaciones (omitida con
+        ``with_sites=False``), y se vacía la caché entre lotes para mantener la
+        memoria constante.
+        """
+        with registry.cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            Specimen = env['herbario.specimen'].sudo()
+            CollectionSite = env['herbario.collection.site'].sudo()
+            specimen_ids = Specimen.search(domain, order='codigo_herbario asc').ids
+            for batch_ids in split_every(EXPORT_BATCH_SIZE, specimen_ids):
+                specimens = Specimen.browse(batch_ids).read(EXPORT_SPECIMEN_FIELDS)
+                sites_by_specimen = defaultdict(list)
+                if with_sites:
+                    for site in CollectionSite.search_read([('specimen_id', 'in', list(batch_ids))],
+                                                           EXPORT_SITE_FIELDS + ['specimen_id'],
+                                                           order='id', load=None):
+                        sites_by_specimen[site['specimen_id']].append(site)
+                yield specimens, sites_by_specimen
+                env.invalidate_all()
+
+    def _stream_export(self, chunks, content_type, filename):
+        """Respuesta por bloques, comprimida con gzip al vuelo si el cliente lo acepta"""
+        headers = [
+            ('Content-Type', content_type),
+            ('Content-Disposition', f'attachment; filename={filename}'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if 'gzip' in request.httprequest.accept_encodings:
+            headers.append(('Content-Encoding', 'gzip'))
+            chunks = self._gzip_chunks(chunks)
+        return request.make_response(chunks, headers=headers)
+
+    def _gzip_chunks(self, chunks):
+        """Comprime cada bloque y lo vacía de inmediato para no retrasar el primer byte"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _export_batches(self, domain, with_sites=True):
+        """Lotes de exportación ligados al entorno de la petición actual"""
+        env = request.env
+        return self._iter_export_batches(env.registry, env.uid, dict(env.context), domain, with_sites=with_sites)
+
+    def _export_csv(self, domain):
+        """Exporta a CSV (solo columnas del espécimen: no se leen ubicaciones)"""
+        batches = self._export_batches(domain, with_sites=False)
+
+        def generate():
+            output = StringIO()
+            writer = csv.writer(output)
+            
+            # Encabezados
+            headers = ['Código', 'Nombre Científico', 'Familia', 'Género', 'Especie', 
+                      'Autor', 'Determinado Por', 'Descripción']
+            writer.writerow(headers)
+            
+            # Datos
+            for specimens, _sites in batches:
+                for spec in specimens:
+                    writer.writerow([
+                        spec['codigo_herbario'],
+                        spec['nombre_cientifico'],
+                        spec['familia'],
+                        spec['genero'],
+                        spec['especie'],
+                        spec['autor_cientifico'] or '',
+                        spec['determinado_por'] or '',
+                        spec['descripcion_especie'] or ''
+                    ])
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate()
+            
+            remaining = output.getvalue()
+            if remaining:
+                yield remaining.encode('utf-8')
         
-        return request.make_response(
-            content,
-            headers=[
-                ('Content-Type', 'text/csv'),
-                ('Content-Disposition', 'attachment; filename=herbario_espoch.csv')
-            ]
-        )
+        return self._stream_export(generate(), 'text/csv', 'herbario_espoch.csv')
 
-    def _export_json(self, specimens):
+    def _export_json(self, domain):
         """Exporta a JSON"""
-        data = []
-        for spec in specimens:
-            data.append({
-                'codigo_herbario': spec.codigo_herbario,
-                'nombre_cientifico': spec.nombre_cientifico,
-                'familia': spec.familia,
-                'genero': spec.genero,
-                'especie': spec.especie,
-                'autor_cientifico': spec.autor_cientifico,
-                'determinado_por': spec.determinado_por,
-                'descripcion_especie': spec.descripcion_especie,
-                'ubicaciones': [{
-                    'localidad': loc.localidad,
-                    'provincia': loc.provincia,
-                    'pais': loc.pais,
-                    'latitud': loc.latitud,
-                    'longitud': loc.longitud,
-                    'colector': loc.colector,
-                    'fecha_recoleccion': str(loc.fecha_recoleccion) if loc.fecha_recoleccion else None
-                } for loc in spec.collection_site_ids]
-            })
-        
-        return request.make_response(
-            json.dumps(data, indent=2),
-            headers=[
-                ('Content-Type', 'application/json'),
-                ('Content-Disposition', 'attachment; filename=herbario_espoch.json')
-            ]
+        batches = self._export_batches(domain)
+
+        def generate():
+            yield b'['
+            first = True
+            for specimens, sites_by_specimen in batches:
+                items = []
+                for spec in specimens:
+                    items.append(json.dumps({
+                        'codigo_herbario': spec['codigo_herbario'],
+                        'nombre_cientifico': spec['nombre_cientifico'],
+                        'familia': spec['familia'],
+                        'genero': spec['genero'],
+                        'especie': spec['especie'],
+                        'autor_cientifico': spec['autor_cientifico'],
+                        'determinado_por': spec['determinado_por'],
+                        'descripcion_especie': spec['descripcion_especie'],
+                        'ubicaciones': [{
+                            'localidad': loc['localidad'],
+                            'provincia': loc['provincia'],
+                            'pais': loc['pais'],
+                            'latitud': loc['latitud'],
+                            'longitud': loc['longitud'],
+                            'colector': loc['colector'],
+                            'fecha_recoleccion': str(loc['fecha_recoleccion']) if loc['fecha_recoleccion'] else None
+                        } for loc in sites_by_specimen[spec['id']]]
+                    }, indent=2))
+                if items:
+                    yield (('' if first else ',\n') + ',\n'.join(items)).encode('utf-8')
+                    first = False
+            yield b']'
+        
+        return self._stream_export(generate(), 'application/json', 'herbario_espoch.json')
+
+    # ==================== DARWIN CORE ARCHIVE ====================
+
+    @http.route(['/herbario/dwca/<int:export_id>/dwca.zip'], type='http', auth='user', methods=['GET'])
+    def herbario_dwca_download(self, export_id, **kw):
+        """Descarga un archivo generado (según los permisos de herbario.dwca.export)"""
+        export = request.env['herbario.dwca.export'].browse(export_id).exists()
+        if not export or export.state != 'done':
+            raise NotFound()
+        return self._dwca_response(export)
+
+    @http.route(['/herbario/dwca/latest.zip'], type='http', auth='public', methods=['GET'])
+    def herbario_dwca_latest(self, **kw):
+        """Último archivo publicado, para la recolección periódica de GBIF/IPT"""
+        export = request.env['herbario.dwca.export'].sudo()._get_last_export()
+        if not export:
+            raise NotFound()
+        return self._dwca_response(export)
+
+    def _dwca_response(self, export):
+        """El archivo se envía desde disco por bloques (o X-Sendfile si está configurado)"""
+        if not export.file_path or not os.path.isfile(export.file_path):
+            raise NotFound()
+        stream = http.Stream(
+            type='path',
+            path=export.file_path,
+            mimetype='application/zip',
+            download_name=f'herbario_espoch_dwca_{export.export_date.strftime("%Y%m%d")}.zip',
+            size=export.file_size,
+            last_modified=export.write_date,
+            etag=f'dwca-{export.id}-{export.file_size}',
+            public=True,
         )
-    
+        return stream.get_response(as_attachment=True)
@@ -0,0 +1,72 @@
+from odoo import http
+from odoo.exceptions import ValidationError
+from odoo.http import request
+from werkzeug.exceptions import BadRequest, NotFound
+
+
+class HerbarioUploadController(http.Controller):
+    """
+    API de subida por bloques reanudable para imágenes de especímenes
+
+    1. ``/herbario/upload/start`` crea la sesión y devuelve su token.
+    2. ``/herbario/upload/<token>/chunk?offset=N`` recibe cada bloque como cuerpo
+       binario (cabecera opcional ``X-Chunk-Sha256``, ``csrf_token`` en la URL).
+    3. ``/herbario/upload/<token>/status`` indica cuántos bytes se recibieron,
+       para reanudar tras un corte.
+    4. ``/herbario/upload/<token>/complete`` crea la imagen desde el archivo en disco.
+    """
+
+    def _get_session(self, token):
+        """Sesión del usuario actual; los modelos se usan con sudo tras validar el propietario"""
+        session = request.env['herbario.upload.session'].sudo().search([('token', '=', token)], limit=1)
+        if not session or session.user_id != request.env.user:
+            raise NotFound()
+        return session
+
+    @http.route(['/herbario/upload/start'], type='json', auth='user', methods=['POST'])
+    def herbario_upload_start(self, specimen_id, filename, total_size, description=None, image_type='general'):
+        """Inicia una sesión de subida"""
+        # Solo usuarios con permiso de creación de imágenes pueden subir
+        request.env['herbario.image'].check_access_rights('create')
+        specimen = request.env['herbario.specimen'].browse(int(specimen_id)).exists()
+        if not specimen:
+            raise NotFound()
+        # Reglas de registro del usuario (p. ej. estudiantes solo sobre sus especímenes)
+        specimen.check_access_rule('write')
+        session = request.env['herbario.upload.session'].sudo().create({
+            'user_id': request.env.user.id,
+            'specimen_id': specimen.id,
+            'filename': filename,
+            'description': description,
+            'image_type': image_type,
+            'total_size': int(total_size),
+        })
+        return session._get_status()
+
+    @http.route(['/herbario/upload/<string:token>/chunk'], type='http', auth='user', methods=['POST', 'PUT'])
+    def herbario_upload_chunk(self, token, offset=0, **kw):
+        """Recibe un bloque; el cuerpo se escribe en disco por partes, sin cargarlo completo"""
+        session = self._get_session(token)
+        length = request.httprequest.content_length
+        if length is None:
+            raise BadRequest('Content-Length requerido')
+        try:
+            status = session.append_chunk(
+                int(offset),
+                request.httprequest.stream,
+                length,
+                checksum=request.httprequest.headers.get('X-Chunk-Sha256'),
+            )
+        except ValidationError as e:
+            return request.make_json_response({'error': str(e), **session._get_status()}, status=409)
+        return request.make_json_response(status)
+
+    @http.route(['/herbario/upload/<string:token>/status'], type='json', auth='user', methods=['POST'])
+    def herbario_upload_status(self, token):
+        """Estado de la sesión para reanudar la subida"""
+        return self._get_session(token)._get_status()
+
+    @http.route(['/herbario/upload/<string:token>/complete'], type='json', auth='user', methods=['POST'])
+    def herbario_upload_complete(self, token):
+        """Finaliza la subida y crea la imagen del espécimen"""
+        return self._get_session(token).complete()
@@ -1,7 +1,19 @@
+from . import search_engine
+from . import facet_engine
+from . import keyset_pager
 from . import specimen_registry
 from . import collection_site
 from . import image
+from . import taxon
+from . import image_job
+from . import statistics_cube
+from . import related_engine
+from . import page_cache
+from . import upload_session
+from . import dwca_export
+from . import import_job
 from . import scan_log
 from . import qr_code
+from . import qr_batch
 from . import history_log
 from . import res_users
\ No newline at end of file
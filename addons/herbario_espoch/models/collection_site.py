@@ -1,5 +1,44 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import column_exists, create_index, index_exists
+from .search_engine import SITE_SEARCH_FIELDS
+from .statistics_cube import STATS_SITE_FIELDS
+from .related_engine import RELATED_SITE_FIELDS
+import math
+
+# Tamaño en píxeles de la celda de agrupación del mapa
+MAP_CLUSTER_CELL_PX = 60
+MAP_TILE_PX = 256
+MAP_MAX_ZOOM = 20
+# Máximo de celdas devueltas (una pantalla completa tiene unas pocas centenas)
+MAP_MAX_CELLS = 2000
+# Límite de latitud de la proyección web mercator
+MERCATOR_MAX_LATITUDE = 85.0511287798
+
+# Índices compuestos para los filtros de ubicación del repositorio
+SITE_FILTER_INDEXES = [
+    ['specimen_id', 'provincia'],
+    ['specimen_id', 'pais'],
+    ['provincia', 'specimen_id'],
+    ['pais', 'specimen_id'],
+]
+# Columnas filtradas con ilike (índice GIN de trigramas si pg_trgm está disponible)
+SITE_TRIGRAM_COLUMNS = ['localidad', 'colector']
+
+
+def lnglat_to_mercator(lng, lat):
+    """Coordenadas web mercator normalizadas a [0, 1] (y crece hacia el sur)"""
+    lat = max(min(lat, MERCATOR_MAX_LATITUDE), -MERCATOR_MAX_LATITUDE)
+    x = (lng + 180.0) / 360.0
+    lat_rad = math.radians(lat)
+    y = (1 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi) / 2
+    return x, y
+
+
+def mercator_to_lnglat(x, y):
+    lng = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lng, lat
 
 
 class CollectionSite(models.Model):
@@ -115,6 +154,108 @@ class CollectionSite(models.Model):
         store=True
     )
 
+    def init(self):
+        """
+        Columna generada ``geo_point`` (posición web mercator normalizada) con
+        índice GiST para las consultas por área visible del mapa, e índices de los
+        filtros de ubicación del repositorio
+        """
+        cr = self.env.cr
+        if not column_exists(cr, self._table, 'geo_point'):
+            cr.execute(f"""
+                ALTER TABLE {self._table} ADD COLUMN geo_point point GENERATED ALWAYS AS (
+                    CASE WHEN coalesce(latitud, 0) = 0 OR coalesce(longitud, 0) = 0 THEN NULL
+                    ELSE point(
+                        (longitud::float8 + 180.0) / 360.0,
+                        (1 - ln(tan(radians(greatest(least(latitud::float8, {MERCATOR_MAX_LATITUDE}), -{MERCATOR_MAX_LATITUDE})))
+                                + 1 / cos(radians(greatest(least(latitud::float8, {MERCATOR_MAX_LATITUDE}), -{MERCATOR_MAX_LATITUDE}))))
+                             / pi()) / 2
+                    ) END
+                ) STORED
+            """)
+        if not index_exists(cr, f'{self._table}_geo_point_idx'):
+            cr.execute(f"CREATE INDEX {self._table}_geo_point_idx ON {self._table} USING gist (geo_point)")
+
+        # Filtros de ubicación: el semi-join desde el espécimen sondea por
+        # (specimen_id, campo) y los filtros por provincia/país recorren (campo, specimen_id)
+        for columns in SITE_FILTER_INDEXES:
+            index_name = f"{self._table}_{'_'.join(columns)}_idx"
+            if not index_exists(cr, index_name):
+                create_index(cr, index_name, self._table, columns)
+        # pg_trgm se instala en el init de herbario.specimen (motor de búsqueda)
+        cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cr.fetchone():
+            for column in SITE_TRIGRAM_COLUMNS:
+                index_name = f'{self._table}_{column}_trgm_idx'
+                if not index_exists(cr, index_name):
+                    create_index(cr, index_name, self._table, [f'"{column}" gin_trgm_ops'], method='gin')
+
+    @api.model
+    def get_map_clusters(self, bbox, zoom, provincia=None, familia=None):
+        """
+        Ubicaciones públicas dentro del área visible agrupadas en una cuadrícula
+
+        ``bbox`` es (oeste, sur, este, norte) en grados. Las celdas miden
+        MAP_CLUSTER_CELL_PX píxeles en el nivel de zoom indicado y están alineadas
+        a una cuadrícula global, de modo que los grupos no cambian al desplazar el
+        mapa. El resultado crece con lo que se ve en pantalla, no con la colección.
+        """
+        west, south, east, north = bbox
+        zoom = max(0, min(int(zoom), MAP_MAX_ZOOM))
+        x1, y1 = lnglat_to_mercator(west, north)
+        x2, y2 = lnglat_to_mercator(east, south)
+        cell = MAP_CLUSTER_CELL_PX / (MAP_TILE_PX * 2 ** zoom)
+
+        where = ["cs.geo_point <@ box(point(%s, %s), point(%s, %s))",
+                 "s.es_publico", "s.status = 'activo'"]
+        params = [x1, y1, x2, y2]
+        if provincia:
+            where.append("cs.provincia = %s")
+            params.append(provincia)
+        if familia:
+            where.append("s.familia = %s")
+            params.append(familia)
+
+        self.flush_model()
+        self.env.cr.execute(f"""
+            SELECT count(*), avg(cs.geo_point[0]), avg(cs.geo_point[1]), min(cs.id)
+              FROM herbario_collection_site cs
+              JOIN herbario_specimen s ON s.id = cs.specimen_id
+             WHERE {' AND '.join(where)}
+          GROUP BY floor(cs.geo_point[0] / %s), floor(cs.geo_point[1] / %s)
+             LIMIT {MAP_MAX_CELLS}
+        """, params + [cell, cell])
+
+        clusters = []
+        single_site_ids = []
+        for count, x, y, site_id in self.env.cr.fetchall():
+            if count == 1:
+                single_site_ids.append(site_id)
+                continue
+            lng, lat = mercator_to_lnglat(x, y)
+            clusters.append({'lat': lat, 'lng': lng, 'count': count})
+
+        # Las celdas con una sola ubicación se devuelven como punto con su información
+        if single_site_ids:
+            self.env.cr.execute("""
+                SELECT cs.id, cs.latitud::float8, cs.longitud::float8, cs.localidad, cs.provincia, s.id, s.nombre_cientifico
+                  FROM herbario_collection_site cs
+                  JOIN herbario_specimen s ON s.id = cs.specimen_id
+                 WHERE cs.id IN %s
+            """, [tuple(single_site_ids)])
+            for site_id, lat, lng, localidad, site_provincia, specimen_id, name in self.env.cr.fetchall():
+                clusters.append({
+                    'id': site_id,
+                    'lat': lat,
+                    'lng': lng,
+                    'count': 1,
+                    'name': name,
+                    'locality': localidad,
+                    'provincia': site_provincia,
+                    'url': f'/herbario/specimen/{specimen_id}',
+                })
+        return {'zoom': zoom, 'clusters': clusters}
+
     @api.depends('localidad', 'provincia', 'pais')
     def _compute_ubicacion_completa(self):
         """Genera una cadena con la ubicación completa"""
@@ -160,38 +301,54 @@ class CollectionSite(models.Model):
             if record.altitud and (record.altitud < -500 or record.altitud > 9000):
                 raise ValidationError('La altitud debe estar entre -500 y 9000 m.s.n.m.')
 
-    @api.model
-    def create(self, vals):
-        """Override para registrar en historial y manejar ubicación principal"""
+    @api.model_create_multi
+    def create(self, vals_list):
+        """
+        Override para registrar en historial y manejar ubicación principal
+
+        Admite lotes (importación masiva): las ubicaciones existentes y las
+        principales a desmarcar se resuelven con una consulta para todo el lote.
+        """
+        specimen_ids = list({vals['specimen_id'] for vals in vals_list if vals.get('specimen_id')})
+        with_sites = set()
+        if specimen_ids:
+            with_sites = {specimen.id for [specimen] in self._read_group(
+                [('specimen_id', 'in', specimen_ids)], ['specimen_id'])}
         # Si es la primera ubicación del espécimen, marcarla como principal
-        if vals.get('specimen_id'):
-            existing_sites = self.search([('specimen_id', '=', vals['specimen_id'])])
-            if not existing_sites:
+        for vals in vals_list:
+            if vals.get('specimen_id') and vals['specimen_id'] not in with_sites:
                 vals['is_primary'] = True
+                with_sites.add(vals['specimen_id'])
         
-        # Si se marca como principal, desmarcar las demás
-        if vals.get('is_primary') and vals.get('specimen_id'):
+        # Si se marca como principal, desmarcar las demás (en el lote gana la última)
+        primary_specimen_ids = set()
+        for vals in reversed(vals_list):
+            if vals.get('is_primary') and vals.get('specimen_id'):
+                if vals['specimen_id'] in primary_specimen_ids:
+                    vals['is_primary'] = False
+                primary_specimen_ids.add(vals['specimen_id'])
+        if primary_specimen_ids:
             self.search([
-                ('specimen_id', '=', vals['specimen_id']),
+                ('specimen_id', 'in', list(primary_specimen_ids)),
                 ('is_primary', '=', True)
             ]).write({'is_primary': False})
         
-        record = super(CollectionSite, self).create(vals)
+        records = super(CollectionSite, self).create(vals_list)
         
         # Registrar en historial
-        self.env['herbario.history.log'].create({
+        self.env['herbario.history.log']._buffer_entries([{
             'specimen_id': record.specimen_id.id,
             'entity_type': 'collection_site',
             'entity_id': record.id,
             'action_type': 'location_added',
-            'field_modified': None,
-            'old_value': None,
             'new_value': f'Nueva ubicación: {record.ubicacion_completa}',
-            'user_id': self.env.user.id,
-            'user_name': self.env.user.name,
-        })
+        } for record in records])
+        self.env['herbario.search.engine'].refresh_documents(records.specimen_id.ids)
+        self.env['herbario.statistics.cube'].refresh_specimens(records.specimen_id.ids)
+        self.env['herbario.related.engine'].refresh_specimens(records.specimen_id.ids)
+        self.env['herbario.page.cache']._invalidate_specimens(records.specimen_id)
         
-        return record
+        return records
 
     def write(self, vals):
         """Override para manejar cambio de ubicación principal"""
@@ -204,7 +361,30 @@ class CollectionSite(models.Model):
                     ('is_primary', '=', True)
                 ]).write({'is_primary': False})
         
-        return super(CollectionSite, self).write(vals)
+        specimen_ids = set(self.mapped('specimen_id').ids)
+        self.env['herbario.page.cache']._invalidate_specimens(self.specimen_id)
+        res = super(CollectionSite, self).write(vals)
+        if 'specimen_id' in vals:
+            self.env['herbario.page.cache']._invalidate_specimens(self.specimen_id)
+        if any(field in vals for field in SITE_SEARCH_FIELDS + STATS_SITE_FIELDS):
+            specimen_ids.update(self.mapped('specimen_id').ids)
+        if any(field in vals for field in SITE_SEARCH_FIELDS):
+            self.env['herbario.search.engine'].refresh_documents(list(specimen_ids))
+        if any(field in vals for field in STATS_SITE_FIELDS):
+            self.env['herbario.statistics.cube'].refresh_specimens(specimen_ids)
+        if any(field in vals for field in RELATED_SITE_FIELDS):
+            self.env['herbario.related.engine'].refresh_specimens(specimen_ids)
+        return res
+
+    def unlink(self):
+        """Override para actualizar el documento de búsqueda y las estadísticas del espécimen"""
+        specimen_ids = self.mapped('specimen_id').ids
+        self.env['herbario.page.cache']._invalidate_specimens(self.specimen_id)
+        res = super(CollectionSite, self).unlink()
+        self.env['herbario.search.engine'].refresh_documents(specimen_ids)
+        self.env['herbario.statistics.cube'].refresh_specimens(specimen_ids)
+        self.env['herbario.related.engine'].refresh_specimens(specimen_ids)
+        return res
 
     def action_set_as_primary(self):
         """Acción para marcar como ubicación principal"""
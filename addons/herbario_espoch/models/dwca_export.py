@@ -0,0 +1,422 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import config, split_every
+from datetime import timedelta
+from xml.sax.saxutils import escape, quoteattr
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+_logger = logging.getLogger(__name__)
+
+DWC = 'http://rs.tdwg.org/dwc/terms/'
+DC = 'http://purl.org/dc/terms/'
+
+# Términos de la extensión núcleo (Occurrence); la columna 0 es el id del espécimen
+OCCURRENCE_TERMS = [
+    ('occurrenceID', DWC), ('basisOfRecord', DWC), ('institutionCode', DWC),
+    ('collectionCode', DWC), ('catalogNumber', DWC), ('scientificName', DWC),
+    ('scientificNameAuthorship', DWC), ('family', DWC), ('genus', DWC),
+    ('specificEpithet', DWC), ('identifiedBy', DWC), ('reproductiveCondition', DWC),
+    ('recordedBy', DWC), ('recordNumber', DWC), ('eventDate', DWC), ('country', DWC),
+    ('stateProvince', DWC), ('county', DWC), ('locality', DWC), ('decimalLatitude', DWC),
+    ('decimalLongitude', DWC), ('geodeticDatum', DWC), ('minimumElevationInMeters', DWC),
+    ('maximumElevationInMeters', DWC), ('modified', DC),
+]
+# Extensión GBIF Simple Multimedia; la columna 0 es el id del espécimen (coreid)
+MULTIMEDIA_TERMS = [
+    ('type', DC), ('format', DC), ('identifier', DC), ('references', DC),
+    ('title', DC), ('created', DC), ('creator', DC),
+]
+OCCURRENCE_ROW_TYPE = 'http://rs.tdwg.org/dwc/terms/Occurrence'
+MULTIMEDIA_ROW_TYPE = 'http://rs.gbif.org/terms/1.0/Multimedia'
+
+INSTITUTION_CODE = 'ESPOCH'
+COLLECTION_CODE = 'CHEP'
+DWCA_BATCH_SIZE = 500
+COPY_BLOCK_SIZE = 1024 * 1024
+# Archivos generados que se conservan en disco (el más reciente sirve de base al incremental)
+DWCA_KEEP_ARCHIVES = 5
+# ``write_date`` es el inicio de la transacción que escribe: una transacción que
+# empezó antes del corte pero confirmó después no entra en el archivo base, así
+# que el incremental vuelve a revisar este margen antes del corte
+DWCA_CHANGE_OVERLAP = timedelta(minutes=15)
+
+SPECIMEN_FIELDS = ['codigo_herbario', 'nombre_cientifico', 'autor_cientifico', 'familia', 'genero',
+                   'especie', 'determinado_por', 'fenologia', 'write_date']
+SITE_FIELDS = ['specimen_id', 'colector', 'numero_coleccion', 'fecha_recoleccion', 'pais', 'provincia',
+               'canton', 'localidad', 'latitud', 'longitud', 'altitud']
+
+
+def _clean(value):
+    """Valor de celda para archivos delimitados por tabuladores sin comillas"""
+    if value is None or value is False:
+        return ''
+    return ' '.join(str(value).split())
+
+
+def _row(values):
+    return '\t'.join(_clean(value) for value in values) + '\n'
+
+
+class HerbarioDwcaExport(models.Model):
+    _name = 'herbario.dwca.export'
+    _description = 'Exportación Darwin Core Archive'
+    _order = 'export_date desc, id desc'
+    _rec_name = 'export_date'
+
+    mode = fields.Selection([
+        ('full', 'Completa'),
+        ('incremental', 'Incremental'),
+    ], string='Modo', required=True, default='full')
+    state = fields.Selection([
+        ('running', 'En Proceso'),
+        ('done', 'Generado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='running', required=True, readonly=True)
+    export_date = fields.Datetime(
+        string='Fecha de Corte',
+        required=True,
+        readonly=True,
+        default=fields.Datetime.now,
+        help='Los cambios posteriores a esta fecha entran en la siguiente exportación incremental'
+    )
+    base_export_id = fields.Many2one(
+        'herbario.dwca.export',
+        string='Archivo Base',
+        readonly=True,
+        ondelete='set null',
+        help='Archivo anterior del que se copiaron los registros sin cambios'
+    )
+
+    # Resultado
+    file_path = fields.Char(string='Ruta del Archivo', readonly=True)
+    file_size = fields.Integer(string='Tamaño (bytes)', readonly=True)
+    occurrence_count = fields.Integer(string='Registros de Ocurrencia', readonly=True)
+    multimedia_count = fields.Integer(string='Registros Multimedia', readonly=True)
+    regenerated_count = fields.Integer(
+        string='Registros Regenerados',
+        readonly=True,
+        help='Especímenes leídos de la base de datos (en modo incremental, solo los modificados)'
+    )
+    duration = fields.Float(string='Duración (s)', digits=(10, 2), readonly=True)
+    error_message = fields.Text(string='Error', readonly=True)
+
+    # ==================== GENERACIÓN ====================
+
+    @api.model
+    def _get_export_dir(self):
+        export_dir = os.path.join(config['data_dir'], 'herbario_dwca', self.env.cr.dbname)
+        os.makedirs(export_dir, exist_ok=True)
+        return export_dir
+
+    @api.model
+    def _get_publish_domain(self):
+        return [('es_publico', '=', True), ('status', '=', 'activo')]
+
+    @api.model
+    def _get_last_export(self):
+        """Último archivo generado que sigue existiendo en disco"""
+        for export in self.search([('state', '=', 'done')], limit=5):
+            if export.file_path and os.path.exists(export.file_path):
+                return export
+        return self.browse()
+
+    @api.model
+    def generate(self, mode='incremental'):
+        """
+        Genera un Darwin Core Archive
+
+        En modo incremental se parte del último archivo: las filas de especímenes
+        sin cambios desde su fecha de corte se copian tal cual y solo se leen de la
+        base de datos los especímenes (o sus ubicaciones/imágenes) modificados. Los
+        especímenes que dejaron de ser públicos desaparecen del archivo.
+        """
+        base = self._get_last_export() if mode == 'incremental' else self.browse()
+        export = self.create({
+            'mode': 'incremental' if base else 'full',
+            'base_export_id': base.id,
+            # Inicio de esta transacción: la instantánea que se exporta
+            'export_date': self.env.cr.now(),
+        })
+        started = time.monotonic()
+        try:
+            # Un error de base de datos aborta solo el savepoint y el fallo se puede registrar
+            with self.env.cr.savepoint():
+                export._write_archive()
+        except Exception as e:
+            _logger.exception("[HerbarioDwCA] Error generando el archivo %s", export.id)
+            export.write({'state': 'failed', 'error_message': str(e)})
+            return export
+        export.write({'state': 'done', 'duration': time.monotonic() - started})
+        self._cleanup_old_archives()
+        return export
+
+    @api.model
+    def _cleanup_old_archives(self):
+        """Elimina del disco los archivos más antiguos que los últimos DWCA_KEEP_ARCHIVES"""
+        old_exports = self.search([('state', '=', 'done'), ('file_path', '!=', False)], offset=DWCA_KEEP_ARCHIVES)
+        for export in old_exports:
+            try:
+                os.unlink(export.file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                _logger.warning("[HerbarioDwCA] No se pudo eliminar %s: %s", export.file_path, e)
+        old_exports.write({'file_path': False})
+
+    def _get_changed_specimen_ids(self, since):
+        """Especímenes con cambios propios o en sus ubicaciones/imágenes desde la fecha indicada"""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT id FROM herbario_specimen WHERE write_date > %s
+             UNION
+            SELECT specimen_id FROM herbario_collection_site WHERE write_date > %s
+             UNION
+            SELECT specimen_id FROM herbario_image WHERE write_date > %s
+        """, [since, since, since])
+        return {row[0] for row in self.env.cr.fetchall()}
+
+    def _write_archive(self):
+        self.ensure_one()
+        Specimen = self.env['herbario.specimen'].sudo()
+        current_ids = Specimen.search(self._get_publish_domain(), order='id').ids
+
+        if self.base_export_id:
+            changed_ids = self._get_changed_specimen_ids(self.base_export_id.export_date - DWCA_CHANGE_OVERLAP)
+            kept_ids = set(current_ids) - changed_ids
+            regenerate_ids = [specimen_id for specimen_id in current_ids if specimen_id in changed_ids]
+        else:
+            kept_ids = set()
+            regenerate_ids = current_ids
+
+        export_dir = self._get_export_dir()
+        final_path = os.path.join(
+            export_dir, f"dwca_{fields.Datetime.to_string(self.export_date).replace(' ', '_').replace(':', '')}_{self.id}.zip")
+        tmp_path = final_path + '.tmp'
+        occurrence_count = multimedia_count = 0
+
+        base_archive = zipfile.ZipFile(self.base_export_id.file_path) if self.base_export_id else None
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive, \
+                    tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=export_dir) as multimedia_tmp:
+                # Multimedia se acumula en un temporal: zipfile no admite dos entradas abiertas a la vez
+                multimedia_tmp.write(_row(['id'] + [term for term, _ns in MULTIMEDIA_TERMS]))
+                with archive.open('occurrence.txt', 'w') as raw_occurrence:
+                    occurrence = io.TextIOWrapper(raw_occurrence, encoding='utf-8', newline='')
+                    occurrence.write(_row(['id'] + [term for term, _ns in OCCURRENCE_TERMS]))
+
+                    if base_archive:
+                        occurrence_count += self._copy_kept_rows(base_archive, 'occurrence.txt', kept_ids, occurrence)
+                        multimedia_count += self._copy_kept_rows(base_archive, 'multimedia.txt', kept_ids, multimedia_tmp)
+
+                    for occurrence_rows, multimedia_rows in self._iter_rows(regenerate_ids):
+                        occurrence.writelines(occurrence_rows)
+                        multimedia_tmp.writelines(multimedia_rows)
+                        occurrence_count += len(occurrence_rows)
+                        multimedia_count += len(multimedia_rows)
+                    occurrence.flush()
+                    occurrence.detach()
+
+                multimedia_tmp.seek(0)
+                with archive.open('multimedia.txt', 'w') as raw_multimedia:
+                    multimedia = io.TextIOWrapper(raw_multimedia, encoding='utf-8', newline='')
+                    shutil.copyfileobj(multimedia_tmp, multimedia, COPY_BLOCK_SIZE)
+                    multimedia.flush()
+                    multimedia.detach()
+
+                archive.writestr('meta.xml', self._render_meta_xml())
+                archive.writestr('eml.xml', self._render_eml_xml())
+        finally:
+            if base_archive:
+                base_archive.close()
+
+        os.replace(tmp_path, final_path)
+        self.write({
+            'file_path': final_path,
+            'file_size': os.path.getsize(final_path),
+            'occurrence_count': occurrence_count,
+            'multimedia_count': multimedia_count,
+            'regenerated_count': len(regenerate_ids),
+        })
+
+    def _copy_kept_rows(self, base_archive, member, kept_ids, output):
+        """Copia del archivo base las filas cuyo id (columna 0) sigue vigente y sin cambios"""
+        count = 0
+        with base_archive.open(member) as raw_input:
+            lines = io.TextIOWrapper(raw_input, encoding='utf-8', newline='')
+            next(lines, None)  # encabezado
+            for line in lines:
+                record_id = line.split('\t', 1)[0]
+                if record_id.isdigit() and int(record_id) in kept_ids:
+                    output.write(line)
+                    count += 1
+        return count
+
+    def _iter_rows(self, specimen_ids):
+        """Filas de ocurrencia y multimedia por lotes: tres consultas por lote y caché vaciada entre lotes"""
+        Specimen = self.env['herbario.specimen'].sudo()
+        CollectionSite = self.env['herbario.collection.site'].sudo()
+        Image = self.env['herbario.image'].sudo()
+        base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
+
+        for batch_ids in split_every(DWCA_BATCH_SIZE, specimen_ids):
+            batch_ids = list(batch_ids)
+            specimens = Specimen.browse(batch_ids).read(SPECIMEN_FIELDS)
+            # Ubicación principal de cada espécimen (o la primera registrada)
+            primary_sites = {}
+            for site in CollectionSite.search_read([('specimen_id', 'in', batch_ids)], SITE_FIELDS,
+                                                   order='is_primary desc, id asc', load=None):
+                primary_sites.setdefault(site['specimen_id'], site)
+            images = Image.search([('specimen_id', 'in', batch_ids), ('deleted_at', '=', False)],
+                                  order='specimen_id, display_order, id')
+
+            occurrence_rows = []
+            for spec in specimens:
+                site = primary_sites.get(spec['id'], {})
+                has_coordinates = bool(site.get('latitud') and site.get('longitud'))
+                occurrence_rows.append(_row([
+                    spec['id'],
+                    f"urn:catalog:{INSTITUTION_CODE}:{COLLECTION_CODE}:{spec['codigo_herbario']}",
+                    'PreservedSpecimen',
+                    INSTITUTION_CODE,
+                    COLLECTION_CODE,
+                    spec['codigo_herbario'],
+                    spec['nombre_cientifico'],
+                    spec['autor_cientifico'],
+                    spec['familia'],
+                    spec['genero'],
+                    spec['especie'],
+                    spec['determinado_por'],
+                    spec['fenologia'],
+                    site.get('colector'),
+                    site.get('numero_coleccion'),
+                    site.get('fecha_recoleccion') and fields.Date.to_string(site['fecha_recoleccion']),
+                    site.get('pais'),
+                    site.get('provincia'),
+                    site.get('canton'),
+                    site.get('localidad'),
+                    site['latitud'] if has_coordinates else None,
+                    site['longitud'] if has_coordinates else None,
+                    'WGS84' if has_coordinates else None,
+                    site.get('altitud') or None,
+                    site.get('altitud') or None,
+                    spec['write_date'] and spec['write_date'].isoformat(),
+                ]))
+
+            multimedia_rows = [_row([
+                image.specimen_id.id,
+                'StillImage',
+                image.mime_type,
+                base_url + image._get_image_url('full'),
+                f'{base_url}/herbario/specimen/{image.specimen_id.id}',
+                image.description or image.filename_original,
+                image.exif_date and image.exif_date.isoformat(),
+                image.photographer.name,
+            ]) for image in images]
+
+            yield occurrence_rows, multimedia_rows
+            self.env.invalidate_all()
+
+    def _render_meta_xml(self):
+        """Descriptor meta.xml del archivo (núcleo Occurrence + extensión Multimedia)"""
+        def file_block(tag, row_type, location, id_tag, terms):
+            field_lines = '\n'.join(
+                f'      <field index="{index}" term="{namespace}{term}"/>'
+                for index, (term, namespace) in enumerate(terms, start=1)
+            )
+            return (
+                f'  <{tag} encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" '
+                f'fieldsEnclosedBy="" ignoreHeaderLines="1" rowType="{row_type}">\n'
+                f'    <files>\n      <location>{location}</location>\n    </files>\n'
+                f'    <{id_tag} index="0"/>\n{field_lines}\n  </{tag}>'
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<archive xmlns="http://rs.tdwg.org/dwc/text/" metadata="eml.xml">\n'
+            + file_block('core', OCCURRENCE_ROW_TYPE, 'occurrence.txt', 'id', OCCURRENCE_TERMS) + '\n'
+            + file_block('extension', MULTIMEDIA_ROW_TYPE, 'multimedia.txt', 'coreid', MULTIMEDIA_TERMS) + '\n'
+            '</archive>\n'
+        )
+
+    def _render_eml_xml(self):
+        """Metadatos EML del recurso; título, resumen y licencia se configuran con parámetros del sistema"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        title = get_param('herbario_espoch.dwca_title', 'Colección del Herbario ESPOCH (CHEP)')
+        abstract = get_param('herbario_espoch.dwca_abstract',
+                             'Especímenes botánicos digitalizados del Herbario de la Escuela Superior '
+                             'Politécnica de Chimborazo.')
+        rights = get_param('herbario_espoch.dwca_license', 'CC-BY 4.0')
+        organization = 'Escuela Superior Politécnica de Chimborazo'
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="eml://ecoinformatics.org/eml-2.1.1 http://rs.gbif.org/schema/eml-gbif-profile/1.1/eml.xsd" '
+            f'packageId={quoteattr(f"{INSTITUTION_CODE}-{COLLECTION_CODE}-{self.id}")} system="http://gbif.org" '
+            'scope="system" xml:lang="es">\n'
+            '  <dataset>\n'
+            f'    <title xml:lang="es">{escape(title)}</title>\n'
+            f'    <creator><organizationName>{escape(organization)}</organizationName></creator>\n'
+            f'    <metadataProvider><organizationName>{escape(organization)}</organizationName></metadataProvider>\n'
+            f'    <pubDate>{fields.Date.to_string(self.export_date.date())}</pubDate>\n'
+            '    <language>es</language>\n'
+            f'    <abstract><para>{escape(abstract)}</para></abstract>\n'
+            f'    <intellectualRights><para>{escape(rights)}</para></intellectualRights>\n'
+            f'    <contact><organizationName>{escape(organization)}</organizationName></contact>\n'
+            '  </dataset>\n'
+            '</eml:eml>\n'
+        )
+
+    # ==================== ACCIONES ====================
+
+    @api.model
+    def _cron_publish(self):
+        """
+        Publicación nocturna: incremental sobre el último archivo, completa si no
+        existe o si se solicitó desde el backend
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        mode = ICP.get_param('herbario_espoch.dwca_requested_mode') or 'incremental'
+        ICP.set_param('herbario_espoch.dwca_requested_mode', False)
+        self.generate(mode=mode)
+
+    @api.model
+    def _request_generation(self, mode):
+        """La generación se delega al cron para no bloquear la petición web"""
+        self.env['ir.config_parameter'].sudo().set_param('herbario_espoch.dwca_requested_mode', mode)
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_dwca_publish', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Darwin Core Archive',
+                'message': 'La generación del archivo se ha programado.',
+                'type': 'info',
+                'sticky': False,
+            }
+        }
+
+    @api.model
+    def action_generate_full(self):
+        return self._request_generation('full')
+
+    @api.model
+    def action_generate_incremental(self):
+        return self._request_generation('incremental')
+
+    def action_download(self):
+        self.ensure_one()
+        if self.state != 'done':
+            raise UserError('El archivo aún no está disponible.')
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/herbario/dwca/{self.id}/dwca.zip',
+            'target': 'self',
+        }
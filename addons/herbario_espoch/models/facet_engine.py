@@ -0,0 +1,114 @@
+from odoo import models, api
+from odoo.tools import SQL
+
+# Facetas del repositorio: campo de herbario.specimen o de herbario.collection.site
+FACET_SPECIMEN_FIELDS = ['familia', 'genero']
+FACET_SITE_FIELDS = ['pais', 'provincia', 'colector']
+FACET_FIELDS = FACET_SPECIMEN_FIELDS + FACET_SITE_FIELDS
+
+# Valores por faceta (los más frecuentes); el seleccionado siempre se incluye
+FACET_LIMIT = 300
+
+
+class HerbarioFacetEngine(models.AbstractModel):
+    _name = 'herbario.facet.engine'
+    _description = 'Facetas del Repositorio del Herbario'
+
+    @api.model
+    def build_domain(self, filters, exclude=None):
+        """
+        Dominio de especímenes públicos para los filtros del repositorio
+
+        ``filters`` contiene los parámetros de la URL (familia, genero, autor,
+        pais, provincia, localidad, colector). ``exclude`` omite el filtro de una
+        faceta para contar sus valores alternativos.
+        """
+        filters = {key: value for key, value in filters.items() if value and key != exclude}
+        domain = [('es_publico', '=', True), ('status', '=', 'activo')]
+
+        if filters.get('familia'):
+            domain += [('familia', '=', filters['familia'])]
+        if filters.get('genero'):
+            domain += [('genero', '=', filters['genero'])]
+        if filters.get('autor'):
+            domain += [('autor_cientifico', 'ilike', filters['autor'])]
+
+        # Filtros de ubicación
+        site_domain = []
+        if filters.get('pais'):
+            site_domain.append(('pais', '=', filters['pais']))
+        if filters.get('provincia'):
+            site_domain.append(('provincia', '=', filters['provincia']))
+        if filters.get('localidad'):
+            site_domain.append(('localidad', 'ilike', filters['localidad']))
+        if filters.get('colector'):
+            site_domain.append(('colector', 'ilike', filters['colector']))
+        if site_domain:
+            # Subconsulta dentro de la misma consulta de especímenes (semi-join),
+            # sin traer a Python la lista de ids de las ubicaciones
+            domain += [('collection_site_ids', 'any', site_domain)]
+        return domain
+
+    @api.model
+    def _specimen_query(self, filters, text=None, exclude=None):
+        domain = self.build_domain(filters, exclude=exclude)
+        if text:
+            query, _rank = self.env['herbario.search.engine']._build_query(text, domain)
+            return query
+        return self.env['herbario.specimen']._search(domain)
+
+    @api.model
+    def facet_counts(self, filters, text=None, facets=None, limit=FACET_LIMIT):
+        """
+        Valores distintos con el número de especímenes de cada faceta
+
+        Cada faceta se cuenta bajo los filtros actuales salvo el suyo propio, de
+        modo que el desplegable sigue mostrando las alternativas. Todas las
+        facetas se resuelven con consultas agrupadas unidas en una sola sentencia,
+        sin cargar registros; familia y género, sin otros filtros, salen de los
+        contadores del árbol taxonómico.
+        """
+        facets = facets or FACET_FIELDS
+        counts = {facet: {} for facet in facets}
+        parts = []
+        for facet in facets:
+            if facet in FACET_SPECIMEN_FIELDS and not text:
+                # Sin otros filtros, familia y género se leen del árbol taxonómico
+                taxon_counts = self.env['herbario.taxon']._facet_counts(facet, filters, limit)
+                if taxon_counts is not None:
+                    counts[facet] = taxon_counts
+                    continue
+            subquery = self._specimen_query(filters, text=text, exclude=facet).subselect()
+            column = SQL.identifier(facet)
+            if facet in FACET_SPECIMEN_FIELDS:
+                parts.append(SQL("""
+                    (SELECT %s, s.%s, COUNT(*)
+                       FROM herbario_specimen s
+                      WHERE s.id IN %s AND s.%s IS NOT NULL AND s.%s != ''
+                   GROUP BY s.%s
+                   ORDER BY COUNT(*) DESC, s.%s
+                      LIMIT %s)
+                """, facet, column, subquery, column, column, column, column, limit))
+            else:
+                parts.append(SQL("""
+                    (SELECT %s, cs.%s, COUNT(DISTINCT cs.specimen_id)
+                       FROM herbario_collection_site cs
+                      WHERE cs.specimen_id IN %s AND cs.%s IS NOT NULL AND cs.%s != ''
+                   GROUP BY cs.%s
+                   ORDER BY COUNT(DISTINCT cs.specimen_id) DESC, cs.%s
+                      LIMIT %s)
+                """, facet, column, subquery, column, column, column, column, limit))
+
+        if parts:
+            self.env['herbario.specimen'].flush_model()
+            self.env['herbario.collection.site'].flush_model()
+            self.env.cr.execute(SQL(" UNION ALL ").join(parts))
+            for facet, value, count in self.env.cr.fetchall():
+                counts[facet][value] = count
+        result = {}
+        for facet in facets:
+            selected = filters.get(facet)
+            if selected and selected not in counts[facet]:
+                counts[facet][selected] = 0
+            result[facet] = sorted(counts[facet].items(), key=lambda item: item[0].lower())
+        return result
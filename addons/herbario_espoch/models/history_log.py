@@ -1,4 +1,59 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+from odoo.http import request
+from odoo.tools import config
+from odoo.tools.sql import create_column, table_columns
+from dateutil.relativedelta import relativedelta
+from datetime import date, timedelta
+import copy
+import gzip
+import logging
+import os
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+# Agrupaciones admitidas para la serie de actividad (date_trunc de PostgreSQL)
+STATISTICS_INTERVALS = ('day', 'week', 'month')
+
+# Claves del buffer de auditoría en cr.precommit.data
+AUDIT_BUFFER_KEY = 'herbario.history.log.buffer'
+AUDIT_REQUEST_KEY = 'herbario.history.log.request'
+
+# Generación de la caché de estadísticas de periodos cerrados: forma parte de la
+# clave y cambia al borrar historial (eliminación de especímenes, archivado)
+STATISTICS_GENERATION_PARAM = 'herbario_espoch.history_statistics_generation'
+
+# ==================== PARTICIONES ====================
+# La tabla se particiona por mes sobre ``timestamp``; se crean por adelantado
+# las particiones de los próximos meses
+HISTORY_PARTITIONS_AHEAD = 3
+# Meses que se conservan en la base de datos (parámetro history_retention_months)
+HISTORY_RETENTION_MONTHS = 36
+HISTORY_ARCHIVE_BATCH_SIZE = 5000
+# Recibe las filas fuera de las particiones mensuales (fechas más allá del horizonte)
+HISTORY_DEFAULT_PARTITION = 'herbario_history_log_default'
+# Índices de la tabla particionada: los de los campos indexados (con el nombre que
+# usa el ORM) y los compuestos de la línea de tiempo y la actividad por usuario
+HISTORY_INDEXES = {
+    'herbario_history_log__entity_type_index': '(entity_type)',
+    'herbario_history_log__entity_id_index': '(entity_id)',
+    'herbario_history_log__specimen_id_index': '(specimen_id)',
+    'herbario_history_log__action_type_index': '(action_type)',
+    'herbario_history_log__user_id_index': '(user_id)',
+    'herbario_history_log__timestamp_index': '("timestamp")',
+    'herbario_history_log_specimen_timestamp_idx': '(specimen_id, "timestamp" DESC)',
+    'herbario_history_log_user_timestamp_idx': '(user_id, "timestamp" DESC)',
+}
+HISTORY_FOREIGN_KEYS = [
+    ('specimen_id', 'herbario_specimen', 'CASCADE'),
+    ('user_id', 'res_users', 'RESTRICT'),
+    ('create_uid', 'res_users', 'SET NULL'),
+    ('write_uid', 'res_users', 'SET NULL'),
+]
+
+
+def _partition_name(month):
+    return f"herbario_history_log_y{month.year}m{month.month:02d}"
 
 
 class HistoryLog(models.Model):
@@ -6,6 +61,9 @@ class HistoryLog(models.Model):
     _description = 'Historial de Cambios del Herbario'
     _order = 'timestamp desc'
     _rec_name = 'action_type'
+    # Tabla particionada: el ORM no reconoce las tablas con relkind 'p' e
+    # intentaría crearla en cada actualización, así que la DDL la gestiona init
+    _auto = False
 
     # Entidad modificada
     entity_type = fields.Selection([
@@ -112,19 +170,26 @@ class HistoryLog(models.Model):
     def _compute_description(self):
         """Genera descripción legible del cambio"""
         for record in self:
-            if record.action_type == 'created':
-                record.description = f"Se creó el registro"
-            elif record.action_type == 'updated' and record.field_modified:
-                field_label = record._get_field_label(record.field_modified)
-                record.description = f"Se modificó {field_label}: '{record.old_value}' → '{record.new_value}'"
-            elif record.action_type == 'deleted':
-                record.description = f"Se eliminó el registro"
-            elif record.action_type in ['location_added', 'image_added']:
-                record.description = record.new_value or f"Se agregó {record.entity_type}"
-            elif record.action_type == 'qr_generated':
-                record.description = "Se generó el código QR"
-            else:
-                record.description = f"Acción: {dict(self._fields['action_type'].selection).get(record.action_type)}"
+            record.description = record._build_description(
+                record.action_type, record.field_modified, record.old_value,
+                record.new_value, record.entity_type,
+            )
+
+    @api.model
+    def _build_description(self, action_type, field_modified=None, old_value=None, new_value=None, entity_type=None):
+        """Descripción legible de una entrada (compartida por el cálculo y el buffer)"""
+        if action_type == 'created':
+            return "Se creó el registro"
+        if action_type == 'updated' and field_modified:
+            field_label = self._get_field_label(field_modified)
+            return f"Se modificó {field_label}: '{old_value}' → '{new_value}'"
+        if action_type == 'deleted':
+            return "Se eliminó el registro"
+        if action_type in ['location_added', 'image_added']:
+            return new_value or f"Se agregó {entity_type}"
+        if action_type == 'qr_generated':
+            return "Se generó el código QR"
+        return f"Acción: {dict(self._fields['action_type'].selection).get(action_type)}"
 
     @api.depends('timestamp')
     def _compute_time_ago(self):
@@ -171,12 +236,302 @@ class HistoryLog(models.Model):
             pass
         return field_name
 
+    # ==================== PARTICIONES ====================
+
+    def init(self):
+        """
+        Crea la tabla particionada por mes (o convierte la tabla de versiones
+        anteriores, una sola vez), añade las columnas de campos nuevos y asegura
+        las particiones de los próximos meses
+        """
+        cr = self.env.cr
+        cr.execute("SELECT relkind FROM pg_class WHERE relname = 'herbario_history_log'")
+        row = cr.fetchone()
+        if not row:
+            self._create_partitioned_table()
+        elif row[0] == 'r':
+            self._convert_to_partitioned()
+        self._update_columns()
+        self._ensure_partitions()
+
+    def _get_column_definitions(self):
+        """``{columna: tipo}`` de los campos almacenados, salvo ``id``"""
+        return {
+            name: field.column_type[1]
+            for name, field in self._fields.items()
+            if field.store and field.column_type and name != 'id'
+        }
+
+    def _create_partitioned_table(self):
+        """Crea la tabla particionada con las columnas de los campos, sus índices y claves foráneas"""
+        cr = self.env.cr
+        _logger.info("[HerbarioHistory] Creando herbario_history_log particionada por mes")
+        columns = ''.join(
+            f',\n"{name}" {column_type}{" NOT NULL" if self._fields[name].required else ""}'
+            for name, column_type in self._get_column_definitions().items()
+        )
+        cr.execute(f"""
+            CREATE SEQUENCE IF NOT EXISTS herbario_history_log_id_seq;
+            CREATE TABLE herbario_history_log (
+                id integer NOT NULL DEFAULT nextval('herbario_history_log_id_seq'){columns},
+                PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp");
+            ALTER SEQUENCE herbario_history_log_id_seq OWNED BY herbario_history_log.id;
+        """)
+        self._create_indexes_and_keys()
+
+    def _update_columns(self):
+        """Columnas de campos añadidos después de crear la tabla (lo que haría el ORM)"""
+        existing = table_columns(self.env.cr, self._table)
+        for name, column_type in self._get_column_definitions().items():
+            if name not in existing:
+                create_column(self.env.cr, self._table, name, column_type)
+
+    def _convert_to_partitioned(self):
+        """
+        Reemplaza la tabla creada por el ORM por una particionada por rango de
+        ``timestamp`` con las mismas columnas, índices y claves foráneas; la clave
+        primaria pasa a ser (id, timestamp), requisito de PostgreSQL.
+        """
+        cr = self.env.cr
+        _logger.info("[HerbarioHistory] Particionando herbario_history_log por mes")
+        cr.execute("""
+            ALTER SEQUENCE herbario_history_log_id_seq OWNED BY NONE;
+            CREATE TABLE herbario_history_log_partitioned
+                (LIKE herbario_history_log INCLUDING DEFAULTS)
+                PARTITION BY RANGE ("timestamp");
+        """)
+        cr.execute('SELECT min("timestamp") FROM herbario_history_log')
+        oldest = cr.fetchone()[0]
+        self._ensure_partitions(
+            since=oldest.date() if oldest else None, table='herbario_history_log_partitioned')
+        cr.execute("""
+            INSERT INTO herbario_history_log_partitioned SELECT * FROM herbario_history_log;
+            DROP TABLE herbario_history_log;
+            ALTER TABLE herbario_history_log_partitioned RENAME TO herbario_history_log;
+            ALTER SEQUENCE herbario_history_log_id_seq OWNED BY herbario_history_log.id;
+            ALTER TABLE herbario_history_log
+                ADD CONSTRAINT herbario_history_log_pkey PRIMARY KEY (id, "timestamp");
+        """)
+        self._create_indexes_and_keys()
+
+    def _create_indexes_and_keys(self):
+        cr = self.env.cr
+        for name, columns in HISTORY_INDEXES.items():
+            cr.execute(f"CREATE INDEX {name} ON herbario_history_log {columns}")
+        for column, target, ondelete in HISTORY_FOREIGN_KEYS:
+            cr.execute(f"""
+                ALTER TABLE herbario_history_log
+                    ADD CONSTRAINT herbario_history_log_{column}_fkey FOREIGN KEY ({column})
+                    REFERENCES {target} (id) ON DELETE {ondelete}
+            """)
+
+    @api.model
+    def _ensure_partitions(self, since=None, table='herbario_history_log'):
+        """
+        Crea la partición por defecto y las mensuales desde ``since`` (o el mes
+        actual) hasta HISTORY_PARTITIONS_AHEAD meses
+
+        Si la partición por defecto ya tiene filas de un mes nuevo, se trasladan
+        a su partición: PostgreSQL no permite crearla mientras existan.
+        """
+        cr = self.env.cr
+        cr.execute(f"CREATE TABLE IF NOT EXISTS {HISTORY_DEFAULT_PARTITION} PARTITION OF {table} DEFAULT")
+        month = (since or fields.Date.today()).replace(day=1)
+        last = fields.Date.today().replace(day=1) + relativedelta(months=HISTORY_PARTITIONS_AHEAD)
+        while month <= last:
+            next_month = month + relativedelta(months=1)
+            name = _partition_name(month)
+            cr.execute("SELECT to_regclass(%s) IS NULL", [name])
+            if cr.fetchone()[0]:
+                cr.execute(f"""
+                    SELECT EXISTS (SELECT 1 FROM {HISTORY_DEFAULT_PARTITION}
+                                    WHERE "timestamp" >= %s AND "timestamp" < %s)
+                """, [month, next_month])
+                if cr.fetchone()[0]:
+                    cr.execute(f"""
+                        CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS);
+                        WITH moved AS (
+                            DELETE FROM {HISTORY_DEFAULT_PARTITION}
+                             WHERE "timestamp" >= %(from)s AND "timestamp" < %(to)s
+                         RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved;
+                        ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%(from)s) TO (%(to)s);
+                    """, {'from': month, 'to': next_month})
+                else:
+                    cr.execute(f"""
+                        CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)
+                    """, [month, next_month])
+            month = next_month
+
+    @api.model
+    def _get_partitions(self):
+        """Particiones mensuales adjuntas ordenadas: [(nombre, primer día del mes)]"""
+        self.env.cr.execute("""
+            SELECT child.relname
+              FROM pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+             WHERE parent.relname = 'herbario_history_log' AND child.relname <> %s
+          ORDER BY child.relname
+        """, [HISTORY_DEFAULT_PARTITION])
+        partitions = []
+        for (name,) in self.env.cr.fetchall():
+            year, month = name.rsplit('_', 1)[1][1:].split('m')
+            partitions.append((name, date(int(year), int(month), 1)))
+        return partitions
+
+    @api.model
+    def _get_archive_dir(self):
+        archive_dir = os.path.join(config['data_dir'], 'herbario_history_archive', self.env.cr.dbname)
+        os.makedirs(archive_dir, exist_ok=True)
+        return archive_dir
+
+    @api.model
+    def _archive_partition(self, name):
+        """
+        Exporta una partición a ``<nombre>.jsonl.gz`` (una fila JSON por línea),
+        la separa de la tabla y la elimina
+        """
+        cr = self.env.cr
+        path = os.path.join(self._get_archive_dir(), f'{name}.jsonl.gz')
+        tmp_path = f'{path}.tmp'
+        count, last_id = 0, 0
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive:
+            while True:
+                cr.execute(f"""
+                    SELECT id, row_to_json(log)::text
+                      FROM {name} log
+                     WHERE id > %s
+                  ORDER BY id
+                     LIMIT %s
+                """, [last_id, HISTORY_ARCHIVE_BATCH_SIZE])
+                rows = cr.fetchall()
+                if not rows:
+                    break
+                archive.writelines(f'{row}\n' for _id, row in rows)
+                count += len(rows)
+                last_id = rows[-1][0]
+        os.replace(tmp_path, path)
+        cr.execute(f"ALTER TABLE herbario_history_log DETACH PARTITION {name}")
+        cr.execute(f"DROP TABLE {name}")
+        self._clear_statistics_cache()
+        _logger.info("[HerbarioHistory] Partición %s archivada en %s (%s filas)", name, path, count)
+        return path
+
+    @api.model
+    def _cron_maintain_partitions(self):
+        """
+        Crea las particiones de los próximos meses y archiva las que superan la
+        retención (parámetro ``herbario_espoch.history_retention_months``)
+        """
+        self._ensure_partitions()
+        retention = int(self.env['ir.config_parameter'].sudo().get_param(
+            'herbario_espoch.history_retention_months', HISTORY_RETENTION_MONTHS))
+        if retention <= 0:
+            return
+        limit_month = fields.Date.today().replace(day=1) - relativedelta(months=retention)
+        archived = False
+        for name, month in self._get_partitions():
+            if month < limit_month:
+                self._archive_partition(name)
+                self.env.cr.commit()
+                archived = True
+        if archived:
+            self.invalidate_model()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Las entradas con fecha explícita anterior al mes actual pueden necesitar su partición"""
+        timestamps = [fields.Datetime.to_datetime(vals['timestamp']) for vals in vals_list if vals.get('timestamp')]
+        current_month = fields.Date.today().replace(day=1)
+        oldest = min((ts.date() for ts in timestamps), default=current_month)
+        if oldest < current_month:
+            self._ensure_partitions(since=oldest)
+        return super().create(vals_list)
+
+    # ==================== BUFFER DE AUDITORÍA ====================
+
+    @api.model
+    def _get_request_info(self):
+        """IP y user agent de la petición HTTP en curso (si la hay)"""
+        if request and request.httprequest:
+            user_agent = request.httprequest.user_agent.string or None
+            return request.httprequest.remote_addr, user_agent and user_agent[:255]
+        return None, None
+
+    @api.model
+    def _buffer_entries(self, vals_list):
+        """
+        Acumula entradas del historial hasta el final de la transacción
+
+        Las entradas se completan aquí (usuario, fecha, IP/user agent, descripción)
+        y se insertan todas juntas, con un único ``create`` multi-registro, justo
+        antes del commit (o antes de cualquier consulta sobre el historial).
+
+        El buffer vive en ``cr.precommit``, así que sigue la pila de savepoints
+        igual que las escrituras pendientes del ORM: ``cr.savepoint()`` ejecuta
+        los hooks precommit al abrirse (las entradas previas quedan insertadas
+        fuera de él) y al liberarse, y al revertirse limpia ``precommit.data``
+        con las entradas acumuladas dentro. Como el resto de escrituras
+        pendientes, solo los savepoints con ``flush=False`` no lo vuelcan.
+        """
+        if not vals_list:
+            return
+        data = self.env.cr.precommit.data
+        buffer = data.get(AUDIT_BUFFER_KEY)
+        if buffer is None:
+            buffer = data[AUDIT_BUFFER_KEY] = []
+            self.env.cr.precommit.add(self.sudo()._flush_audit_buffer)
+        if AUDIT_REQUEST_KEY not in data:
+            # Una sola vez por petición
+            data[AUDIT_REQUEST_KEY] = self._get_request_info()
+        ip_address, user_agent = data[AUDIT_REQUEST_KEY]
+        now = fields.Datetime.now()
+        user = self.env.user
+        for vals in vals_list:
+            entry = dict(vals)
+            entry.setdefault('user_id', user.id)
+            entry.setdefault('user_name', user.name)
+            entry.setdefault('timestamp', now)
+            entry.setdefault('ip_address', ip_address)
+            entry.setdefault('user_agent', user_agent)
+            if not entry.get('description'):
+                entry['description'] = self._build_description(
+                    entry['action_type'], entry.get('field_modified'), entry.get('old_value'),
+                    entry.get('new_value'), entry.get('entity_type'),
+                )
+            buffer.append(entry)
+
+    @api.model
+    def _flush_audit_buffer(self):
+        """Inserta las entradas acumuladas en la transacción"""
+        entries = self.env.cr.precommit.data.pop(AUDIT_BUFFER_KEY, None)
+        if not entries:
+            return
+        # Entradas de especímenes eliminados en la misma transacción: su historial
+        # se habría borrado en cascada
+        specimen_ids = tuple({entry['specimen_id'] for entry in entries})
+        self.env.cr.execute("SELECT id FROM herbario_specimen WHERE id IN %s", [specimen_ids])
+        existing_ids = {row[0] for row in self.env.cr.fetchall()}
+        entries = [entry for entry in entries if entry['specimen_id'] in existing_ids]
+        if entries:
+            self.sudo().create(entries)
+
+    def flush_model(self, fnames=None):
+        self._flush_audit_buffer()
+        return super().flush_model(fnames)
+
     @api.model
     def log_action(self, specimen_id, entity_type, entity_id, action_type, 
                    field_modified=None, old_value=None, new_value=None, description=None):
         """
-        Método helper para crear logs de manera sencilla
-        
+        Método helper para registrar cambios de manera sencilla
+
+        La entrada se acumula en el buffer de la transacción (ver
+        ``_buffer_entries``).
+
         Uso:
         self.env['herbario.history.log'].log_action(
             specimen_id=15,
@@ -188,16 +543,7 @@ class HistoryLog(models.Model):
             new_value='Asteraceae'
         )
         """
-        # Obtener información de la petición si está disponible
-        request = self.env.context.get('request')
-        ip_address = None
-        user_agent = None
-        
-        if request and hasattr(request, 'httprequest'):
-            ip_address = request.httprequest.environ.get('REMOTE_ADDR')
-            user_agent = request.httprequest.environ.get('HTTP_USER_AGENT')
-
-        return self.create({
+        vals = {
             'specimen_id': specimen_id,
             'entity_type': entity_type,
             'entity_id': entity_id,
@@ -205,23 +551,33 @@ class HistoryLog(models.Model):
             'field_modified': field_modified,
             'old_value': str(old_value) if old_value else None,
             'new_value': str(new_value) if new_value else None,
-            'user_id': self.env.user.id,
-            'user_name': self.env.user.name,
-            'ip_address': ip_address,
-            'user_agent': user_agent,
-        })
+            'description': description,
+        }
+        self._buffer_entries([vals])
 
     @api.model
-    def get_specimen_timeline(self, specimen_id, limit=None):
-        """Obtiene línea de tiempo de un espécimen"""
+    def get_specimen_timeline(self, specimen_id, limit=None, date_from=None, date_to=None):
+        """
+        Obtiene línea de tiempo de un espécimen
+
+        El historial no puede ser anterior a la creación del espécimen: ese límite
+        inferior permite a PostgreSQL descartar las particiones más antiguas.
+        """
+        if not date_from:
+            specimen = self.env['herbario.specimen'].browse(specimen_id)
+            if specimen.exists() and specimen.create_date:
+                date_from = specimen.create_date - timedelta(days=1)
         domain = [('specimen_id', '=', specimen_id)]
+        if date_from:
+            domain.append(('timestamp', '>=', date_from))
+        if date_to:
+            domain.append(('timestamp', '<', date_to))
         return self.search(domain, limit=limit, order='timestamp desc')
 
     @api.model
     def get_user_activity(self, user_id, days=30):
-        """Obtiene actividad reciente de un usuario"""
-        from datetime import datetime, timedelta
-        date_from = datetime.now() - timedelta(days=days)
+        """Obtiene actividad reciente de un usuario (solo las particiones del rango)"""
+        date_from = fields.Datetime.now() - timedelta(days=days)
         
         domain = [
             ('user_id', '=', user_id),
@@ -230,41 +586,121 @@ class HistoryLog(models.Model):
         return self.search(domain, order='timestamp desc')
 
     @api.model
-    def get_statistics(self, specimen_id=None):
-        """Obtiene estadísticas de cambios"""
-        domain = [('specimen_id', '=', specimen_id)] if specimen_id else []
-        
-        logs = self.search(domain)
-        
+    def get_statistics(self, specimen_id=None, date_from=None, date_to=None, user_ids=None, interval='day'):
+        """
+        Obtiene estadísticas de cambios
+
+        Filtros opcionales: espécimen, rango ``[date_from, date_to)`` y usuarios.
+        Además de los totales por acción, usuario y entidad devuelve ``series``,
+        la actividad agrupada por día, semana o mes (``interval``).
+
+        Todo se resuelve con una consulta agregada en PostgreSQL; si el rango
+        termina antes del día en curso (periodo cerrado, el historial solo crece)
+        el resultado se guarda en caché.
+        """
+        if interval not in STATISTICS_INTERVALS:
+            raise ValueError(f"Intervalo no soportado: {interval}")
+        date_from = fields.Datetime.to_datetime(date_from) if date_from else None
+        date_to = fields.Datetime.to_datetime(date_to) if date_to else None
+        user_ids = tuple(sorted(set(user_ids))) if user_ids else ()
+        args = (specimen_id or None, date_from, date_to, user_ids, interval)
+
+        today = fields.Datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        if date_to and date_to <= today:
+            stats = self._get_closed_period_statistics(self._get_statistics_generation(), *args)
+        else:
+            stats = self._compute_statistics(*args)
+        return copy.deepcopy(stats)
+
+    @api.model
+    @tools.ormcache('generation', 'specimen_id', 'date_from', 'date_to', 'user_ids', 'interval')
+    def _get_closed_period_statistics(self, generation, specimen_id, date_from, date_to, user_ids, interval):
+        return self._compute_statistics(specimen_id, date_from, date_to, user_ids, interval)
+
+    @api.model
+    def _compute_statistics(self, specimen_id, date_from, date_to, user_ids, interval):
+        """Una sola consulta con GROUPING SETS: acción, usuario, entidad, periodo y total"""
+        conditions, params = ['TRUE'], []
+        if specimen_id:
+            conditions.append('specimen_id = %s')
+            params.append(specimen_id)
+        if date_from:
+            conditions.append('timestamp >= %s')
+            params.append(date_from)
+        if date_to:
+            conditions.append('timestamp < %s')
+            params.append(date_to)
+        if user_ids:
+            conditions.append('user_id IN %s')
+            params.append(user_ids)
+
+        self.flush_model()
+        self.env.cr.execute(f"""
+            SELECT GROUPING(action_type, user_name, entity_type, bucket) AS grouping_id,
+                   action_type, user_name, entity_type, bucket, count(*)
+              FROM (
+                    SELECT action_type, user_name, entity_type,
+                           date_trunc(%s, timestamp) AS bucket
+                      FROM herbario_history_log
+                     WHERE {' AND '.join(conditions)}
+                   ) log
+          GROUP BY GROUPING SETS ((action_type), (user_name), (entity_type), (bucket), ())
+        """, [interval] + params)
+
         stats = {
-            'total_changes': len(logs),
+            'total_changes': 0,
             'by_action': {},
             'by_user': {},
             'by_entity': {},
-            'most_active_users': []
+            'most_active_users': [],
+            'series': [],
         }
-        
-        # Agrupar por acción
-        for log in logs:
-            action = log.action_type
-            stats['by_action'][action] = stats['by_action'].get(action, 0) + 1
-        
-        # Agrupar por usuario
-        for log in logs:
-            user = log.user_name
-            stats['by_user'][user] = stats['by_user'].get(user, 0) + 1
-        
-        # Agrupar por tipo de entidad
-        for log in logs:
-            entity = log.entity_type
-            stats['by_entity'][entity] = stats['by_entity'].get(entity, 0) + 1
-        
+        # El bit más alto de GROUPING() corresponde a la primera columna
+        for grouping_id, action, user_name, entity, bucket, count in self.env.cr.fetchall():
+            if grouping_id == 0b1111:
+                stats['total_changes'] = count
+            elif grouping_id == 0b0111:
+                stats['by_action'][action] = count
+            elif grouping_id == 0b1011:
+                stats['by_user'][user_name] = count
+            elif grouping_id == 0b1101:
+                stats['by_entity'][entity] = count
+            elif grouping_id == 0b1110:
+                stats['series'].append((fields.Datetime.to_string(bucket), count))
+
         # Usuarios más activos
         user_activity = sorted(stats['by_user'].items(), key=lambda x: x[1], reverse=True)
         stats['most_active_users'] = user_activity[:5]
-        
+        stats['series'].sort()
         return stats
 
+    @api.model
+    def _get_statistics_generation(self):
+        """
+        Generación vigente de la caché de periodos cerrados
+
+        Se lee y escribe con SQL: ``get_param``/``set_param`` vaciarían la caché de
+        todo el registro, que es justamente lo que se quiere evitar.
+        """
+        self.env.cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", [STATISTICS_GENERATION_PARAM])
+        row = self.env.cr.fetchone()
+        return row[0] if row else ''
+
+    @api.model
+    def _clear_statistics_cache(self):
+        """
+        Los periodos cerrados solo cambian al borrar historial (eliminación en
+        cascada o archivado): una generación nueva deja sin uso las entradas
+        anteriores. Es un valor único y no un contador, para que una transacción
+        revertida no reutilice la generación de entradas ya guardadas.
+        """
+        self.env.cr.execute("""
+            INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+                 VALUES (%(key)s, %(value)s, %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, write_uid = EXCLUDED.write_uid,
+                                            write_date = EXCLUDED.write_date
+        """, {'key': STATISTICS_GENERATION_PARAM, 'value': uuid.uuid4().hex, 'uid': self.env.uid})
+
     def action_view_specimen(self):
         """Acción para ver el espécimen relacionado"""
         self.ensure_one()
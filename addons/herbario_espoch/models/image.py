@@ -1,12 +1,206 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from odoo.tools import config
+from odoo.tools.mimetypes import guess_mimetype
+from .statistics_cube import STATS_IMAGE_FIELDS
+from .taxon import TAXON_IMAGE_FIELDS
 import base64
 import hashlib
+import math
 import os
+import shutil
 from PIL import Image
 from io import BytesIO
 import json
 
+# Tamaños de miniatura generados por la cola de derivados (campo → caja máxima)
+THUMBNAIL_SIZES = {
+    'thumbnail': (80, 80),
+    'thumbnail_medium': (200, 200),
+}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Pirámide de teselas para zoom profundo (solo para imágenes grandes)
+TILE_SIZE = 256
+TILE_JPEG_QUALITY = 85
+TILE_MIN_DIMENSION = 1024
+TILES_DIRECTORY = 'herbario_tiles'
+
+# Valores de los metadatos cuando no hay imagen o no se puede leer
+EMPTY_METADATA = {
+    'file_size': 0,
+    'image_width': 0,
+    'image_height': 0,
+    'file_hash': False,
+    'exif_data': None,
+}
+
+EXIF_TAG_MAKE = 0x010F
+EXIF_TAG_MODEL = 0x0110
+EXIF_TAG_DATETIME = 0x0132
+EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+EXIF_IFD_POINTER = 0x8769
+
+RESAMPLE_FILTER = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.ANTIALIAS
+
+
+def _read_exif(image):
+    """Lee los metadatos EXIF de la cabecera, sin decodificar los píxeles"""
+    exif = image.getexif()
+    if not exif:
+        return None
+    exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+    exif_dict = {}
+    for key, tag_id, source in [('make', EXIF_TAG_MAKE, exif),
+                                ('model', EXIF_TAG_MODEL, exif),
+                                ('datetime', EXIF_TAG_DATETIME, exif),
+                                ('datetimeoriginal', EXIF_TAG_DATETIME_ORIGINAL, exif_ifd)]:
+        if source.get(tag_id):
+            exif_dict[key] = str(source[tag_id]).strip('\x00 ')
+    camera = ' '.join(filter(None, [exif_dict.get('make'), exif_dict.get('model')]))
+    if camera:
+        exif_dict['camera'] = camera
+    date_taken = exif_dict.get('datetimeoriginal') or exif_dict.get('datetime')
+    if date_taken and len(date_taken) >= 19:
+        # Formato EXIF 'AAAA:MM:DD HH:MM:SS' → formato de Odoo
+        exif_dict['date_taken'] = date_taken[:10].replace(':', '-') + date_taken[10:19]
+    return json.dumps(exif_dict) if exif_dict else None
+
+
+def read_image_metadata(stream):
+    """
+    Lee los metadatos de un archivo de imagen sin decodificar sus píxeles
+
+    El hash SHA-256 y el tamaño se calculan leyendo por bloques; dimensiones y EXIF
+    salen de la cabecera. Devuelve un dict con los campos derivados.
+    """
+    values = dict(EMPTY_METADATA)
+    sha256 = hashlib.sha256()
+    file_size = 0
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        sha256.update(chunk)
+        file_size += len(chunk)
+    values['file_hash'] = sha256.hexdigest()
+    values['file_size'] = file_size
+
+    stream.seek(0)
+    values.update(read_image_header(stream))
+    return values
+
+
+def read_image_header(stream):
+    """Dimensiones y EXIF leídos de la cabecera; vacío si el archivo no es una imagen"""
+    try:
+        image = Image.open(stream)
+        return {
+            'image_width': image.width,
+            'image_height': image.height,
+            'exif_data': _read_exif(image),
+        }
+    except Exception:
+        return {}
+
+
+def hash_file(path):
+    """SHA-1 (nombre en el filestore) y SHA-256 (``file_hash``) de un archivo en una sola lectura"""
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(block)
+            sha256.update(block)
+    return {'sha1': sha1.hexdigest(), 'sha256': sha256.hexdigest()}
+
+
+def open_image_source(source):
+    """Abre una fuente de imagen: ruta en el filestore o bytes en memoria"""
+    if isinstance(source, bytes):
+        return BytesIO(source)
+    return open(source, 'rb')
+
+
+def render_thumbnails(source):
+    """
+    Genera todas las miniaturas desde una única decodificación reducida
+
+    ``Image.draft`` aprovecha el escalado DCT en JPEG; la miniatura mediana se
+    genera primero y la pequeña a partir de la mediana. Se ejecuta en procesos
+    del pool de herbario.image.job, por lo que no usa el ORM.
+    Devuelve un dict campo → bytes PNG.
+    """
+    values = {}
+    with open_image_source(source) as stream:
+        image = Image.open(stream)
+        sizes = sorted(THUMBNAIL_SIZES.items(), key=lambda item: item[1], reverse=True)
+        largest_box = sizes[0][1]
+        if image.format == 'JPEG':
+            image.draft('RGB', largest_box)
+        image.thumbnail(largest_box, RESAMPLE_FILTER)
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+
+        for field_name, box in sizes:
+            if box != largest_box:
+                image = image.copy()
+                image.thumbnail(box, RESAMPLE_FILTER)
+            output = BytesIO()
+            image.save(output, format='PNG')
+            values[field_name] = output.getvalue()
+    return values
+
+def render_tile_pyramid(source, output_dir, tile_size=TILE_SIZE):
+    """
+    Genera la pirámide de teselas (estilo Deep Zoom) de una imagen
+
+    El nivel máximo es la resolución original y cada nivel inferior es la mitad
+    del anterior hasta llegar a 1 px; cada nivel se corta en teselas JPEG de
+    ``tile_size`` px guardadas como ``<nivel>/<columna>_<fila>.jpg``. Se escribe
+    en un directorio temporal que se renombra al terminar, para que un lector
+    nunca vea una pirámide a medias. Devuelve el nivel máximo.
+    """
+    with open_image_source(source) as stream:
+        image = Image.open(stream)
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        max_level = tile_max_level(image.width, image.height)
+
+        tmp_dir = f'{output_dir}.tmp-{os.getpid()}'
+        level = max_level
+        while True:
+            level_dir = os.path.join(tmp_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            for row in range(math.ceil(image.height / tile_size)):
+                for col in range(math.ceil(image.width / tile_size)):
+                    box = (col * tile_size, row * tile_size,
+                           min((col + 1) * tile_size, image.width),
+                           min((row + 1) * tile_size, image.height))
+                    image.crop(box).save(os.path.join(level_dir, f'{col}_{row}.jpg'),
+                                         format='JPEG', quality=TILE_JPEG_QUALITY)
+            if level == 0:
+                break
+            # reduce() redondea hacia arriba, igual que el tamaño de nivel de Deep Zoom
+            image = image.reduce(2)
+            level -= 1
+
+    if os.path.isdir(output_dir):
+        # Otra ejecución ya generó la misma pirámide (mismo hash de contenido)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        os.rename(tmp_dir, output_dir)
+    return max_level
+
+
+def tile_max_level(width, height):
+    """Nivel de la resolución original: log2 del lado mayor, redondeado hacia arriba"""
+    return math.ceil(math.log2(max(width, height, 1)))
+
+# Variantes servidas por /herbario/image y el campo binario de cada una
+IMAGE_VARIANT_FIELDS = {
+    'thumb': 'thumbnail',
+    'medium': 'thumbnail_medium',
+    'full': 'image_data',
+}
+
 class HerbarioImage(models.Model):
     _name = 'herbario.image'
     _description = 'Imágenes de Especímenes Botánicos'
@@ -41,15 +235,30 @@ class HerbarioImage(models.Model):
     )
     thumbnail = fields.Binary(
         string='Miniatura Pequeña',
-        compute='_compute_thumbnails',
-        store=True,
-        readonly=True
+        readonly=True,
+        help='Generada de forma asíncrona por la cola de derivados'
     )
     thumbnail_medium = fields.Binary(
         string='Miniatura Mediana',
-        compute='_compute_thumbnails',
-        store=True,
-        readonly=True
+        readonly=True,
+        help='Generada de forma asíncrona por la cola de derivados'
+    )
+    derivatives_state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Generados'),
+        ('failed', 'Error')
+    ], string='Estado de Miniaturas', readonly=True, copy=False,
+        help='Estado de la generación asíncrona de miniaturas')
+    has_tiles = fields.Boolean(
+        string='Teselas de Zoom',
+        readonly=True,
+        copy=False,
+        help='Indica si la pirámide de teselas para zoom profundo está generada'
+    )
+    derivative_job_ids = fields.One2many(
+        'herbario.image.job',
+        'image_id',
+        string='Trabajos de Miniaturas'
     )
     
     # Metadatos del archivo
@@ -76,7 +285,7 @@ class HerbarioImage(models.Model):
     )
     file_hash = fields.Char(
         string='Hash SHA-256',
-        compute='_compute_file_hash',
+        compute='_compute_file_metadata',
         store=True,
         index=True,
         help='Hash para detección de duplicados'
@@ -85,6 +294,8 @@ class HerbarioImage(models.Model):
     # Datos EXIF
     exif_data = fields.Text(
         string='Datos EXIF',
+        compute='_compute_file_metadata',
+        store=True,
         help='Metadatos EXIF extraídos de la imagen (JSON)'
     )
     exif_camera = fields.Char(
@@ -150,64 +361,64 @@ class HerbarioImage(models.Model):
         string='Resolución',
         compute='_compute_resolution'
     )
+    is_published = fields.Boolean(
+        string='Publicada',
+        compute='_compute_is_published',
+        store=True,
+        index=True,
+        help='Visible en el portal: espécimen público y activo, imagen no eliminada'
+    )
 
-    @api.depends('image_data')
-    def _compute_thumbnails(self):
-        for record in self:
-            if record.image_data:
-                try:
-                    image = Image.open(BytesIO(base64.b64decode(record.image_data)))
-                    # Generar miniatura pequeña (80x80)
-                    image_small = image.copy()
-                    image_small.thumbnail((80, 80), Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.ANTIALIAS)
-                    output_small = BytesIO()
-                    image_small.save(output_small, format='PNG')
-                    record.thumbnail = base64.b64encode(output_small.getvalue())
-                    
-                    # Generar miniatura mediana (200x200)
-                    image_medium = image.copy()
-                    image_medium.thumbnail((200, 200), Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.ANTIALIAS)
-                    output_medium = BytesIO()
-                    image_medium.save(output_medium, format='PNG')
-                    record.thumbnail_medium = base64.b64encode(output_medium.getvalue())
-                except Exception as e:
-                    record.thumbnail = False
-                    record.thumbnail_medium = False
-            else:
-                record.thumbnail = False
-                record.thumbnail_medium = False
+    def init(self):
+        """Índice parcial para la galería pública (orden por id descendente)"""
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS herbario_image_published_id_idx
+                ON herbario_image (id DESC) WHERE is_published
+        """)
 
     @api.depends('image_data')
     def _compute_file_metadata(self):
+        """Hash, tamaño, dimensiones y EXIF del original, sin decodificar la imagen"""
+        sources = self._get_image_sources()
         for record in self:
-            if record.image_data:
-                try:
-                    image_bytes = base64.b64decode(record.image_data)
-                    record.file_size = len(image_bytes)
-                    image_stream = BytesIO(image_bytes)
-                    image = Image.open(image_stream)
-                    record.image_width = image.width
-                    record.image_height = image.height
-                except Exception:
-                    record.file_size = 0
-                    record.image_width = 0
-                    record.image_height = 0
-            else:
-                record.file_size = 0
-                record.image_width = 0
-                record.image_height = 0
+            values = dict(EMPTY_METADATA)
+            source = sources.get(record.id)
+            if source is not None:
+                with open_image_source(source) as stream:
+                    values.update(read_image_metadata(stream))
+            record.update(values)
 
-    @api.depends('image_data')
-    def _compute_file_hash(self):
+    def _get_image_sources(self):
+        """
+        Fuente del archivo original por registro: ruta en el filestore o bytes,
+        sin decodificar base64 cuando el binario ya está guardado
+        """
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'image_data'),
+            ('res_id', 'in', [record_id for record_id in self.ids if record_id]),
+        ])
+        attachment_by_res_id = {attachment.res_id: attachment for attachment in attachments}
+        sources = {}
         for record in self:
-            if record.image_data:
-                try:
-                    image_bytes = base64.b64decode(record.image_data)
-                    record.file_hash = hashlib.sha256(image_bytes).hexdigest()
-                except Exception:
-                    record.file_hash = False
-            else:
-                record.file_hash = False
+            attachment = attachment_by_res_id.get(record.id)
+            if attachment and attachment.store_fname:
+                sources[record.id] = attachment._full_path(attachment.store_fname)
+            elif attachment and attachment.db_datas:
+                sources[record.id] = attachment.raw
+            elif record.image_data:
+                # Registros aún no guardados (formularios en edición)
+                sources[record.id] = base64.b64decode(record.image_data)
+        return sources
+
+    @api.depends('deleted_at', 'specimen_id.es_publico', 'specimen_id.status')
+    def _compute_is_published(self):
+        for record in self:
+            record.is_published = bool(
+                not record.deleted_at
+                and record.specimen_id.es_publico
+                and record.specimen_id.status == 'activo'
+            )
 
     @api.depends('exif_data')
     def _compute_exif_fields(self):
@@ -262,37 +473,148 @@ class HerbarioImage(models.Model):
 
     @api.model
     def create(self, vals):
-        if vals.get('image_data'):
-            vals['exif_data'] = self._extract_exif(vals['image_data'])
         if vals.get('specimen_id'):
             existing_images = self.search([('specimen_id', '=', vals['specimen_id']), ('deleted_at', '=', False)])
             if not existing_images:
                 vals['is_primary'] = True
         if vals.get('is_primary') and vals.get('specimen_id'):
             self.search([('specimen_id', '=', vals['specimen_id']), ('is_primary', '=', True), ('deleted_at', '=', False)]).write({'is_primary': False})
+        Taxon = self.env['herbario.taxon'].sudo()
+        taxon_before = Taxon._specimen_contributions([vals.get('specimen_id')])
         record = super(HerbarioImage, self).create(vals)
-        self.env['herbario.history.log'].create({
+        Taxon._apply_contributions(taxon_before, Taxon._specimen_contributions(record.specimen_id.ids))
+        # Las miniaturas se generan fuera de la petición de subida; la cola es
+        # interna (sudo): los usuarios del herbario no tienen permisos sobre ella
+        self.env['herbario.image.job'].sudo()._enqueue(record)
+        self.env['herbario.history.log']._buffer_entries([{
             'specimen_id': record.specimen_id.id,
             'entity_type': 'image',
             'entity_id': record.id,
             'action_type': 'image_added',
-            'field_modified': None,
-            'old_value': None,
             'new_value': f'Nueva imagen: {record.filename_original}',
-            'user_id': self.env.user.id,
-            'user_name': self.env.user.name,
-        })
+        }])
+        self.env['herbario.statistics.cube'].refresh_specimens(record.specimen_id.ids)
+        self.env['herbario.page.cache']._invalidate_specimens(record.specimen_id)
         return record
 
     def write(self, vals):
         if vals.get('is_primary'):
             for record in self:
                 self.search([('specimen_id', '=', record.specimen_id.id), ('id', '!=', record.id), ('is_primary', '=', True), ('deleted_at', '=', False)]).write({'is_primary': False})
-        return super(HerbarioImage, self).write(vals)
+        specimen_ids = set(self.mapped('specimen_id').ids)
+        Taxon = self.env['herbario.taxon'].sudo()
+        taxon_tracked = any(field in vals for field in TAXON_IMAGE_FIELDS)
+        taxon_specimen_ids = specimen_ids | {vals.get('specimen_id')} if taxon_tracked else set()
+        taxon_before = Taxon._specimen_contributions(taxon_specimen_ids)
+        self.env['herbario.page.cache']._invalidate_specimens(self.specimen_id)
+        res = super(HerbarioImage, self).write(vals)
+        if taxon_tracked:
+            Taxon._apply_contributions(taxon_before, Taxon._specimen_contributions(taxon_specimen_ids))
+        if 'specimen_id' in vals:
+            self.env['herbario.page.cache']._invalidate_specimens(self.specimen_id)
+        if 'image_data' in vals:
+            self.env['herbario.image.job'].sudo()._enqueue(self)
+        if any(field in vals for field in STATS_IMAGE_FIELDS):
+            specimen_ids.update(self.mapped('specimen_id').ids)
+            self.env['herbario.statistics.cube'].refresh_specimens(specimen_ids)
+        return res
+
+    def _get_tile_dir(self):
+        """Directorio de la pirámide de teselas en el filestore, compartido por imágenes con el mismo hash"""
+        self.ensure_one()
+        if not self.file_hash:
+            return None
+        return os.path.join(config.filestore(self.env.cr.dbname), TILES_DIRECTORY,
+                            self.file_hash[:2], self.file_hash)
+
+    def _needs_tiles(self):
+        """Solo las imágenes grandes justifican una pirámide de teselas"""
+        self.ensure_one()
+        return max(self.image_width, self.image_height) > TILE_MIN_DIMENSION
+
+    def _get_tiles_url(self):
+        """URL del descriptor de la pirámide de teselas (tamaño, niveles y plantilla de URL)"""
+        self.ensure_one()
+        return f'/herbario/image/{self.id}/tiles/{self.file_hash}/info.json'
+
+    def _get_tiles_info(self):
+        """Descriptor de la pirámide que usa el visor de zoom de gallery.js"""
+        self.ensure_one()
+        return {
+            'width': self.image_width,
+            'height': self.image_height,
+            'tile_size': TILE_SIZE,
+            'max_level': tile_max_level(self.image_width, self.image_height),
+            'tile_url': f'/herbario/image/{self.id}/tiles/{self.file_hash}/{{level}}/{{col}}_{{row}}.jpg',
+        }
+
+    @api.model
+    def _create_from_file(self, vals, file_path, file_size, hashes=None):
+        """
+        Crea una imagen cuyo original es ``file_path``, sin cargarlo en memoria
+
+        El archivo se enlaza en el filestore (o se copia si está en otro sistema
+        de archivos) y queda marcado para el recolector de ir.attachment: si la
+        transacción o el savepoint se revierten, el archivo sin adjunto se
+        elimina en la siguiente limpieza. ``file_path`` no se modifica: el
+        llamador lo elimina cuando la transacción se confirma, de modo que un
+        reintento tras un error de serialización lo encuentra intacto.
+        ``hashes`` (``{'sha1', 'sha256'}``)
+        evita releer el archivo cuando el llamador ya los calculó al recibirlo;
+        los metadatos se guardan al crear y las miniaturas quedan en la cola.
+        """
+        Attachment = self.env['ir.attachment'].sudo()
+        hashes = hashes or hash_file(file_path)
+        with open(file_path, 'rb') as source:
+            head = source.read(1024)
+            source.seek(0)
+            metadata = read_image_header(source)
+
+        # Mismo esquema de nombres y registro para la limpieza que ir.attachment._file_write
+        checksum = hashes['sha1']
+        store_fname = f'{checksum[:2]}/{checksum}'
+        full_path = Attachment._full_path(store_fname)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            try:
+                os.link(file_path, full_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # Otro sistema de archivos: copia completa y renombrado atómico
+                shutil.copyfile(file_path, f'{full_path}.part')
+                os.replace(f'{full_path}.part', full_path)
+        Attachment._mark_for_gc(store_fname)
+
+        image = self.create(dict(
+            vals,
+            mime_type=guess_mimetype(head, default='image/jpeg'),
+            file_hash=hashes['sha256'],
+            file_size=file_size,
+            **metadata,
+        ))
+        # Valor de image_data: el adjunto se crea en la misma transacción que la imagen
+        Attachment.create({
+            'name': 'image_data',
+            'res_model': self._name,
+            'res_field': 'image_data',
+            'res_id': image.id,
+            'type': 'binary',
+            'store_fname': store_fname,
+            'checksum': checksum,
+            'file_size': file_size,
+            'mimetype': image.mime_type,
+        })
+        image.invalidate_recordset(['image_data'])
+        return image
+
+    def _derivatives_ready(self):
+        """Indica si las miniaturas ya fueron generadas (registros previos a la cola no tienen estado)"""
+        self.ensure_one()
+        return self.derivatives_state in (False, 'done')
 
     def unlink(self):
-        for record in self:
-            record.write({'deleted_at': fields.Datetime.now()})
+        self.write({'deleted_at': fields.Datetime.now()})
         return True
 
     def action_set_as_primary(self):
@@ -300,22 +622,16 @@ class HerbarioImage(models.Model):
         self.search([('specimen_id', '=', self.specimen_id.id), ('id', '!=', self.id), ('is_primary', '=', True), ('deleted_at', '=', False)]).write({'is_primary': False})
         self.write({'is_primary': True})
 
-    def _extract_exif(self, image_data_base64):
-        try:
-            image_bytes = base64.b64decode(image_data_base64)
-            image_stream = BytesIO(image_bytes)
-            image = Image.open(image_stream)
-            exif_dict = {}
-            if hasattr(image, '_getexif') and image._getexif():
-                exif = image._getexif()
-                from PIL.ExifTags import TAGS
-                for tag_id, value in exif.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag in ['Make', 'Model', 'DateTime', 'DateTimeOriginal']:
-                        exif_dict[tag.lower()] = str(value)
-            return json.dumps(exif_dict) if exif_dict else None
-        except Exception:
-            return None
+    def _get_image_url(self, variant='medium'):
+        """URL pública de una variante; el hash del contenido la hace inmutable y cacheable"""
+        self.ensure_one()
+        if variant not in IMAGE_VARIANT_FIELDS:
+            raise ValueError(f'Variante de imagen desconocida: {variant}')
+        unique = self.file_hash or fields.Datetime.to_string(self.write_date).replace(' ', '_')
+        if variant != 'full' and not self._derivatives_ready():
+            # Mientras se genera la miniatura la URL no debe quedar cacheada como inmutable
+            unique = f'{unique}-pending'
+        return f'/herbario/image/{self.id}/{variant}/{unique}'
 
     def name_get(self):
         result = []
@@ -0,0 +1,216 @@
+from odoo import models, fields, api
+from .image import render_thumbnails, render_tile_pyramid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+import base64
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Trabajos tomados por lote: cada uno decodifica la imagen a resolución completa
+# (y puede generar su pirámide de teselas), así que los lotes son pequeños
+JOB_BATCH_SIZE = 8
+# Procesos del pool como máximo, sea cual sea el número de CPU
+JOB_MAX_WORKERS = 4
+# Segundos de trabajo por ejecución del cron, por debajo de limit_time_real (120 s
+# por defecto); al agotarlos el cron se vuelve a lanzar
+JOB_TIME_BUDGET = 60
+# Reintentos antes de marcar el trabajo como fallido
+JOB_MAX_ATTEMPTS = 3
+# Espera antes de reintentar: base * número de intento
+JOB_RETRY_DELAY_MINUTES = 5
+# Trabajos en ejecución más antiguos que esto se consideran abandonados (worker caído)
+JOB_STALE_MINUTES = 30
+
+
+def _run_render_job(source, tile_dir=None):
+    """Genera miniaturas (y teselas si se indica directorio) en un proceso del pool y mide el tiempo"""
+    started = time.monotonic()
+    values = render_thumbnails(source)
+    if tile_dir:
+        render_tile_pyramid(source, tile_dir)
+    return values, time.monotonic() - started
+
+
+class HerbarioImageJob(models.Model):
+    _name = 'herbario.image.job'
+    _description = 'Cola de Generación de Miniaturas y Teselas'
+    _order = 'id desc'
+    _rec_name = 'image_id'
+
+    image_id = fields.Many2one(
+        'herbario.image',
+        string='Imagen',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En Proceso'),
+        ('done', 'Completado'),
+        ('failed', 'Fallido')
+    ], string='Estado', default='pending', required=True, index=True)
+
+    # Reintentos
+    attempts = fields.Integer(string='Intentos', default=0, readonly=True)
+    next_attempt_at = fields.Datetime(
+        string='Próximo Intento',
+        default=fields.Datetime.now,
+        index=True
+    )
+    error_message = fields.Text(string='Último Error', readonly=True)
+
+    # Tiempos
+    enqueued_at = fields.Datetime(string='Encolado', default=fields.Datetime.now, readonly=True)
+    started_at = fields.Datetime(string='Inicio', readonly=True)
+    finished_at = fields.Datetime(string='Fin', readonly=True)
+    duration = fields.Float(
+        string='Duración (s)',
+        digits=(10, 3),
+        readonly=True,
+        help='Tiempo real transcurrido generando miniaturas y teselas'
+    )
+
+    @api.model
+    def _enqueue(self, images):
+        """Encola la generación de miniaturas de las imágenes y despierta al cron"""
+        if not images:
+            return self.browse()
+        # Un trabajo pendiente previo de la misma imagen queda reemplazado
+        self.search([('image_id', 'in', images.ids), ('state', '=', 'pending')]).unlink()
+        jobs = self.create([{'image_id': image.id} for image in images])
+        images.write({'derivatives_state': 'pending', 'has_tiles': False})
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_image_jobs', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return jobs
+
+    @api.model
+    def _claim_jobs(self, limit):
+        """Reserva trabajos pendientes; SKIP LOCKED permite varios workers en paralelo"""
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT id
+              FROM herbario_image_job
+             WHERE state = 'pending'
+               AND (next_attempt_at IS NULL OR next_attempt_at <= (now() at time zone 'UTC'))
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [limit])
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        jobs.write({'state': 'running', 'started_at': fields.Datetime.now()})
+        return jobs
+
+    @api.model
+    def _requeue_stale_jobs(self):
+        """
+        Devuelve a la cola los trabajos que quedaron en ejecución por una caída
+        del worker; cuenta como un intento, de modo que una imagen que tumba el
+        worker acaba marcada como fallida
+        """
+        limit_date = fields.Datetime.now() - timedelta(minutes=JOB_STALE_MINUTES)
+        stale_jobs = self.search([('state', '=', 'running'), ('started_at', '<', limit_date)])
+        for job in stale_jobs:
+            job._mark_failed('El trabajo quedó interrumpido (caída o tiempo límite del worker)')
+
+    @api.model
+    def _cron_process_queue(self, batch_size=JOB_BATCH_SIZE, max_workers=None, auto_commit=True,
+                            time_budget=JOB_TIME_BUDGET):
+        """
+        Vacía la cola de miniaturas
+
+        El trabajo de PIL (CPU) se reparte en un ProcessPoolExecutor; los procesos
+        reciben la ruta del archivo en el filestore y solo devuelven los PNG, el
+        ORM se usa únicamente en este proceso. Cada ejecución trabaja como mucho
+        ``time_budget`` segundos (se comprueba entre lotes); si quedan trabajos,
+        el cron se vuelve a lanzar de inmediato.
+        """
+        self._requeue_stale_jobs()
+        deadline = time.monotonic() + time_budget if time_budget else None
+        while True:
+            jobs = self._claim_jobs(batch_size)
+            if not jobs:
+                break
+            if auto_commit:
+                self.env.cr.commit()
+            jobs._process(max_workers=max_workers)
+            if auto_commit:
+                self.env.cr.commit()
+            if deadline and time.monotonic() >= deadline:
+                self.env.ref('herbario_espoch.ir_cron_herbario_image_jobs')._trigger()
+                break
+
+    def _process(self, max_workers=None):
+        """Genera las miniaturas de los trabajos y registra el resultado de cada uno"""
+        sources = self.image_id._get_image_sources()
+        workers = max_workers or min(len(self), os.cpu_count() or 1, JOB_MAX_WORKERS)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for job in self:
+                source = sources.get(job.image_id.id)
+                if source is None:
+                    job._mark_failed('La imagen no tiene archivo original')
+                    continue
+                # Sin hash no hay directorio de teselas: la imagen queda sin pirámide
+                tile_dir = job.image_id._needs_tiles() and job.image_id._get_tile_dir()
+                render_dir = tile_dir
+                if tile_dir and os.path.isdir(tile_dir):
+                    # Pirámide ya generada para el mismo contenido
+                    render_dir = None
+                futures[executor.submit(_run_render_job, source, render_dir)] = (job, bool(tile_dir))
+
+            for future in as_completed(futures):
+                job, has_tiles = futures[future]
+                try:
+                    values, duration = future.result()
+                except Exception as e:
+                    _logger.warning("[HerbarioImageJob] Error generando miniaturas de la imagen %s: %s",
+                                    job.image_id.id, e)
+                    job._mark_failed(str(e))
+                    continue
+                job.image_id.write(dict(
+                    {field_name: base64.b64encode(data) for field_name, data in values.items()},
+                    derivatives_state='done',
+                    has_tiles=has_tiles,
+                ))
+                job.write({
+                    'state': 'done',
+                    'attempts': job.attempts + 1,
+                    'finished_at': fields.Datetime.now(),
+                    'duration': duration,
+                    'error_message': False,
+                })
+
+    def _mark_failed(self, error_message):
+        """Programa un reintento o marca el trabajo como fallido al agotar los intentos"""
+        self.ensure_one()
+        attempts = self.attempts + 1
+        vals = {
+            'attempts': attempts,
+            'finished_at': fields.Datetime.now(),
+            'error_message': error_message,
+        }
+        if attempts >= JOB_MAX_ATTEMPTS:
+            vals['state'] = 'failed'
+            self.image_id.write({'derivatives_state': 'failed'})
+        else:
+            vals['state'] = 'pending'
+            vals['next_attempt_at'] = fields.Datetime.now() + timedelta(minutes=JOB_RETRY_DELAY_MINUTES * attempts)
+        self.write(vals)
+
+    def action_retry(self):
+        """Acción para volver a encolar trabajos fallidos"""
+        self.write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_at': fields.Datetime.now(),
+            'error_message': False,
+        })
+        self.image_id.write({'derivatives_state': 'pending'})
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_image_jobs', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
@@ -0,0 +1,583 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import config, split_every
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from xml.etree import ElementTree
+import csv
+import glob
+import hashlib
+import io
+import logging
+import os
+import time
+import uuid
+import zipfile
+
+_logger = logging.getLogger(__name__)
+
+# Filas por bloque: creación en lote, punto de control y commit
+IMPORT_BATCH_SIZE = 500
+# Filas por bloque cuando hay imágenes (zip o carpeta): copiar y registrar las imágenes
+# de un bloque debe caber holgadamente en lo que queda de IMPORT_TIME_BUDGET
+IMPORT_IMAGE_BATCH_SIZE = 20
+# Bloque de lectura al copiar imágenes
+IMPORT_IO_BLOCK = 1024 * 1024
+# Segundos de trabajo por ejecución del cron, por debajo de limit_time_real (120 s
+# por defecto); al agotarlos se confirma el bloque y el cron se vuelve a lanzar
+IMPORT_TIME_BUDGET = 90
+IMPORT_DELIMITERS = (',', ';', '\t')
+IMPORT_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp')
+# Directorio del servidor bajo el que deben estar las carpetas de imágenes
+IMPORT_ROOT_PARAM = 'herbario_espoch.import_root'
+
+DWC_TEXT = 'http://rs.tdwg.org/dwc/text/'
+
+# Columnas aceptadas (en minúsculas): nombre del campo o término Darwin Core
+IMPORT_SPECIMEN_COLUMNS = {
+    'codigo_herbario': ['codigo_herbario', 'catalognumber'],
+    'numero_cartulina': ['numero_cartulina'],
+    'nombre_cientifico': ['nombre_cientifico', 'scientificname'],
+    'familia': ['familia', 'family'],
+    'autor_cientifico': ['autor_cientifico', 'scientificnameauthorship'],
+    'determinado_por': ['determinado_por', 'identifiedby'],
+    'fenologia': ['fenologia', 'reproductivecondition'],
+    'descripcion_especie': ['descripcion_especie'],
+}
+IMPORT_SITE_COLUMNS = {
+    'colector': ['colector', 'recordedby'],
+    'numero_coleccion': ['numero_coleccion', 'recordnumber'],
+    'fecha_recoleccion': ['fecha_recoleccion', 'eventdate'],
+    'metodo_recoleccion': ['metodo_recoleccion', 'samplingprotocol'],
+    'pais': ['pais', 'country'],
+    'provincia': ['provincia', 'stateprovince'],
+    'canton': ['canton', 'county'],
+    'localidad': ['localidad', 'locality'],
+    'vecindad': ['vecindad'],
+    'latitud': ['latitud', 'decimallatitude'],
+    'longitud': ['longitud', 'decimallongitude'],
+    'altitud': ['altitud', 'minimumelevationinmeters'],
+}
+IMPORT_IMAGE_COLUMNS = ['imagenes', 'associatedmedia']
+
+
+def _column_targets():
+    targets = {}
+    for field, aliases in list(IMPORT_SPECIMEN_COLUMNS.items()) + list(IMPORT_SITE_COLUMNS.items()):
+        for alias in aliases:
+            targets[alias] = field
+    for alias in IMPORT_IMAGE_COLUMNS:
+        targets[alias] = 'imagenes'
+    return targets
+
+
+def _map_columns(header):
+    """``{índice: campo}`` de las columnas reconocidas de la cabecera"""
+    targets = _column_targets()
+    columns = {}
+    for index, name in enumerate(header):
+        target = targets.get(name.strip().rsplit('/', 1)[-1].lower())
+        if target and target not in columns.values():
+            columns[index] = target
+    missing = {'nombre_cientifico', 'familia'} - set(columns.values())
+    if missing:
+        raise UserError(f'Faltan columnas obligatorias en el archivo: {", ".join(sorted(missing))}.')
+    return columns
+
+
+def _dwca_core_file(archive):
+    """
+    Archivo núcleo de un zip: el de meta.xml (Darwin Core Archive) con su
+    separador, comillas y cabecera, o el primer CSV/TXT
+    """
+    names = archive.namelist()
+    if 'meta.xml' in names:
+        core = ElementTree.fromstring(archive.read('meta.xml')).find(f'{{{DWC_TEXT}}}core')
+        if core is not None:
+            location = core.findtext(f'{{{DWC_TEXT}}}files/{{{DWC_TEXT}}}location')
+            terms = {int(field.get('index')): field.get('term')
+                     for field in core.findall(f'{{{DWC_TEXT}}}field') if field.get('index')}
+            header = [terms.get(index, '') for index in range(max(terms) + 1)] if terms else None
+            return {
+                'member': location,
+                'delimiter': core.get('fieldsTerminatedBy', '\\t').encode().decode('unicode_escape'),
+                'quotechar': core.get('fieldsEnclosedBy', '"'),
+                'header': header,
+                'skip_lines': int(core.get('ignoreHeaderLines') or 0),
+            }
+    for name in names:
+        if name.lower().endswith(('.csv', '.txt')):
+            return {'member': name}
+    raise UserError('El archivo zip no contiene un CSV ni un Darwin Core Archive.')
+
+
+def _iter_csv(raw, delimiter=None, quotechar='"', header=None, skip_lines=0):
+    """
+    Recorre un CSV en streaming: ``(número de fila, {campo: valor})``
+
+    Sin ``header`` (meta.xml) la primera línea es la cabecera y, sin
+    ``delimiter``, el separador es el más frecuente en ella.
+    """
+    text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    if header is None:
+        header_line = text.readline()
+        delimiter = delimiter or max(IMPORT_DELIMITERS, key=header_line.count)
+        header = next(csv.reader([header_line], delimiter=delimiter), [])
+    else:
+        for _line in range(skip_lines):
+            text.readline()
+    columns = _map_columns(header)
+    reader_options = {'delimiter': delimiter or ','}
+    if quotechar:
+        reader_options['quotechar'] = quotechar
+    else:
+        reader_options['quoting'] = csv.QUOTE_NONE
+    for row_number, row in enumerate(csv.reader(text, **reader_options), start=1):
+        if any(cell.strip() for cell in row):
+            yield row_number, {target: row[index] for index, target in columns.items() if index < len(row)}
+
+
+def _is_image_name(name):
+    return name.lower().endswith(IMPORT_IMAGE_EXTENSIONS)
+
+
+def _image_code(name):
+    """Código de herbario de un archivo ``<codigo>.jpg`` o ``<codigo>_<n>.jpg``"""
+    return os.path.splitext(os.path.basename(name))[0].split('_')[0].lower()
+
+
+class HerbarioImportJob(models.Model):
+    _name = 'herbario.import.job'
+    _description = 'Importación Masiva de Especímenes'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(string='Descripción', required=True, default='Importación masiva')
+    data_file = fields.Binary(
+        string='Archivo de Datos',
+        attachment=True,
+        required=True,
+        help='CSV (separado por comas, punto y coma o tabuladores) o Darwin Core Archive (.zip)'
+    )
+    data_filename = fields.Char(string='Nombre del Archivo')
+    image_archive = fields.Binary(
+        string='Imágenes (zip)',
+        attachment=True,
+        help='Zip con las imágenes: <codigo_herbario>.jpg, <codigo_herbario>_2.jpg... '
+             'o los nombres indicados en la columna imagenes/associatedMedia'
+    )
+    image_archive_filename = fields.Char(string='Nombre del Zip')
+    image_folder = fields.Char(
+        string='Carpeta de Imágenes',
+        help='Carpeta del servidor con las imágenes, dentro del directorio de importación'
+    )
+    image_type = fields.Selection([
+        ('general', 'General'),
+        ('flower', 'Flor'),
+        ('fruit', 'Fruto'),
+        ('leaf', 'Hoja'),
+    ], string='Tipo de Imagen', default='general', required=True)
+
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('queued', 'En Cola'),
+        ('running', 'En Proceso'),
+        ('done', 'Completado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='draft', required=True, readonly=True, index=True)
+    total_rows = fields.Integer(string='Filas', readonly=True)
+    last_row = fields.Integer(
+        string='Última Fila Procesada',
+        readonly=True,
+        help='Punto de control: al reanudar se continúa desde la fila siguiente'
+    )
+    created_count = fields.Integer(string='Especímenes Creados', readonly=True)
+    duplicate_count = fields.Integer(string='Especímenes Existentes', readonly=True)
+    error_count = fields.Integer(string='Filas con Error', readonly=True)
+    image_count = fields.Integer(string='Imágenes Creadas', readonly=True)
+    image_duplicate_count = fields.Integer(string='Imágenes Repetidas', readonly=True)
+    progress = fields.Float(string='Progreso', compute='_compute_progress')
+    duration = fields.Float(string='Duración (s)', digits=(10, 2), readonly=True)
+    error_message = fields.Text(string='Error', readonly=True)
+    error_ids = fields.One2many('herbario.import.error', 'job_id', string='Errores por Fila', readonly=True)
+
+    @api.depends('last_row', 'total_rows')
+    def _compute_progress(self):
+        for job in self:
+            job.progress = 100.0 * job.last_row / job.total_rows if job.total_rows else 0.0
+
+    @api.constrains('image_folder')
+    def _check_image_folder(self):
+        root = os.path.realpath(self._get_import_root())
+        for job in self:
+            if job.image_folder:
+                folder = os.path.realpath(job.image_folder)
+                if os.path.commonpath([root, folder]) != root or not os.path.isdir(folder):
+                    raise ValidationError(f'La carpeta de imágenes debe existir dentro de {root}.')
+
+    @api.model
+    def _get_import_root(self):
+        return (self.env['ir.config_parameter'].sudo().get_param(IMPORT_ROOT_PARAM)
+                or os.path.join(config['data_dir'], 'herbario_import'))
+
+    # ==================== LECTURA EN STREAMING ====================
+
+    @contextmanager
+    def _open_binary(self, field_name):
+        """Archivo adjunto del campo, abierto desde el filestore sin cargarlo en memoria"""
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', field_name),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if attachment.store_fname:
+            with open(attachment._full_path(attachment.store_fname), 'rb') as stream:
+                yield stream
+        else:
+            yield io.BytesIO(attachment.raw or b'')
+
+    def _iter_data_rows(self):
+        """Filas del archivo de datos, de una en una"""
+        with self._open_binary('data_file') as stream:
+            if zipfile.is_zipfile(stream):
+                stream.seek(0)
+                with zipfile.ZipFile(stream) as archive:
+                    core = _dwca_core_file(archive)
+                    with archive.open(core.pop('member')) as raw:
+                        yield from _iter_csv(raw, **core)
+            else:
+                stream.seek(0)
+                yield from _iter_csv(stream)
+
+    @contextmanager
+    def _open_images(self):
+        """
+        Índice de las imágenes del zip y de la carpeta: ``{nombre en minúsculas:
+        (zip o None, miembro o ruta, nombre original)}`` y nombres por código
+        """
+        self.ensure_one()
+        with ExitStack() as stack:
+            index = {}
+            if self.image_archive:
+                archive = stack.enter_context(zipfile.ZipFile(stack.enter_context(self._open_binary('image_archive'))))
+                for info in archive.infolist():
+                    if not info.is_dir() and _is_image_name(info.filename):
+                        name = os.path.basename(info.filename)
+                        index.setdefault(name.lower(), (archive, info, name))
+            if self.image_folder:
+                for dirpath, _dirnames, filenames in os.walk(self.image_folder):
+                    for name in filenames:
+                        if _is_image_name(name):
+                            index.setdefault(name.lower(), (None, os.path.join(dirpath, name), name))
+            by_code = defaultdict(list)
+            for key in sorted(index):
+                by_code[_image_code(key)].append(key)
+            yield index, by_code
+
+    # ==================== IMPORTACIÓN ====================
+
+    def _parse_row(self, values):
+        """Valores del espécimen, de su ubicación (o None) y nombres de imágenes de una fila"""
+        values = {field: (value or '').strip() for field, value in values.items()}
+        specimen_vals = {field: values[field] for field in IMPORT_SPECIMEN_COLUMNS if values.get(field)}
+        if not specimen_vals.get('nombre_cientifico') or not specimen_vals.get('familia'):
+            raise ValueError('Faltan el nombre científico o la familia.')
+        if 'numero_cartulina' in specimen_vals:
+            specimen_vals['numero_cartulina'] = int(specimen_vals['numero_cartulina'])
+
+        site_vals = {field: values[field] for field in IMPORT_SITE_COLUMNS if values.get(field)}
+        for field in ('latitud', 'longitud'):
+            if field in site_vals:
+                site_vals[field] = float(site_vals[field].replace(',', '.'))
+        if 'altitud' in site_vals:
+            site_vals['altitud'] = round(float(site_vals['altitud'].replace(',', '.')))
+        if 'fecha_recoleccion' in site_vals:
+            # eventDate puede ser un intervalo (AAAA-MM-DD/AAAA-MM-DD): se toma el inicio
+            site_vals['fecha_recoleccion'] = fields.Date.to_date(site_vals['fecha_recoleccion'][:10])
+
+        image_names = [
+            os.path.basename(name.strip()).lower()
+            for name in values.get('imagenes', '').replace(';', '|').split('|') if name.strip()
+        ]
+        return specimen_vals, site_vals or None, image_names
+
+    def _create_specimens(self, pending, errors):
+        """
+        Crea los especímenes (y sus ubicaciones) con un ``create`` por modelo
+
+        Si el lote falla se reintenta fila por fila, cada una en su savepoint,
+        para aislar las filas con error. Las entradas de historial acumuladas
+        dentro de un savepoint revertido se descartan con él (ver
+        ``herbario.history.log._buffer_entries``).
+        """
+        Specimen = self.env['herbario.specimen'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_create_nosubscribe=True,
+        )
+        CollectionSite = self.env['herbario.collection.site']
+
+        def create(rows):
+            specimens = Specimen.create([specimen_vals for _row, specimen_vals, _site, _images in rows])
+            CollectionSite.create([
+                dict(site_vals, specimen_id=specimen.id)
+                for (_row, _vals, site_vals, _images), specimen in zip(rows, specimens) if site_vals
+            ])
+            return {row[0]: specimen.id for row, specimen in zip(rows, specimens)}
+
+        try:
+            with self.env.cr.savepoint():
+                return create(pending)
+        except Exception as e:
+            if len(pending) == 1:
+                errors.append((pending[0][0], pending[0][1].get('codigo_herbario'), str(e)))
+                return {}
+        created = {}
+        for row in pending:
+            try:
+                with self.env.cr.savepoint():
+                    created.update(create([row]))
+            except Exception as e:
+                errors.append((row[0], row[1].get('codigo_herbario'), str(e)))
+        return created
+
+    def _import_image(self, specimen_id, source, upload_dir):
+        """
+        Copia una imagen al directorio temporal calculando sus hashes y la crea
+        si el espécimen no la tiene ya; devuelve False si estaba repetida
+
+        El archivo se mueve al filestore marcado para la limpieza de
+        ir.attachment, así que un savepoint revertido no lo deja huérfano.
+        """
+        archive, ref, name = source
+        Image = self.env['herbario.image']
+        temp_path = os.path.join(upload_dir, f'import_{self.id}_{uuid.uuid4().hex}.part')
+        try:
+            sha1 = hashlib.sha1()
+            sha256 = hashlib.sha256()
+            file_size = 0
+            with (archive.open(ref) if archive else open(ref, 'rb')) as stream, open(temp_path, 'wb') as target:
+                for block in iter(lambda: stream.read(IMPORT_IO_BLOCK), b''):
+                    sha1.update(block)
+                    sha256.update(block)
+                    target.write(block)
+                    file_size += len(block)
+            if Image.search_count([
+                ('specimen_id', '=', specimen_id),
+                ('file_hash', '=', sha256.hexdigest()),
+                ('deleted_at', '=', False),
+            ]):
+                return False
+            Image._create_from_file({
+                'specimen_id': specimen_id,
+                'filename_original': name,
+                'image_type': self.image_type,
+            }, temp_path, file_size, hashes={'sha1': sha1.hexdigest(), 'sha256': sha256.hexdigest()})
+            return True
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _import_chunk(self, rows, images):
+        """
+        Importa un bloque de filas: duplicados por código y por nombre científico
+        + familia, creación en lote, imágenes y punto de control
+        """
+        self.ensure_one()
+        index, by_code = images
+        errors = []
+        parsed = []
+        for row_number, values in rows:
+            try:
+                parsed.append((row_number, *self._parse_row(values)))
+            except (ValueError, TypeError) as e:
+                errors.append((row_number, values.get('codigo_herbario'), str(e)))
+
+        # Especímenes existentes: por código y por nombre científico + familia (restricción del modelo)
+        Specimen = self.env['herbario.specimen']
+        codes = [row[1]['codigo_herbario'] for row in parsed if row[1].get('codigo_herbario')]
+        existing_codes = {
+            record['codigo_herbario']: record['id']
+            for record in Specimen.search_read([('codigo_herbario', 'in', codes)], ['codigo_herbario'])
+        } if codes else {}
+        pairs = {(row[1]['nombre_cientifico'], row[1]['familia']) for row in parsed}
+        Specimen.flush_model(['nombre_cientifico', 'familia'])
+        self.env.cr.execute("""
+            SELECT nombre_cientifico, familia
+              FROM herbario_specimen
+             WHERE (nombre_cientifico, familia) IN %s
+        """, [tuple(pairs) or ((None, None),)])
+        existing_pairs = set(self.env.cr.fetchall())
+
+        specimen_by_row = {}
+        pending = []
+        seen_codes = set()
+        duplicate_count = 0
+        for row in parsed:
+            row_number, specimen_vals = row[0], row[1]
+            code = specimen_vals.get('codigo_herbario')
+            pair = (specimen_vals['nombre_cientifico'], specimen_vals['familia'])
+            if code in existing_codes:
+                # Ya importado (o reanudación): solo se completan sus imágenes
+                specimen_by_row[row_number] = existing_codes[code]
+                duplicate_count += 1
+            elif code and code in seen_codes:
+                errors.append((row_number, code, 'Código de herbario repetido en el archivo.'))
+            elif pair in existing_pairs:
+                errors.append((row_number, code, f'Ya existe un espécimen "{pair[0]}" de la familia "{pair[1]}".'))
+            else:
+                seen_codes.add(code)
+                existing_pairs.add(pair)
+                pending.append(row)
+        if pending:
+            specimen_by_row.update(self._create_specimens(pending, errors))
+
+        # Imágenes: las de la columna o las que empiezan por el código del espécimen
+        upload_dir = self.env['herbario.upload.session']._get_upload_dir()
+        image_count = image_duplicate_count = 0
+        if index:
+            codes_by_id = {
+                record['id']: record['codigo_herbario']
+                for record in Specimen.browse(set(specimen_by_row.values())).read(['codigo_herbario'])
+            }
+            for row_number, _vals, _site, image_names in parsed:
+                specimen_id = specimen_by_row.get(row_number)
+                if not specimen_id:
+                    continue
+                for name in image_names or by_code.get(codes_by_id[specimen_id].lower(), []):
+                    if name not in index:
+                        errors.append((row_number, codes_by_id[specimen_id], f'Imagen no encontrada: {name}'))
+                        continue
+                    try:
+                        with self.env.cr.savepoint():
+                            if self._import_image(specimen_id, index[name], upload_dir):
+                                image_count += 1
+                            else:
+                                image_duplicate_count += 1
+                    except Exception as e:
+                        errors.append((row_number, codes_by_id[specimen_id], f'Imagen {name}: {e}'))
+
+        self.env['herbario.import.error'].create([{
+            'job_id': self.id,
+            'row_number': row_number,
+            'codigo_herbario': code or False,
+            'message': message,
+        } for row_number, code, message in errors])
+        self.write({
+            'last_row': rows[-1][0],
+            'created_count': self.created_count + len(specimen_by_row) - duplicate_count,
+            'duplicate_count': self.duplicate_count + duplicate_count,
+            'error_count': self.error_count + len({error[0] for error in errors}),
+            'image_count': self.image_count + image_count,
+            'image_duplicate_count': self.image_duplicate_count + image_duplicate_count,
+        })
+
+    def _process(self, auto_commit=True, deadline=None):
+        """
+        Importa el archivo en bloques de IMPORT_BATCH_SIZE filas (o de
+        IMPORT_IMAGE_BATCH_SIZE si hay imágenes)
+
+        Cada bloque se confirma con su punto de control (``last_row``), de modo
+        que tras una caída la importación continúa desde la fila siguiente; las
+        filas ya importadas de un bloque interrumpido se reconocen por su código.
+        El archivo se lee en streaming: en memoria solo están el bloque actual y
+        el índice de nombres de las imágenes.
+
+        Si se alcanza ``deadline`` (``time.monotonic()``) tras confirmar un
+        bloque, se detiene y devuelve False; la importación sigue en ejecución y
+        continúa en la siguiente llamada. Con imágenes el bloque es pequeño para
+        que el último no lleve la ejecución más allá de limit_time_real.
+        """
+        self.ensure_one()
+        started = time.monotonic()
+        self._cleanup_temp_files()
+        if not self.total_rows:
+            self.total_rows = sum(1 for _row in self._iter_data_rows())
+        self.write({'state': 'running', 'error_message': False})
+        if auto_commit:
+            self.env.cr.commit()
+
+        resume_from = self.last_row
+        with self._open_images() as images:
+            rows = (row for row in self._iter_data_rows() if row[0] > resume_from)
+            batch_size = IMPORT_IMAGE_BATCH_SIZE if images[0] else IMPORT_BATCH_SIZE
+            for chunk in split_every(batch_size, rows, list):
+                self._import_chunk(chunk, images)
+                if auto_commit:
+                    self.env.cr.commit()
+                    # Los registros ya guardados no necesitan seguir en memoria
+                    self.env.invalidate_all()
+                if deadline and time.monotonic() >= deadline:
+                    self.write({'duration': self.duration + time.monotonic() - started})
+                    _logger.info("[HerbarioImport] Importación %s pausada en la fila %s (tiempo por ejecución agotado)",
+                                 self.id, self.last_row)
+                    return False
+
+        self.write({'state': 'done', 'duration': self.duration + time.monotonic() - started})
+        _logger.info("[HerbarioImport] Importación %s: %s especímenes y %s imágenes creados, %s filas con error",
+                     self.id, self.created_count, self.image_count, self.error_count)
+        return True
+
+    def _cleanup_temp_files(self):
+        """Copias temporales de imágenes que dejó una ejecución interrumpida (worker terminado)"""
+        upload_dir = self.env['herbario.upload.session']._get_upload_dir()
+        for path in glob.glob(os.path.join(upload_dir, f'import_{self.id}_*.part')):
+            try:
+                os.unlink(path)
+            except OSError as e:
+                _logger.warning("[HerbarioImport] No se pudo eliminar %s: %s", path, e)
+
+    @api.model
+    def _cron_process_jobs(self, auto_commit=True, time_budget=IMPORT_TIME_BUDGET):
+        """
+        Procesa las importaciones en cola y reanuda las interrumpidas
+
+        Cada ejecución trabaja como mucho ``time_budget`` segundos para no ser
+        terminada por el límite del worker; si quedan filas, el cron se vuelve a
+        lanzar de inmediato.
+        """
+        deadline = time.monotonic() + time_budget if time_budget else None
+        for job in self.search([('state', 'in', ('queued', 'running'))], order='id'):
+            finished = True
+            try:
+                finished = job._process(auto_commit=auto_commit, deadline=deadline)
+            except Exception as e:
+                _logger.exception("[HerbarioImport] Error en la importación %s", job.id)
+                if auto_commit:
+                    self.env.cr.rollback()
+                job.write({'state': 'failed', 'error_message': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+            if not finished or (deadline and time.monotonic() >= deadline):
+                self.env.ref('herbario_espoch.ir_cron_herbario_import')._trigger()
+                break
+
+    # ==================== ACCIONES ====================
+
+    def action_start(self):
+        """La importación se delega al cron para no bloquear la petición web"""
+        for job in self:
+            if job.state not in ('draft', 'failed'):
+                raise UserError('La importación ya está en cola o procesada.')
+        self.write({'state': 'queued'})
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_import', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def action_restart(self):
+        """Vuelve a importar desde la primera fila (las ya importadas se omiten como existentes)"""
+        self.error_ids.sudo().unlink()
+        self.write({
+            'state': 'draft', 'total_rows': 0, 'last_row': 0, 'created_count': 0, 'duplicate_count': 0,
+            'error_count': 0, 'image_count': 0, 'image_duplicate_count': 0, 'duration': 0.0,
+        })
+        return self.action_start()
+
+
+class HerbarioImportError(models.Model):
+    _name = 'herbario.import.error'
+    _description = 'Error de Importación por Fila'
+    _order = 'job_id, row_number, id'
+
+    job_id = fields.Many2one('herbario.import.job', string='Importación', required=True, index=True, ondelete='cascade')
+    row_number = fields.Integer(string='Fila', readonly=True)
+    codigo_herbario = fields.Char(string='Código Herbario', readonly=True)
+    message = fields.Char(string='Error', readonly=True)
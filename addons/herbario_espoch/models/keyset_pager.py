@@ -0,0 +1,133 @@
+from odoo import models, api
+from odoo.tools import SQL
+import base64
+import json
+
+# Por encima de este número estimado de filas el total se informa aproximado
+APPROX_COUNT_THRESHOLD = 10000
+
+
+def encode_cursor(values, direction='next', tag=''):
+    """Cursor opaco para la URL: valores de las claves de orden de la fila límite"""
+    payload = json.dumps({'k': values, 'd': direction, 't': tag}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, tag=''):
+    """
+    Devuelve (valores, dirección); un cursor inválido o de otro orden (``tag``
+    distinto) equivale a la primera página
+    """
+    if not token:
+        return None, 'next'
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        values, direction = payload['k'], payload.get('d', 'next')
+    except (ValueError, TypeError, KeyError):
+        return None, 'next'
+    if not isinstance(values, list) or direction not in ('next', 'prev') or payload.get('t', '') != tag:
+        return None, 'next'
+    return values, direction
+
+
+class HerbarioKeysetPager(models.AbstractModel):
+    _name = 'herbario.keyset.pager'
+    _description = 'Paginación por Cursor del Herbario'
+
+    @api.model
+    def paginate(self, query, keys, cursor=None, limit=20, tag=''):
+        """
+        Página de ``query`` a partir de un cursor (paginación keyset)
+
+        ``keys`` es la lista de claves de orden ``(columna o expresión SQL,
+        'asc'|'desc')``, todas en la misma dirección y con la última única (id),
+        de modo que la página se obtiene con una comparación de filas sobre el
+        índice en lugar de un OFFSET: la página 500 cuesta lo mismo que la 1.
+
+        ``tag`` identifica el orden (p. ej. la opción de la URL) para descartar
+        cursores generados con otras claves. Devuelve ``{'ids', 'next_cursor',
+        'prev_cursor'}``.
+        """
+        table = query.table
+        exprs = [SQL.identifier(table, key) if isinstance(key, str) else key for key, _direction in keys]
+        descending = keys[0][1] == 'desc'
+        values, direction = decode_cursor(cursor, tag)
+        if values is not None and len(values) != len(exprs):
+            values, direction = None, 'next'
+        backwards = direction == 'prev' and values is not None
+
+        # Hacia atrás se recorre el orden inverso y luego se invierte la página
+        if values is not None:
+            forward_op = '<' if descending else '>'
+            op = {'<': '>', '>': '<'}[forward_op] if backwards else forward_op
+            query.add_where(SQL(
+                f"(%s) {op} (%s)",
+                SQL(", ").join(exprs),
+                SQL(", ").join(SQL("%s", value) for value in values),
+            ))
+        scan_desc = descending != backwards
+        query.order = SQL(", ").join(
+            SQL("%s DESC" if scan_desc else "%s ASC", expr) for expr in exprs
+        )
+        query.limit = limit + 1
+        query.offset = None
+
+        self.env.cr.execute(query.select(SQL(", ").join([SQL.identifier(table, 'id')] + exprs)))
+        rows = self.env.cr.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = encode_cursor(list(rows[-1][1:]), 'next', tag)
+            if values is not None and (has_more or not backwards):
+                prev_cursor = encode_cursor(list(rows[0][1:]), 'prev', tag)
+        return {
+            'ids': [row[0] for row in rows],
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+        }
+
+    @api.model
+    def cursor_at(self, query, keys, offset, tag=''):
+        """
+        Cursor 'next' que continúa después de las primeras ``offset`` filas
+
+        Usa un OFFSET, así que solo sirve para traducir una vez las URLs antiguas
+        por número de página; None si la consulta no tiene tantas filas.
+        """
+        if offset <= 0:
+            return None
+        table = query.table
+        exprs = [SQL.identifier(table, key) if isinstance(key, str) else key for key, _direction in keys]
+        query.order = SQL(", ").join(
+            SQL("%s DESC" if direction == 'desc' else "%s ASC", expr)
+            for expr, (_key, direction) in zip(exprs, keys)
+        )
+        query.limit = 1
+        query.offset = offset - 1
+        self.env.cr.execute(query.select(SQL(", ").join(exprs)))
+        row = self.env.cr.fetchone()
+        return row and encode_cursor(list(row), 'next', tag)
+
+    @api.model
+    def count(self, query, mode='auto'):
+        """
+        Número de filas de ``query``: devuelve ``(total, es_exacto)``
+
+        ``mode`` puede ser 'exact', 'approx' (estimación del planificador, sin
+        recorrer las filas) o 'auto' (exacto solo si la estimación es pequeña).
+        """
+        if mode in ('auto', 'approx'):
+            self.env.cr.execute(SQL("EXPLAIN (FORMAT JSON) %s", query.select(SQL("1"))))
+            plan = self.env.cr.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if mode == 'approx' or estimate > APPROX_COUNT_THRESHOLD:
+                return estimate, False
+        self.env.cr.execute(query.select(SQL("COUNT(*)")))
+        return self.env.cr.fetchone()[0], True
@@ -0,0 +1,206 @@
+from odoo import models, fields, api
+from contextlib import contextmanager
+from datetime import timedelta
+import hashlib
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Vida máxima de una página en caché (además de la invalidación por claves)
+PAGE_CACHE_TTL_MINUTES = 60
+# Marcador del token CSRF de la sesión dentro del HTML guardado
+CSRF_PLACEHOLDER = '__herbario_csrf_token__'
+
+# Claves sustitutas: todas las páginas que agregan especímenes (portada,
+# repositorio, estadísticas), la ficha de un espécimen y los relacionados de una familia
+SURROGATE_ALL_SPECIMENS = 'herbario:specimens'
+PAGE_CACHE_INVALIDATION_KEY = 'herbario.page.cache.invalidate'
+# Candado consultivo que ordena el guardado de páginas (compartido) frente a la
+# invalidación posterior al commit (exclusivo)
+PAGE_CACHE_LOCK_ID = 0x48455242
+
+
+def specimen_surrogate_key(specimen_id):
+    return f'herbario:specimen:{specimen_id}'
+
+
+def family_surrogate_key(familia):
+    return f'herbario:family:{familia}'
+
+
+class HerbarioPageCache(models.AbstractModel):
+    _name = 'herbario.page.cache'
+    _description = 'Caché de Páginas Públicas del Herbario'
+
+    # ==================== ESTRUCTURAS EN BASE DE DATOS ====================
+
+    def init(self):
+        """
+        Tabla compartida por todos los workers: HTML por clave de página con su
+        ETag y las claves sustitutas que lo invalidan
+        """
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS herbario_page_cache (
+                cache_key varchar PRIMARY KEY,
+                etag varchar NOT NULL,
+                html text NOT NULL,
+                surrogate_keys varchar[] NOT NULL,
+                created_at timestamp NOT NULL DEFAULT (now() at time zone 'UTC')
+            );
+            CREATE INDEX IF NOT EXISTS herbario_page_cache_surrogate_keys_idx
+                ON herbario_page_cache USING gin (surrogate_keys);
+            CREATE TABLE IF NOT EXISTS herbario_page_cache_invalidation (
+                id bigserial PRIMARY KEY,
+                txid bigint NOT NULL,
+                surrogate_keys varchar[] NOT NULL,
+                created_at timestamp NOT NULL DEFAULT (now() at time zone 'UTC')
+            );
+            CREATE INDEX IF NOT EXISTS herbario_page_cache_invalidation_surrogate_keys_idx
+                ON herbario_page_cache_invalidation USING gin (surrogate_keys);
+        """)
+
+    @contextmanager
+    def _locked_cursor(self, shared):
+        """
+        Cursor propio en READ COMMITTED con el candado de la caché
+
+        Cada sentencia posterior al candado ve lo confirmado hasta ese momento,
+        no la instantánea de la petición; se confirma al salir.
+        """
+        with self.env.registry.cursor() as cr:
+            cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            if shared:
+                cr.execute("SELECT pg_advisory_xact_lock_shared(%s)", [PAGE_CACHE_LOCK_ID])
+            else:
+                cr.execute("SELECT pg_advisory_xact_lock(%s)", [PAGE_CACHE_LOCK_ID])
+            yield cr
+
+    # ==================== LECTURA Y ESCRITURA ====================
+
+    @api.model
+    def _make_key(self, path, args, lang, website_id, cache_args=()):
+        """
+        Clave de la página: ruta, idioma, sitio web y los argumentos de
+        ``cache_args`` (los que la ruta usa); el resto de argumentos de la URL no
+        cambian el contenido y no deben multiplicar las entradas de la tabla
+        """
+        args = [(key, value) for key in sorted(cache_args) for value in args.getlist(key) if value]
+        payload = json.dumps([path, args, lang, website_id], separators=(',', ':'))
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    @api.model
+    def _make_etag(self, html):
+        """
+        ETag derivado del HTML guardado: cambia con cualquier dato que la página
+        muestre (también los relacionados que dependen de otros especímenes)
+        """
+        return hashlib.sha1(html.encode()).hexdigest()[:32]
+
+    @api.model
+    def _get(self, cache_key):
+        """``(etag, html)`` de la página si está en caché y no expiró"""
+        self.env.cr.execute("""
+            SELECT etag, html
+              FROM herbario_page_cache
+             WHERE cache_key = %s AND created_at > %s
+        """, [cache_key, fields.Datetime.now() - timedelta(minutes=PAGE_CACHE_TTL_MINUTES)])
+        return self.env.cr.fetchone()
+
+    @api.model
+    def _get_snapshot(self):
+        """Instantánea de la transacción (REPEATABLE READ): lo que ve el renderizado"""
+        self.env.cr.execute("SELECT txid_current_snapshot()::text")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _store(self, cache_key, etag, html, surrogate_keys, snapshot):
+        """
+        Guarda la página renderizada con la instantánea ``snapshot``
+
+        Si alguna transacción invisible para esa instantánea invalidó una de sus
+        claves, el HTML puede ser anterior a sus cambios y no se guarda: su
+        DELETE ya pudo ejecutarse antes de este INSERT. El guardado usa su propio
+        cursor, después del de cualquier invalidación posterior al commit (ver
+        ``_flush_invalidations``), y no reemplaza la página que otra petición
+        haya guardado entretanto.
+        """
+        expired = fields.Datetime.now() - timedelta(minutes=PAGE_CACHE_TTL_MINUTES)
+        with self._locked_cursor(shared=True) as cr:
+            cr.execute("DELETE FROM herbario_page_cache WHERE cache_key = %s AND created_at <= %s",
+                       [cache_key, expired])
+            cr.execute("""
+                INSERT INTO herbario_page_cache (cache_key, etag, html, surrogate_keys, created_at)
+                     SELECT %(key)s, %(etag)s, %(html)s, %(keys)s::varchar[], now() at time zone 'UTC'
+                      WHERE NOT EXISTS (
+                            SELECT 1
+                              FROM herbario_page_cache_invalidation
+                             WHERE surrogate_keys && %(keys)s::varchar[]
+                               AND NOT txid_visible_in_snapshot(txid, %(snapshot)s::txid_snapshot))
+                ON CONFLICT (cache_key) DO NOTHING
+            """, {'key': cache_key, 'etag': etag, 'html': html, 'keys': list(surrogate_keys),
+                  'snapshot': snapshot})
+
+    # ==================== INVALIDACIÓN ====================
+
+    @api.model
+    def _invalidate(self, surrogate_keys):
+        """
+        Invalida las páginas con alguna de las claves sustitutas
+
+        Las claves se acumulan en la transacción y se eliminan las páginas con un
+        único DELETE antes del commit; si la transacción se revierte no se invalida
+        nada. La invalidación queda registrada con el id de la transacción para
+        que ``_store`` descarte los renderizados que no vieron sus cambios.
+        """
+        if not surrogate_keys:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get(PAGE_CACHE_INVALIDATION_KEY)
+        if pending is None:
+            pending = data[PAGE_CACHE_INVALIDATION_KEY] = set()
+            self.env.cr.precommit.add(self._flush_invalidations)
+        pending.update(surrogate_keys)
+
+    @api.model
+    def _invalidate_specimens(self, specimens):
+        """Claves de las páginas afectadas por cambios en estos especímenes"""
+        keys = {SURROGATE_ALL_SPECIMENS}
+        for specimen in specimens:
+            keys.add(specimen_surrogate_key(specimen.id))
+            if specimen.familia:
+                keys.add(family_surrogate_key(specimen.familia))
+        self._invalidate(keys)
+
+    @api.model
+    def _flush_invalidations(self):
+        """
+        Registra la invalidación y elimina las páginas antes del commit
+
+        Tras el commit se repite el DELETE con el candado exclusivo: una página
+        guardada por una petición cuya instantánea es anterior al commit, pero
+        que no veía aún el registro de invalidación, se elimina entonces.
+        """
+        keys = self.env.cr.precommit.data.pop(PAGE_CACHE_INVALIDATION_KEY, None)
+        if not keys:
+            return
+        keys = sorted(keys)
+        self.env.cr.execute("""
+            INSERT INTO herbario_page_cache_invalidation (txid, surrogate_keys)
+                 VALUES (txid_current(), %s::varchar[])
+        """, [keys])
+        self.env.cr.execute("DELETE FROM herbario_page_cache WHERE surrogate_keys && %s::varchar[]", [keys])
+
+        def delete_after_commit():
+            with self._locked_cursor(shared=False) as cr:
+                cr.execute("DELETE FROM herbario_page_cache WHERE surrogate_keys && %s::varchar[]", [keys])
+        self.env.cr.postcommit.add(delete_after_commit)
+
+    @api.model
+    def _cron_cleanup(self):
+        """Elimina las páginas expiradas y los registros de invalidación antiguos"""
+        expired = fields.Datetime.now() - timedelta(minutes=PAGE_CACHE_TTL_MINUTES)
+        self.env.cr.execute("DELETE FROM herbario_page_cache WHERE created_at <= %s", [expired])
+        _logger.info("[HerbarioPageCache] %s páginas expiradas eliminadas", self.env.cr.rowcount)
+        # Ninguna petición en curso tiene una instantánea tan antigua
+        self.env.cr.execute("DELETE FROM herbario_page_cache_invalidation WHERE created_at <= %s", [expired])
@@ -0,0 +1,257 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+from odoo.tools.safe_eval import safe_eval
+from .qr_code import qr_render_key, qr_render_values, render_qr, specimen_qr_url
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Especímenes por lote: renderizado en paralelo, escritura y commit
+QR_BATCH_SIZE = 500
+# Tareas que recibe cada proceso del pool en cada envío
+QR_RENDER_CHUNK_SIZE = 50
+# Segundos de trabajo por ejecución del cron, por debajo de limit_time_real (120 s
+# por defecto); al agotarlos el lote sigue en proceso y el cron se vuelve a lanzar
+QR_TIME_BUDGET = 90
+
+
+def _run_render_job(args):
+    """Renderiza un QR en un proceso del pool: ``args`` = (clave, url, parámetros...)"""
+    render_key, url, error_correction, box_size, border, resolution, image_format = args
+    return render_key, render_qr(url, error_correction, box_size, border, resolution, image_format)
+
+
+class HerbarioQRBatch(models.Model):
+    _name = 'herbario.qr.batch'
+    _description = 'Generación Masiva de Códigos QR'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(string='Descripción', required=True, default='Generación masiva de QR')
+    specimen_domain = fields.Char(
+        string='Especímenes',
+        required=True,
+        default='[]',
+        help='Dominio de los especímenes para los que se generan los códigos QR'
+    )
+    only_missing = fields.Boolean(
+        string='Solo sin QR',
+        default=True,
+        help='Omite los especímenes que ya tienen un código QR activo; '
+             'si se desmarca, se regeneran como una nueva versión'
+    )
+    resolution = fields.Selection([
+        ('300', '300x300 px (Pequeño)'),
+        ('600', '600x600 px (Mediano)'),
+        ('1200', '1200x1200 px (Grande)'),
+        ('2400', '2400x2400 px (Muy Grande)')
+    ], string='Resolución', default='600', required=True)
+    error_correction = fields.Selection([
+        ('L', 'Bajo'),
+        ('M', 'Medio'),
+        ('Q', 'Alto'),
+        ('H', 'Máximo')
+    ], string='Corrección de Errores', default='H', required=True)
+    image_format = fields.Selection([
+        ('PNG', 'PNG (mapa de bits)'),
+        ('SVG', 'SVG (vectorial)')
+    ], string='Formato de Imagen', default='PNG', required=True)
+
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('queued', 'En Cola'),
+        ('running', 'En Proceso'),
+        ('done', 'Completado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='draft', required=True, readonly=True, index=True)
+    specimen_count = fields.Integer(string='Especímenes', readonly=True)
+    processed_count = fields.Integer(string='Procesados', readonly=True)
+    # Punto de control: último espécimen de un bloque confirmado (se procesan por id)
+    last_specimen_id = fields.Integer(string='Último Espécimen Procesado', readonly=True)
+    generated_count = fields.Integer(string='QR Generados', readonly=True)
+    skipped_count = fields.Integer(string='Omitidos', readonly=True)
+    progress = fields.Float(string='Progreso', compute='_compute_progress')
+    duration = fields.Float(string='Duración (s)', digits=(10, 2), readonly=True)
+    error_message = fields.Text(string='Error', readonly=True)
+    qr_code_ids = fields.One2many('herbario.qr.code', 'batch_id', string='Códigos QR')
+
+    @api.depends('processed_count', 'specimen_count')
+    def _compute_progress(self):
+        for batch in self:
+            batch.progress = 100.0 * batch.processed_count / batch.specimen_count if batch.specimen_count else 0.0
+
+    # ==================== GENERACIÓN ====================
+
+    def _get_specimens_ids(self):
+        self.ensure_one()
+        domain = safe_eval(self.specimen_domain or '[]')
+        return self.env['herbario.specimen'].search(domain, order='id').ids
+
+    def _process(self, max_workers=None, auto_commit=True, deadline=None):
+        """
+        Genera los códigos QR del lote
+
+        Por cada bloque de especímenes las imágenes que no están en la caché de
+        renderizado se generan en paralelo en un ProcessPoolExecutor (los procesos
+        solo reciben la URL y los parámetros); después se marcan obsoletos los QR
+        anteriores y se crean todos los nuevos, con sus adjuntos, en una sola
+        llamada a ``create``.
+
+        Cada bloque se confirma con su punto de control (``last_specimen_id``):
+        un lote en proceso (worker terminado o ``deadline`` alcanzado, en cuyo
+        caso devuelve False) continúa desde el bloque siguiente.
+        """
+        self.ensure_one()
+        QRCode = self.env['herbario.qr.code'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_create_nosubscribe=True,
+        )
+        if self.state != 'running':
+            self.write({
+                'state': 'running',
+                'specimen_count': len(self._get_specimens_ids()),
+                'processed_count': 0,
+                'generated_count': 0,
+                'skipped_count': 0,
+                'last_specimen_id': 0,
+                'duration': 0.0,
+                'error_message': False,
+            })
+            if auto_commit:
+                self.env.cr.commit()
+        specimen_ids = [sid for sid in self._get_specimens_ids() if sid > self.last_specimen_id]
+
+        base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
+        workers = max_workers or os.cpu_count() or 1
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_ids in split_every(QR_BATCH_SIZE, specimen_ids):
+                current = QRCode.search([('specimen_id', 'in', list(chunk_ids)), ('obsolete', '=', False)])
+                current_by_specimen = {qr.specimen_id.id: qr for qr in current}
+                if self.only_missing:
+                    pending_ids = [sid for sid in chunk_ids if sid not in current_by_specimen]
+                    current = QRCode.browse()
+                else:
+                    pending_ids = list(chunk_ids)
+
+                render_keys = {
+                    sid: qr_render_key(specimen_qr_url(base_url, sid), self.error_correction, 10, 4,
+                                       self.resolution, self.image_format)
+                    for sid in pending_ids
+                }
+                images = QRCode._render_cache_lookup(render_keys.values())
+                tasks = [
+                    (key, specimen_qr_url(base_url, sid), self.error_correction, 10, 4,
+                     self.resolution, self.image_format)
+                    for sid, key in render_keys.items() if key not in images
+                ]
+                images.update(executor.map(_run_render_job, tasks, chunksize=QR_RENDER_CHUNK_SIZE))
+
+                # Primero se liberan los QR activos: la restricción admite uno solo por espécimen
+                current.write({'obsolete': True})
+                QRCode.create([{
+                    'specimen_id': sid,
+                    'qr_url': specimen_qr_url(base_url, sid),
+                    'qr_data': specimen_qr_url(base_url, sid),
+                    'resolution': self.resolution,
+                    'error_correction': self.error_correction,
+                    'image_format': self.image_format,
+                    'version': current_by_specimen[sid].version + 1 if sid in current_by_specimen else 1,
+                    'batch_id': self.id,
+                    **qr_render_values(images[render_keys[sid]], render_keys[sid]),
+                } for sid in pending_ids])
+
+                self.write({
+                    'processed_count': self.processed_count + len(chunk_ids),
+                    'generated_count': self.generated_count + len(pending_ids),
+                    'skipped_count': self.skipped_count + len(chunk_ids) - len(pending_ids),
+                    'last_specimen_id': chunk_ids[-1],
+                })
+                if auto_commit:
+                    self.env.cr.commit()
+                    # Los registros ya guardados no necesitan seguir en memoria
+                    self.env.invalidate_all()
+                if deadline and time.monotonic() >= deadline:
+                    self.write({'duration': self.duration + time.monotonic() - started})
+                    _logger.info("[HerbarioQR] Lote %s pausado tras el espécimen %s (tiempo por ejecución agotado)",
+                                 self.id, self.last_specimen_id)
+                    return False
+
+        self.write({'state': 'done', 'duration': self.duration + time.monotonic() - started})
+        _logger.info("[HerbarioQR] Lote %s: %s QR generados en %.1f s",
+                     self.id, self.generated_count, self.duration)
+        return True
+
+    @api.model
+    def _cron_process_batches(self, max_workers=None, auto_commit=True, time_budget=QR_TIME_BUDGET):
+        """
+        Procesa los lotes en cola y reanuda los interrumpidos, uno tras otro
+
+        Cada ejecución trabaja como mucho ``time_budget`` segundos; si quedan
+        especímenes, el cron se vuelve a lanzar de inmediato.
+        """
+        deadline = time.monotonic() + time_budget if time_budget else None
+        for batch in self.search([('state', 'in', ('queued', 'running'))], order='id'):
+            finished = True
+            try:
+                finished = batch._process(max_workers=max_workers, auto_commit=auto_commit, deadline=deadline)
+            except Exception as e:
+                _logger.exception("[HerbarioQR] Error en el lote %s", batch.id)
+                if auto_commit:
+                    self.env.cr.rollback()
+                batch.write({'state': 'failed', 'error_message': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+            if not finished or (deadline and time.monotonic() >= deadline):
+                self.env.ref('herbario_espoch.ir_cron_herbario_qr_batch')._trigger()
+                break
+
+    # ==================== ACCIONES ====================
+
+    def action_start(self):
+        """La generación se delega al cron para no bloquear la petición web"""
+        for batch in self:
+            if batch.state not in ('draft', 'failed'):
+                raise UserError('El lote ya está en cola o procesado.')
+            if not batch._get_specimens_ids():
+                raise UserError('El dominio no selecciona ningún espécimen.')
+        self.write({'state': 'queued'})
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_qr_batch', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def action_print_labels(self):
+        """Hoja de etiquetas (PDF) con los códigos QR generados por el lote"""
+        self.ensure_one()
+        qr_codes = self.qr_code_ids.filtered(lambda qr: not qr.obsolete)
+        if not qr_codes:
+            raise UserError('El lote no tiene códigos QR activos.')
+        return self.env.ref('herbario_espoch.action_report_herbario_qr_labels').report_action(qr_codes)
+
+    def action_view_qr_codes(self):
+        self.ensure_one()
+        return {
+            'name': f'Códigos QR de {self.name}',
+            'type': 'ir.actions.act_window',
+            'res_model': 'herbario.qr.code',
+            'view_mode': 'tree,kanban,form',
+            'domain': [('batch_id', '=', self.id)],
+        }
+
+    @api.model
+    def action_create_from_specimens(self, specimen_ids):
+        """Crea y encola un lote con los especímenes seleccionados en la lista"""
+        batch = self.create({
+            'name': f'Generación de QR ({len(specimen_ids)} especímenes)',
+            'specimen_domain': repr([('id', 'in', list(specimen_ids))]),
+        })
+        batch.action_start()
+        return {
+            'name': 'Generación Masiva de QR',
+            'type': 'ir.actions.act_window',
+            'res_model': 'herbario.qr.batch',
+            'view_mode': 'form',
+            'res_id': batch.id,
+        }
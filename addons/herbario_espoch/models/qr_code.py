@@ -2,8 +2,11 @@ from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 import qrcode
 from io import BytesIO
+from qrcode.image.svg import SvgPathImage
+from PIL import Image
 import base64
 import hashlib
+import json
 
 ERROR_CORRECTION_MAP = {
     'L': qrcode.constants.ERROR_CORRECT_L,  # 7%
@@ -12,6 +15,79 @@ ERROR_CORRECTION_MAP = {
     'H': qrcode.constants.ERROR_CORRECT_H,  # 30%
 }
 
+# Campos cuyo cambio modifica la imagen del QR
+QR_RENDER_FIELDS = ['qr_url', 'error_correction', 'box_size', 'border', 'resolution', 'image_format']
+
+
+def specimen_qr_url(base_url, specimen_id):
+    """URL que codifica el QR; ``from_qr`` permite contar los escaneos"""
+    return f"{base_url}/herbario/specimen/{specimen_id}?from_qr=1"
+
+
+def _build_qr(data, error_correction='H', box_size=10, border=4):
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION_MAP.get(error_correction, qrcode.constants.ERROR_CORRECT_H),
+        box_size=box_size or 10,
+        border=border or 4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png(data, error_correction='H', box_size=10, border=4, resolution=600):
+    """
+    PNG del código QR escalado a ``resolution`` píxeles de lado
+
+    Función de módulo (sin ORM) para poder ejecutarse en los procesos del pool
+    de la generación masiva.
+    """
+    qr = _build_qr(data, error_correction, box_size, border)
+    image = qr.make_image(fill_color='black', back_color='white').get_image().convert('1')
+    size = int(resolution or 600)
+    # Vecino más cercano: los módulos siguen siendo cuadrados nítidos
+    image = image.resize((size, size), Image.NEAREST)
+    output = BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def render_qr_svg(data, error_correction='H', box_size=10, border=4):
+    """SVG vectorial del código QR (un único trazado; escala sin pérdida para imprenta)"""
+    qr = _build_qr(data, error_correction, box_size, border)
+    output = BytesIO()
+    qr.make_image(image_factory=SvgPathImage).save(output)
+    return output.getvalue()
+
+
+def render_qr(data, error_correction='H', box_size=10, border=4, resolution=600, image_format='PNG'):
+    if image_format == 'SVG':
+        return render_qr_svg(data, error_correction, box_size, border)
+    return render_qr_png(data, error_correction, box_size, border, resolution)
+
+
+def qr_render_key(data, error_correction='H', box_size=10, border=4, resolution=600, image_format='PNG'):
+    """
+    Clave de la caché de renderizado: contenido y parámetros que determinan los
+    bytes de la imagen (la resolución solo afecta al PNG)
+    """
+    params = [data, error_correction or 'H', box_size or 10, border or 4, image_format or 'PNG']
+    if image_format != 'SVG':
+        params.append(int(resolution or 600))
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+
+def qr_render_values(image_bytes, render_key):
+    """Valores a guardar tras renderizar; tamaño y checksum se calculan una sola vez aquí"""
+    return {
+        'qr_image': base64.b64encode(image_bytes),
+        'file_size_bytes': len(image_bytes),
+        'checksum': hashlib.sha256(image_bytes).hexdigest(),
+        'render_key': render_key,
+    }
+
+
 class HerbarioQRCode(models.Model):
     _name = 'herbario.qr.code'
     _description = 'Códigos QR de Especímenes'
@@ -72,7 +148,8 @@ class HerbarioQRCode(models.Model):
         string='Número de Escaneos',
         default=0,
         readonly=True,
-        help='Contador de veces que se escaneó el QR'
+        help='Contador de veces que se escaneó el QR (se consolida periódicamente '
+             'desde el historial de escaneos)'
     )
     last_scanned_at = fields.Datetime(
         string='Último Escaneo',
@@ -105,11 +182,28 @@ class HerbarioQRCode(models.Model):
         readonly=True
     )
 
-    # Campos adicionales para coincidir con la vista
-    image_format = fields.Char(string='Formato de Imagen', default='PNG')  # Campo agregado
-    file_size_bytes = fields.Integer(string='Tamaño en Bytes', compute='_compute_file_size')  # Campo agregado
-    checksum = fields.Char(string='Checksum', compute='_compute_checksum')  # Campo agregado
+    # Datos de la imagen generada (se guardan al renderizar)
+    image_format = fields.Selection([
+        ('PNG', 'PNG (mapa de bits)'),
+        ('SVG', 'SVG (vectorial)')
+    ], string='Formato de Imagen', default='PNG', required=True)
+    file_size_bytes = fields.Integer(string='Tamaño en Bytes', readonly=True)
+    checksum = fields.Char(string='Checksum', readonly=True, help='SHA-256 de la imagen')
+    render_key = fields.Char(
+        string='Clave de Renderizado',
+        readonly=True,
+        index=True,
+        help='Hash del contenido y los parámetros del QR; imágenes con la misma clave se reutilizan'
+    )
     scan_log_ids = fields.One2many('herbario.qr.scan.log', 'qr_code_id', string='Historial de Escaneos')
+    scan_stat_ids = fields.One2many('herbario.qr.scan.stat', 'qr_code_id', string='Escaneos por Periodo')
+    batch_id = fields.Many2one(
+        'herbario.qr.batch',
+        string='Generación Masiva',
+        ondelete='set null',
+        index=True,
+        readonly=True
+    )
 
     # Campos computados
     qr_filename = fields.Char(
@@ -117,35 +211,32 @@ class HerbarioQRCode(models.Model):
         compute='_compute_qr_filename'
     )
 
+    # Solo el QR activo es único: las versiones obsoletas se acumulan al regenerar
     _sql_constraints = [
-        ('specimen_unique', 'UNIQUE(specimen_id, obsolete)', 
+        ('specimen_unique', 'EXCLUDE (specimen_id WITH =) WHERE (NOT obsolete)',
          'Solo puede existir un código QR activo por espécimen.')
     ]
 
-    @api.depends('specimen_id.codigo_herbario')
+    def init(self):
+        """Tamaño de las imágenes generadas antes de guardarlo al renderizar"""
+        self.env.cr.execute("""
+            UPDATE herbario_qr_code qr
+               SET file_size_bytes = a.file_size
+              FROM ir_attachment a
+             WHERE a.res_model = 'herbario.qr.code'
+               AND a.res_field = 'qr_image'
+               AND a.res_id = qr.id
+               AND qr.file_size_bytes IS NULL
+        """)
+
+    @api.depends('specimen_id.codigo_herbario', 'image_format')
     def _compute_qr_filename(self):
         for record in self:
+            extension = 'svg' if record.image_format == 'SVG' else 'png'
             if record.specimen_id:
-                record.qr_filename = f"QR_{record.specimen_id.codigo_herbario}.png"
-            else:
-                record.qr_filename = "QR_code.png"
-
-    @api.depends('qr_image')
-    def _compute_file_size(self):
-        for record in self:
-            if record.qr_image:
-                record.file_size_bytes = len(base64.b64decode(record.qr_image))
+                record.qr_filename = f"QR_{record.specimen_id.codigo_herbario}.{extension}"
             else:
-                record.file_size_bytes = 0
-
-    @api.depends('qr_image')
-    def _compute_checksum(self):
-        for record in self:
-            if record.qr_image:
-                image_bytes = base64.b64decode(record.qr_image)
-                record.checksum = hashlib.sha256(image_bytes).hexdigest()
-            else:
-                record.checksum = False
+                record.qr_filename = f"QR_code.{extension}"
 
     @api.model
     def generate_qr_for_specimen(self, specimen):
@@ -156,35 +247,78 @@ class HerbarioQRCode(models.Model):
         else:
             new_version = 1
         base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
-        qr_url = f"{base_url}/herbario/specimen/{specimen.id}"
-        qr_record = self.create({
+        qr_url = specimen_qr_url(base_url, specimen.id)
+        vals = {
             'specimen_id': specimen.id,
             'qr_url': qr_url,
             'version': new_version,
             'qr_data': qr_url  # Asumiendo que qr_data es la URL o datos similares
-        })
+        }
+        if existing_qr:
+            # Mismos parámetros que la versión anterior: la imagen sale de la caché
+            vals.update({
+                field: existing_qr[field]
+                for field in ['resolution', 'error_correction', 'box_size', 'border', 'image_format']
+            })
+        qr_record = self.create(vals)
         qr_record._generate_qr_image()
         return qr_record
 
-    def _generate_qr_image(self):
-        """Genera la imagen QR"""
+    def _get_render_key(self):
         self.ensure_one()
-        
-        # Convertir el string 'H' al valor correcto
-        error_correction_value = ERROR_CORRECTION_MAP.get(
-            self.error_correction, 
-            qrcode.constants.ERROR_CORRECT_H
-        ) if isinstance(self.error_correction, str) else (
-            self.error_correction or qrcode.constants.ERROR_CORRECT_H
-        )
-        
-        qr = qrcode.QRCode(
-            version=None,
-            error_correction=error_correction_value,  # ← Usar el valor convertido
-            box_size=self.box_size or 10,
-            border=self.border or 4
+        return qr_render_key(
+            self.qr_url, self.error_correction, self.box_size, self.border,
+            self.resolution, self.image_format,
         )
 
+    @api.model
+    def _render_cache_lookup(self, render_keys):
+        """
+        Imágenes ya renderizadas con las claves indicadas: ``{clave: bytes}``
+
+        Se toma un QR por clave (incluidos los obsoletos); el índice sobre
+        ``render_key`` evita recorrer la tabla.
+        """
+        render_keys = list(set(render_keys))
+        if not render_keys:
+            return {}
+        self.flush_model(['render_key', 'checksum'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (render_key) id
+              FROM herbario_qr_code
+             WHERE render_key IN %s AND checksum IS NOT NULL
+          ORDER BY render_key, id DESC
+        """, [tuple(render_keys)])
+        cached = self.browse([row[0] for row in self.env.cr.fetchall()]).with_context(bin_size=False)
+        return {
+            record.render_key: base64.b64decode(record.qr_image)
+            for record in cached if record.qr_image
+        }
+
+    def _generate_qr_image(self):
+        """
+        Genera la imagen QR
+
+        Si otro QR ya se renderizó con el mismo contenido y parámetros se reutilizan
+        sus bytes; si la clave no cambió no se hace nada.
+        """
+        keys = {record.id: record._get_render_key() for record in self}
+        pending = self.filtered(lambda record: record.render_key != keys[record.id] or not record.checksum)
+        cache = self._render_cache_lookup(keys[record.id] for record in pending)
+        for record in pending:
+            key = keys[record.id]
+            image_bytes = cache.get(key)
+            if image_bytes is None:
+                image_bytes = cache[key] = render_qr(
+                    record.qr_url,
+                    error_correction=record.error_correction,
+                    box_size=record.box_size,
+                    border=record.border,
+                    resolution=record.resolution,
+                    image_format=record.image_format,
+                )
+            record.write(qr_render_values(image_bytes, key))
+
     def action_regenerate(self):
         self.ensure_one()
         return self.generate_qr_for_specimen(self.specimen_id)
@@ -201,11 +335,18 @@ class HerbarioQRCode(models.Model):
             'target': 'self',
         }
 
-    def register_scan(self):
+    def register_scan(self, ip_address=None, user_agent=None):
+        """
+        Registra un escaneo en el historial sin escribir en el QR
+
+        El contador y la fecha del último escaneo los actualiza el cron de
+        consolidación, para que los escaneos simultáneos no bloqueen esta fila.
+        """
         self.ensure_one()
-        self.write({
-            'scan_count': self.scan_count + 1,
-            'last_scanned_at': fields.Datetime.now()
+        self.env['herbario.qr.scan.log'].create({
+            'qr_code_id': self.id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
         })
 
     def action_change_resolution(self):
@@ -234,9 +375,8 @@ class HerbarioQRCode(models.Model):
     
     def write(self, vals):
         res = super(HerbarioQRCode, self).write(vals)
-        if 'resolution' in vals or 'error_correction' in vals or 'box_size' in vals or 'border' in vals:
-            for record in self:
-                record._generate_qr_image()
+        if any(field in vals for field in QR_RENDER_FIELDS):
+            self._generate_qr_image()
         return res
 
     def name_get(self):
@@ -0,0 +1,228 @@
+from odoo import models, api
+from odoo.tools import split_every
+from collections import defaultdict
+from .statistics_cube import ALTITUDE_BAND_SIZE
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Especímenes relacionados que se guardan por espécimen
+RELATED_COUNT = 4
+
+# Pesos de la similitud (los candidatos son siempre de la misma familia)
+RELATED_WEIGHT_GENUS = 4
+RELATED_WEIGHT_PROVINCE = 2
+RELATED_WEIGHT_SAME_BAND = 2
+RELATED_WEIGHT_ADJACENT_BAND = 1
+
+# Campos cuyo cambio altera los relacionados de un espécimen o su lugar en otras listas
+RELATED_SPECIMEN_FIELDS = ['familia', 'genero', 'es_publico', 'status']
+RELATED_SITE_FIELDS = ['specimen_id', 'provincia', 'altitud', 'is_primary']
+
+RELATED_REFRESH_KEY = 'herbario.related.engine.refresh'
+REFRESH_BATCH_SIZE = 1000
+
+
+class HerbarioRelatedEngine(models.AbstractModel):
+    _name = 'herbario.related.engine'
+    _description = 'Especímenes Relacionados del Herbario'
+
+    # ==================== ESTRUCTURAS EN BASE DE DATOS ====================
+
+    def init(self):
+        """
+        Tabla de vecinos: para cada espécimen público, sus relacionados
+        ordenados por similitud, leídos por la clave primaria
+        """
+        cr = self.env.cr
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS herbario_specimen_neighbor (
+                specimen_id integer NOT NULL REFERENCES herbario_specimen (id) ON DELETE CASCADE,
+                rank smallint NOT NULL,
+                neighbor_id integer NOT NULL REFERENCES herbario_specimen (id) ON DELETE CASCADE,
+                score smallint NOT NULL,
+                PRIMARY KEY (specimen_id, rank)
+            );
+            CREATE INDEX IF NOT EXISTS herbario_specimen_neighbor_neighbor_id_idx
+                ON herbario_specimen_neighbor (neighbor_id);
+        """)
+        # Primera instalación o actualización desde una versión sin vecinos
+        cr.execute("SELECT to_regclass('herbario_collection_site') IS NOT NULL")
+        if cr.fetchone()[0]:
+            cr.execute("SELECT NOT EXISTS (SELECT 1 FROM herbario_specimen_neighbor) AND EXISTS (SELECT 1 FROM herbario_specimen)")
+            if cr.fetchone()[0]:
+                self.rebuild()
+
+    def _profile_sql(self, familia_where):
+        """
+        Perfil de los especímenes públicos: taxonomía y provincia/altitud de la
+        ubicación principal; ``familia_where`` filtra sobre el alias ``s``
+        """
+        return f"""
+            SELECT s.id, s.familia, s.genero, site.provincia,
+                   NULLIF(site.altitud, 0) / {ALTITUDE_BAND_SIZE} AS altitude_band
+              FROM herbario_specimen s
+         LEFT JOIN LATERAL (
+                    SELECT cs.provincia, cs.altitud
+                      FROM herbario_collection_site cs
+                     WHERE cs.specimen_id = s.id
+                  ORDER BY cs.is_primary DESC NULLS LAST, cs.id
+                     LIMIT 1
+                   ) site ON TRUE
+             WHERE s.es_publico AND s.status = 'activo' AND s.familia IS NOT NULL AND {familia_where}
+        """
+
+    def _score_sql(self, a, b):
+        """Similitud entre los perfiles con alias ``a`` y ``b`` de la misma familia"""
+        return f"""(
+            CASE WHEN {a}.genero = {b}.genero THEN {RELATED_WEIGHT_GENUS} ELSE 0 END
+          + CASE WHEN {a}.provincia = {b}.provincia THEN {RELATED_WEIGHT_PROVINCE} ELSE 0 END
+          + CASE abs({a}.altitude_band - {b}.altitude_band)
+                 WHEN 0 THEN {RELATED_WEIGHT_SAME_BAND}
+                 WHEN 1 THEN {RELATED_WEIGHT_ADJACENT_BAND}
+                 ELSE 0 END
+        )"""
+
+    def _insert_neighbors(self, familia_where, target_where, params):
+        """
+        Inserta los vecinos de los especímenes de ``target_where`` (alias ``t``):
+        los RELATED_COUNT candidatos de su familia con mayor similitud y, a
+        igualdad, los más antiguos (un espécimen nuevo no desplaza a los que ya
+        empatan con él)
+        """
+        self.env.cr.execute(f"""
+            WITH profile AS MATERIALIZED ({self._profile_sql(familia_where)})
+            INSERT INTO herbario_specimen_neighbor (specimen_id, rank, neighbor_id, score)
+            SELECT t.id, row_number() OVER (PARTITION BY t.id ORDER BY n.score DESC, n.id), n.id, n.score
+              FROM profile t
+        CROSS JOIN LATERAL (
+                    SELECT c.id, {self._score_sql('c', 't')} AS score
+                      FROM profile c
+                     WHERE c.familia = t.familia AND c.id <> t.id
+                  ORDER BY score DESC, c.id
+                     LIMIT {RELATED_COUNT}
+                   ) n
+             WHERE {target_where}
+        """, params)
+
+    # ==================== ACTUALIZACIÓN ====================
+
+    @api.model
+    def rebuild(self):
+        """Recalcula los vecinos de todos los especímenes"""
+        self.env.flush_all()
+        self.env.cr.execute("TRUNCATE herbario_specimen_neighbor")
+        self._insert_neighbors('TRUE', 'TRUE', [])
+        _logger.info("[HerbarioRelated] Especímenes relacionados reconstruidos")
+
+    @api.model
+    def refresh_specimens(self, specimen_ids):
+        """
+        Marca para recalcular las listas afectadas por cambios en estos especímenes
+
+        Se anotan los especímenes y las listas que ya los contienen (que pueden
+        perderlos), que se recalculan completas antes del commit; en las demás
+        listas de su familia en las que ahora entran, el espécimen se intercala en
+        los vecinos ya guardados.
+        """
+        specimen_ids = sorted({specimen_id for specimen_id in specimen_ids if specimen_id})
+        if not specimen_ids:
+            return
+        self.env.cr.execute(
+            "SELECT DISTINCT specimen_id FROM herbario_specimen_neighbor WHERE neighbor_id IN %s",
+            [tuple(specimen_ids)],
+        )
+        listing_ids = [row[0] for row in self.env.cr.fetchall()]
+
+        data = self.env.cr.precommit.data
+        pending = data.get(RELATED_REFRESH_KEY)
+        if pending is None:
+            pending = data[RELATED_REFRESH_KEY] = {'changed': set(), 'targets': set()}
+            self.env.cr.precommit.add(self._flush_refresh)
+        pending['changed'].update(specimen_ids)
+        pending['targets'].update(specimen_ids, listing_ids)
+
+    @api.model
+    def _flush_refresh(self):
+        pending = self.env.cr.precommit.data.pop(RELATED_REFRESH_KEY, None)
+        if not pending:
+            return
+        self.env.flush_all()
+        cr = self.env.cr
+        target_ids = sorted(pending['targets'])
+        entries = defaultdict(list)
+        for batch_ids in split_every(REFRESH_BATCH_SIZE, sorted(pending['changed'])):
+            # Listas de la misma familia en las que el espécimen cambiado entra:
+            # supera al último vecino (o empata y es más antiguo) o la lista no está llena
+            cr.execute(f"""
+                WITH profile AS MATERIALIZED ({self._profile_sql(
+                    's.familia IN (SELECT familia FROM herbario_specimen WHERE id IN %(ids)s)')})
+                SELECT t.id, c.id, candidate.score
+                  FROM profile c
+                  JOIN profile t ON t.familia = c.familia AND t.id <> c.id
+            CROSS JOIN LATERAL (SELECT {self._score_sql('c', 't')} AS score) candidate
+             LEFT JOIN LATERAL (
+                        SELECT rank, score, neighbor_id
+                          FROM herbario_specimen_neighbor
+                         WHERE specimen_id = t.id
+                      ORDER BY rank DESC
+                         LIMIT 1
+                       ) last ON TRUE
+                 WHERE c.id IN %(ids)s
+                   AND t.id <> ALL(%(targets)s)
+                   AND (last.rank IS NULL
+                        OR last.rank < {RELATED_COUNT}
+                        OR candidate.score > last.score
+                        OR (candidate.score = last.score AND c.id < last.neighbor_id))
+            """, {'ids': tuple(batch_ids), 'targets': target_ids})
+            for specimen_id, neighbor_id, score in cr.fetchall():
+                entries[specimen_id].append((score, neighbor_id))
+
+        for batch_ids in split_every(REFRESH_BATCH_SIZE, target_ids):
+            params = {'ids': tuple(batch_ids)}
+            cr.execute("DELETE FROM herbario_specimen_neighbor WHERE specimen_id IN %(ids)s", params)
+            self._insert_neighbors(
+                's.familia IN (SELECT familia FROM herbario_specimen WHERE id IN %(ids)s)',
+                't.id IN %(ids)s', params,
+            )
+
+        for batch_ids in split_every(REFRESH_BATCH_SIZE, sorted(entries)):
+            self._merge_neighbors({specimen_id: entries[specimen_id] for specimen_id in batch_ids})
+
+    def _merge_neighbors(self, entries):
+        """
+        Intercala ``{lista: [(similitud, candidato)]}`` en los vecinos guardados
+        y conserva los RELATED_COUNT primeros, con el orden de ``_insert_neighbors``
+        """
+        cr = self.env.cr
+        cr.execute("""
+            SELECT specimen_id, score, neighbor_id
+              FROM herbario_specimen_neighbor
+             WHERE specimen_id IN %s
+        """, [tuple(entries)])
+        for specimen_id, score, neighbor_id in cr.fetchall():
+            entries[specimen_id].append((score, neighbor_id))
+
+        rows = []
+        for specimen_id, neighbors in entries.items():
+            neighbors = sorted(set(neighbors), key=lambda neighbor: (-neighbor[0], neighbor[1]))
+            for rank, (score, neighbor_id) in enumerate(neighbors[:RELATED_COUNT], 1):
+                rows.append((specimen_id, rank, neighbor_id, score))
+        cr.execute("DELETE FROM herbario_specimen_neighbor WHERE specimen_id IN %s", [tuple(entries)])
+        cr.execute("""
+            INSERT INTO herbario_specimen_neighbor (specimen_id, rank, neighbor_id, score)
+            SELECT * FROM unnest(%s::integer[], %s::smallint[], %s::integer[], %s::smallint[])
+        """, [list(column) for column in zip(*rows)])
+
+    # ==================== CONSULTAS ====================
+
+    @api.model
+    def get_related(self, specimen_id):
+        """Especímenes relacionados, del más al menos similar (lectura por clave primaria)"""
+        self.env.cr.execute("""
+            SELECT neighbor_id
+              FROM herbario_specimen_neighbor
+             WHERE specimen_id = %s
+          ORDER BY rank
+        """, [specimen_id])
+        return self.env['herbario.specimen'].browse([row[0] for row in self.env.cr.fetchall()])
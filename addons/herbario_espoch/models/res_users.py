@@ -1,4 +1,4 @@
-from odoo import models, fields, api
+from odoo import models, fields
 
 
 class ResUsers(models.Model):
@@ -45,35 +45,57 @@ class ResUsers(models.Model):
         help='Identificador ORCID del investigador'
     )
 
-    @api.depends('specimens_created_count', 'locations_added_count', 'images_uploaded_count')
     def _compute_herbario_stats(self):
-        """Calcula estadísticas de contribuciones al herbario"""
+        """
+        Calcula estadísticas de contribuciones al herbario
+
+        Una consulta agrupada por modelo para todo el recordset, de modo que una
+        lista o kanban de usuarios no lanza consultas por cada fila.
+        """
+        user_ids = self._origin.ids
+        counts = {}
+        for model, user_field, domain in [
+            ('herbario.specimen', 'created_by', []),
+            ('herbario.collection.site', 'created_by', []),
+            ('herbario.image', 'uploaded_by', [('deleted_at', '=', False)]),
+        ]:
+            groups = self.env[model].sudo()._read_group(
+                [(user_field, 'in', user_ids)] + domain, [user_field], ['__count'],
+            )
+            counts[model] = {user.id: count for user, count in groups}
+
         for user in self:
-            # Especímenes creados
-            user.specimens_created_count = self.env['herbario.specimen'].search_count([
-                ('created_by', '=', user.id)
-            ])
-            
-            # Ubicaciones agregadas
-            user.locations_added_count = self.env['herbario.collection.site'].search_count([
-                ('created_by', '=', user.id)
-            ])
-            
-            # Imágenes subidas
-            user.images_uploaded_count = self.env['herbario.image'].search_count([
-                ('uploaded_by', '=', user.id),
-                ('deleted_at', '=', False)
-            ])
+            user_id = user._origin.id
+            user.specimens_created_count = counts['herbario.specimen'].get(user_id, 0)
+            user.locations_added_count = counts['herbario.collection.site'].get(user_id, 0)
+            user.images_uploaded_count = counts['herbario.image'].get(user_id, 0)
 
-    @api.depends()
     def _compute_last_activity(self):
-        """Obtiene la última actividad en el herbario"""
+        """
+        Obtiene la última actividad en el herbario
+
+        Para cada usuario se lee solo la primera entrada del índice
+        (user_id, timestamp DESC) del historial, en una única consulta.
+        """
+        user_ids = self._origin.ids
+        last_activity = {}
+        if user_ids:
+            self.env['herbario.history.log'].flush_model(['user_id', 'timestamp'])
+            self.env.cr.execute("""
+                SELECT u.id, last_log.timestamp
+                  FROM unnest(%s) AS u(id)
+                  CROSS JOIN LATERAL (
+                        SELECT "timestamp"
+                          FROM herbario_history_log
+                         WHERE user_id = u.id
+                      ORDER BY "timestamp" DESC
+                         LIMIT 1
+                       ) last_log
+            """, [user_ids])
+            last_activity = dict(self.env.cr.fetchall())
+
         for user in self:
-            last_log = self.env['herbario.history.log'].search([
-                ('user_id', '=', user.id)
-            ], limit=1, order='timestamp desc')
-            
-            user.last_herbario_activity = last_log.timestamp if last_log else False
+            user.last_herbario_activity = last_activity.get(user._origin.id, False)
 
     def action_view_my_specimens(self):
         """Acción para ver mis especímenes"""
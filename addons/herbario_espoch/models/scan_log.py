@@ -1,4 +1,14 @@
 from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Escaneos consolidados por sentencia del cron
+SCAN_AGGREGATE_BATCH_SIZE = 5000
+# Días que se conservan los escaneos ya consolidados (los agregados se conservan siempre)
+SCAN_LOG_RETENTION_DAYS = 180
+
 
 class HerbarioQRScanLog(models.Model):
     _name = 'herbario.qr.scan.log'
@@ -29,4 +39,141 @@ class HerbarioQRScanLog(models.Model):
         string='Ubicación',
         help='Ubicación aproximada del escaneo'
     )
-    # Agrega más campos si necesitas, como user_id o notes
\ No newline at end of file
+    aggregated = fields.Boolean(
+        string='Consolidado',
+        default=False,
+        readonly=True,
+        help='El escaneo ya se sumó al contador del QR y a los agregados por hora/día'
+    )
+
+    def init(self):
+        """Índice parcial de la cola de escaneos pendientes de consolidar"""
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS herbario_qr_scan_log_pending_idx
+                ON herbario_qr_scan_log (id) WHERE NOT aggregated
+        """)
+
+    # ==================== CONSOLIDACIÓN ====================
+
+    @api.model
+    def _aggregate_batch(self, limit=SCAN_AGGREGATE_BATCH_SIZE):
+        """
+        Consolida un lote de escaneos pendientes en una sola sentencia
+
+        Se reservan los escaneos con SKIP LOCKED, se suman a los agregados por
+        hora y por día (UPSERT) y se actualizan ``scan_count`` y
+        ``last_scanned_at`` de cada QR una sola vez por lote. Devuelve el número
+        de escaneos consolidados.
+        """
+        self.env['herbario.qr.scan.stat'].flush_model()
+        self.env['herbario.qr.code'].flush_model(['scan_count', 'last_scanned_at'])
+        self.flush_model()
+        uid = self.env.uid
+        rollups = []
+        for period in ('hour', 'day'):
+            rollups.append(f"""
+                {period}_stats AS (
+                    INSERT INTO herbario_qr_scan_stat
+                           (qr_code_id, period, period_start, scan_count,
+                            create_uid, create_date, write_uid, write_date)
+                    SELECT qr_code_id, '{period}', date_trunc('{period}', scanned_at), count(*),
+                           %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                      FROM claimed
+                  GROUP BY qr_code_id, date_trunc('{period}', scanned_at)
+                        ON CONFLICT (qr_code_id, period, period_start) DO UPDATE
+                       SET scan_count = herbario_qr_scan_stat.scan_count + EXCLUDED.scan_count,
+                           write_uid = EXCLUDED.write_uid,
+                           write_date = EXCLUDED.write_date
+                )""")
+        self.env.cr.execute(f"""
+            WITH claimed AS (
+                UPDATE herbario_qr_scan_log log
+                   SET aggregated = TRUE
+                 WHERE log.id IN (
+                        SELECT id
+                          FROM herbario_qr_scan_log
+                         WHERE NOT aggregated
+                      ORDER BY id
+                         LIMIT %(limit)s
+                           FOR UPDATE SKIP LOCKED
+                       )
+             RETURNING log.qr_code_id, log.scanned_at
+            ), {', '.join(rollups)}, totals AS (
+                UPDATE herbario_qr_code qr
+                   SET scan_count = coalesce(qr.scan_count, 0) + t.scans,
+                       last_scanned_at = greatest(qr.last_scanned_at, t.last_scanned_at)
+                  FROM (
+                        SELECT qr_code_id, count(*) AS scans, max(scanned_at) AS last_scanned_at
+                          FROM claimed
+                      GROUP BY qr_code_id
+                       ) t
+                 WHERE qr.id = t.qr_code_id
+            )
+            SELECT count(*) FROM claimed
+        """, {'limit': limit, 'uid': uid})
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _cron_aggregate_scans(self, batch_size=SCAN_AGGREGATE_BATCH_SIZE, auto_commit=True):
+        """
+        Vacía la cola de escaneos y depura los consolidados antiguos
+
+        El escaneo público solo inserta una fila en esta tabla; el contador del
+        QR se actualiza aquí, fuera de la petición, de modo que los escaneos
+        simultáneos de una misma etiqueta no compiten por el bloqueo de su fila.
+        """
+        total = 0
+        while True:
+            count = self._aggregate_batch(batch_size)
+            total += count
+            if auto_commit:
+                self.env.cr.commit()
+            if count < batch_size:
+                break
+        self.invalidate_model(['aggregated'])
+        self.env['herbario.qr.code'].invalidate_model(['scan_count', 'last_scanned_at'])
+        self.env['herbario.qr.scan.stat'].invalidate_model()
+
+        limit_date = fields.Datetime.now() - timedelta(days=SCAN_LOG_RETENTION_DAYS)
+        self.env.cr.execute("""
+            DELETE FROM herbario_qr_scan_log
+             WHERE aggregated AND scanned_at < %s
+        """, [limit_date])
+        if total:
+            _logger.info("[HerbarioQR] %s escaneos consolidados", total)
+        return total
+
+
+class HerbarioQRScanStat(models.Model):
+    _name = 'herbario.qr.scan.stat'
+    _description = 'Escaneos de QR por Hora y Día'
+    _order = 'period_start desc'
+
+    qr_code_id = fields.Many2one(
+        'herbario.qr.code',
+        string='Código QR',
+        required=True,
+        ondelete='cascade',
+        index=True,
+        readonly=True
+    )
+    period = fields.Selection([
+        ('hour', 'Hora'),
+        ('day', 'Día'),
+    ], string='Periodo', required=True, readonly=True)
+    period_start = fields.Datetime(
+        string='Inicio del Periodo',
+        required=True,
+        readonly=True,
+        help='Inicio de la hora o del día (UTC)'
+    )
+    scan_count = fields.Integer(
+        string='Escaneos',
+        default=0,
+        readonly=True
+    )
+
+    _sql_constraints = [
+        ('period_unique', 'UNIQUE(qr_code_id, period, period_start)',
+         'Solo puede existir un agregado por QR, periodo e inicio.')
+    ]
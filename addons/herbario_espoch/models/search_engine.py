@@ -0,0 +1,162 @@
+from odoo import models, api
+from odoo.tools import SQL
+from odoo.tools.sql import column_exists, create_column, create_index, index_exists
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+# Columnas de herbario.specimen con índice GIN de trigramas (búsqueda %término%)
+TRIGRAM_COLUMNS = ['nombre_cientifico', 'familia', 'genero', 'especie', 'autor_cientifico']
+
+# Campos que alimentan el documento de búsqueda
+SPECIMEN_SEARCH_FIELDS = ['nombre_cientifico', 'familia', 'genero', 'especie', 'autor_cientifico']
+SITE_SEARCH_FIELDS = ['specimen_id', 'localidad', 'colector', 'provincia', 'canton', 'vecindad']
+
+# Configuración de texto: 'simple' no aplica stemming a nombres científicos
+TS_CONFIG = 'simple'
+
+
+class HerbarioSearchEngine(models.AbstractModel):
+    _name = 'herbario.search.engine'
+    _description = 'Motor de Búsqueda del Herbario'
+
+    # ==================== ESTRUCTURAS EN BASE DE DATOS ====================
+
+    @api.model
+    def _ensure_search_structures(self):
+        """Crea la extensión pg_trgm, la columna tsvector y los índices GIN"""
+        cr = self.env.cr
+        table = self.env['herbario.specimen']._table
+
+        has_trigram = True
+        try:
+            with cr.savepoint():
+                cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception:
+            has_trigram = False
+            _logger.warning("[HerbarioSearch] No se pudo instalar pg_trgm; "
+                            "la búsqueda parcial no usará índices de trigramas")
+
+        if not column_exists(cr, table, 'search_document'):
+            create_column(cr, table, 'search_document', 'tsvector',
+                          'Documento de búsqueda ponderado (taxonomía y sitios de recolección)')
+
+        if not index_exists(cr, f'{table}_search_document_idx'):
+            create_index(cr, f'{table}_search_document_idx', table, ['search_document'], method='gin')
+
+        if has_trigram:
+            for column in TRIGRAM_COLUMNS:
+                index_name = f'{table}_{column}_trgm_idx'
+                if not index_exists(cr, index_name):
+                    create_index(cr, index_name, table, [f'"{column}" gin_trgm_ops'], method='gin')
+
+        # Documentos de registros existentes antes de instalar el motor
+        cr.execute(SQL("SELECT id FROM %s WHERE search_document IS NULL", SQL.identifier(table)))
+        pending_ids = [row[0] for row in cr.fetchall()]
+        if pending_ids:
+            self.refresh_documents(pending_ids)
+
+    @api.model
+    def refresh_documents(self, specimen_ids):
+        """Recalcula el documento de búsqueda de los especímenes indicados en una sola sentencia"""
+        specimen_ids = [specimen_id for specimen_id in specimen_ids if specimen_id]
+        if not specimen_ids:
+            return
+        self.env['herbario.specimen'].flush_model()
+        self.env['herbario.collection.site'].flush_model()
+        self.env.cr.execute(SQL("""
+            UPDATE herbario_specimen s
+               SET search_document =
+                       setweight(to_tsvector(%s, concat_ws(' ', s.nombre_cientifico, s.genero, s.especie)), 'A')
+                    || setweight(to_tsvector(%s, concat_ws(' ', s.familia, s.autor_cientifico)), 'B')
+                    || setweight(to_tsvector(%s, coalesce(sites.site_text, '')), 'C')
+              FROM (
+                    SELECT sp.id,
+                           string_agg(concat_ws(' ', cs.localidad, cs.colector, cs.provincia,
+                                                cs.canton, cs.vecindad), ' ') AS site_text
+                      FROM herbario_specimen sp
+                 LEFT JOIN herbario_collection_site cs ON cs.specimen_id = sp.id
+                     WHERE sp.id IN %s
+                  GROUP BY sp.id
+                   ) sites
+             WHERE s.id = sites.id
+        """, TS_CONFIG, TS_CONFIG, TS_CONFIG, tuple(specimen_ids)))
+
+    # ==================== CONSULTAS ====================
+
+    @api.model
+    def _prefix_tsquery(self, text):
+        """Convierte el texto del usuario en un tsquery de prefijos: 'quercus hum' → 'quercus:* & hum:*'"""
+        words = re.findall(r'\w+', text or '', re.UNICODE)
+        return ' & '.join(f'{word.lower()}:*' for word in words)
+
+    @api.model
+    def _build_query(self, text, domain=None):
+        """Query de especímenes filtrada por el dominio y el texto, con su expresión de relevancia"""
+        query = self.env['herbario.specimen']._search(list(domain or []))
+        table = SQL.identifier(query.table)
+
+        term = (text or '').strip()
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+        tsquery = SQL("to_tsquery(%s, %s)", TS_CONFIG, self._prefix_tsquery(term))
+
+        trigram_match = SQL(" OR ").join(
+            SQL("%s.%s ILIKE %s", table, SQL.identifier(column), pattern)
+            for column in TRIGRAM_COLUMNS
+        )
+        if self._prefix_tsquery(term):
+            query.add_where(SQL("(%s.search_document @@ %s OR %s)", table, tsquery, trigram_match))
+            text_rank = SQL("ts_rank_cd(%s.search_document, %s)", table, tsquery)
+        else:
+            query.add_where(SQL("(%s)", trigram_match))
+            text_rank = SQL("0")
+
+        if not self.env.registry.has_trigram:
+            return query, text_rank
+        rank = SQL(
+            "(%s + word_similarity(%s, coalesce(%s.nombre_cientifico, '')) + 0.5 * word_similarity(%s, coalesce(%s.familia, '')))",
+            text_rank, term, table, term, table,
+        )
+        return query, rank
+
+    @api.model
+    def search_count(self, text, domain=None):
+        """Número de especímenes que coinciden con el texto"""
+        query, _rank = self._build_query(text, domain)
+        self.env.cr.execute(query.select(SQL("COUNT(*)")))
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def search_specimens(self, text, domain=None, limit=None, offset=0, order=None):
+        """
+        Búsqueda de especímenes por relevancia
+
+        Combina el documento tsvector ponderado (taxonomía en peso A/B, sitios de
+        recolección en peso C) con coincidencias parciales servidas por los índices
+        de trigramas. Si se indica ``order`` se usa en lugar de la relevancia.
+        """
+        Specimen = self.env['herbario.specimen']
+        query, rank = self._build_query(text, domain)
+        table = SQL.identifier(query.table)
+        if order:
+            query.order = Specimen._order_to_sql(order, query)
+        else:
+            query.order = SQL("%s DESC, %s.id DESC", rank, table)
+        query.limit = limit
+        query.offset = offset
+        self.env.cr.execute(query.select(SQL("%s.id", table)))
+        return Specimen.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def autocomplete(self, text, limit=10):
+        """Sugerencias para el autocompletado del portal público"""
+        domain = [('es_publico', '=', True), ('status', '=', 'activo')]
+        specimens = self.search_specimens(text, domain, limit=limit)
+        return [{
+            'id': spec.id,
+            'nombre_cientifico': spec.nombre_cientifico,
+            'familia': spec.familia,
+            'codigo': spec.codigo_herbario,
+            'url': f'/herbario/specimen/{spec.id}'
+        } for spec in specimens]
@@ -1,6 +1,14 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import create_index, index_exists
 import re
+from .search_engine import SPECIMEN_SEARCH_FIELDS
+from .statistics_cube import STATS_SPECIMEN_FIELDS
+from .related_engine import RELATED_SPECIMEN_FIELDS
+from .taxon import TAXON_SPECIMEN_FIELDS
+
+# Campos cuyos cambios se registran en herbario.history.log
+HISTORY_TRACKED_FIELDS = ['nombre_cientifico', 'familia', 'genero', 'especie', 'status']
 
 
 class SpecimenRegistry(models.Model):
@@ -50,6 +58,14 @@ class SpecimenRegistry(models.Model):
         store=True,
         index=True
     )
+    taxon_id = fields.Many2one(
+        'herbario.taxon',
+        string='Taxón',
+        readonly=True,
+        index=True,
+        ondelete='restrict',
+        help='Nodo del árbol taxonómico (familia, género o especie) del espécimen'
+    )
     autor_cientifico = fields.Char(
         string='Autor Científico',
         help='Autor de la descripción científica'
@@ -107,6 +123,11 @@ class SpecimenRegistry(models.Model):
         compute='_compute_total_ubicaciones',
         store=True
     )
+    primary_image_id = fields.Many2one(
+        'herbario.image',
+        string='Registro de Imagen Principal',
+        compute='_compute_primary_image_id'
+    )
     primary_image = fields.Binary(
         string='Imagen Principal',
         compute='_compute_primary_image'
@@ -138,6 +159,13 @@ class SpecimenRegistry(models.Model):
         ('codigo_herbario_unique', 'UNIQUE(codigo_herbario)', 'El código de herbario debe ser único.'),
     ]
 
+    def init(self):
+        """Crea índices de trigramas, el documento de búsqueda y los índices de paginación por cursor"""
+        self.env['herbario.search.engine']._ensure_search_structures()
+        if not index_exists(self.env.cr, 'herbario_specimen_nombre_cientifico_id_idx'):
+            create_index(self.env.cr, 'herbario_specimen_nombre_cientifico_id_idx', self._table,
+                         ['nombre_cientifico', 'id'])
+
     @api.model
     def _get_next_code(self):
         """Genera el siguiente código CHEP-XXXXXXX"""
@@ -156,23 +184,37 @@ class SpecimenRegistry(models.Model):
                 record.genero = ''
                 record.especie = ''
 
+    def _assign_taxon(self):
+        """Enlaza cada espécimen con el nodo de su familia/género/especie, creando la ruta si falta"""
+        paths = {record: ((record.familia or '').strip(), record.genero or '', record.especie or '')
+                 for record in self}
+        taxa = self.env['herbario.taxon'].sudo()._get_or_create_paths(paths.values())
+        by_taxon = {}
+        for record, path in paths.items():
+            by_taxon.setdefault(taxa.get(path, False), []).append(record.id)
+        for taxon_id, record_ids in by_taxon.items():
+            # Sin pasar por el write del modelo: no es un cambio del usuario
+            super(SpecimenRegistry, self.browse(record_ids)).write({'taxon_id': taxon_id})
+
     @api.depends('collection_site_ids')
     def _compute_total_ubicaciones(self):
         """Calcula el total de ubicaciones registradas"""
         for record in self:
             record.total_ubicaciones = len(record.collection_site_ids)
 
-    @api.depends('image_ids.is_primary')
+    @api.depends('image_ids.is_primary', 'image_ids.deleted_at')
+    def _compute_primary_image_id(self):
+        """Obtiene el registro de la imagen principal sin leer sus datos binarios"""
+        for record in self:
+            images = record.image_ids.filtered(lambda img: not img.deleted_at)
+            primary_img = images.filtered(lambda img: img.is_primary)
+            record.primary_image_id = primary_img[:1] or images[:1]
+
+    @api.depends('primary_image_id')
     def _compute_primary_image(self):
         """Obtiene la imagen principal"""
         for record in self:
-            primary_img = record.image_ids.filtered(lambda img: img.is_primary)
-            if primary_img:
-                record.primary_image = primary_img[0].image_data
-            elif record.image_ids:
-                record.primary_image = record.image_ids[0].image_data
-            else:
-                record.primary_image = False
+            record.primary_image = record.primary_image_id.image_data or False
 
     @api.depends('collection_site_ids.is_primary')
     def _compute_primary_location(self):
@@ -189,79 +231,130 @@ class SpecimenRegistry(models.Model):
     @api.constrains('nombre_cientifico', 'familia')
     def _check_unique_specimen(self):
         """Evita duplicados por nombre científico + familia"""
-        for record in self:
-            duplicate = self.search([
-                ('id', '!=', record.id),
-                ('nombre_cientifico', '=', record.nombre_cientifico),
-                ('familia', '=', record.familia)
-            ], limit=1)
-            if duplicate:
-                raise ValidationError(
-                    f'Ya existe un espécimen con el nombre científico "{record.nombre_cientifico}" '
-                    f'y familia "{record.familia}" (Código: {duplicate.codigo_herbario})'
-                )
+        if not self.ids:
+            return
+        self.flush_model(['nombre_cientifico', 'familia'])
+        # Una sola consulta para todo el lote en lugar de un search por registro
+        self.env.cr.execute("""
+            SELECT s.id, d.codigo_herbario
+              FROM herbario_specimen s
+              JOIN herbario_specimen d
+                ON d.nombre_cientifico = s.nombre_cientifico
+               AND d.familia = s.familia
+               AND d.id != s.id
+             WHERE s.id IN %s
+             LIMIT 1
+        """, [tuple(self.ids)])
+        row = self.env.cr.fetchone()
+        if row:
+            record = self.browse(row[0])
+            raise ValidationError(
+                f'Ya existe un espécimen con el nombre científico "{record.nombre_cientifico}" '
+                f'y familia "{record.familia}" (Código: {row[1]})'
+            )
+
+    def _prepare_history_vals(self, action_type, field_modified=None, old_value=None, new_value=None):
+        """Valores de una entrada de herbario.history.log para este espécimen"""
+        self.ensure_one()
+        return {
+            'specimen_id': self.id,
+            'entity_type': 'specimen',
+            'entity_id': self.id,
+            'action_type': action_type,
+            'field_modified': field_modified,
+            'old_value': old_value,
+            'new_value': new_value,
+        }
 
     def write(self, vals):
         """Override para registrar cambios en el historial"""
         vals['updated_by'] = self.env.user.id
         vals['updated_at'] = fields.Datetime.now()
         
-        # Registrar cambios en history_log
-        tracked_fields = ['nombre_cientifico', 'familia', 'genero', 'especie', 'status']
-        for record in self:
-            for field in tracked_fields:
-                if field in vals and vals[field] != record[field]:
-                    self.env['herbario.history.log'].create({
-                        'specimen_id': record.id,
-                        'entity_type': 'specimen',
-                        'entity_id': record.id,
-                        'action_type': 'updated',
-                        'field_modified': field,
-                        'old_value': str(record[field]) if record[field] else '',
-                        'new_value': str(vals[field]) if vals[field] else '',
-                        'user_id': self.env.user.id,
-                        'user_name': self.env.user.name,
-                    })
+        # Registrar cambios en history_log: las entradas van al buffer de la
+        # transacción y se insertan juntas antes del commit
+        tracked_fields = [field for field in HISTORY_TRACKED_FIELDS if field in vals]
+        log_vals_list = []
+        if tracked_fields:
+            for record in self:
+                for field in tracked_fields:
+                    if vals[field] != record[field]:
+                        log_vals_list.append(record._prepare_history_vals(
+                            'updated',
+                            field_modified=field,
+                            old_value=str(record[field]) if record[field] else '',
+                            new_value=str(vals[field]) if vals[field] else '',
+                        ))
+        self.env['herbario.history.log']._buffer_entries(log_vals_list)
         
-        return super(SpecimenRegistry, self).write(vals)
+        Taxon = self.env['herbario.taxon'].sudo()
+        taxon_tracked = any(field in vals for field in TAXON_SPECIMEN_FIELDS)
+        taxon_before = Taxon._specimen_contributions(self.ids) if taxon_tracked else {}
+        PageCache = self.env['herbario.page.cache']
+        # Antes y después: un cambio de familia afecta a los relacionados de ambas
+        PageCache._invalidate_specimens(self)
+        res = super(SpecimenRegistry, self).write(vals)
+        if 'familia' in vals or 'nombre_cientifico' in vals:
+            self._assign_taxon()
+        if taxon_tracked:
+            Taxon._apply_contributions(taxon_before, Taxon._specimen_contributions(self.ids))
+        if 'familia' in vals:
+            PageCache._invalidate_specimens(self)
+        if any(field in vals for field in SPECIMEN_SEARCH_FIELDS):
+            self.env['herbario.search.engine'].refresh_documents(self.ids)
+        if any(field in vals for field in STATS_SPECIMEN_FIELDS):
+            self.env['herbario.statistics.cube'].refresh_specimens(self.ids)
+        if any(field in vals for field in RELATED_SPECIMEN_FIELDS):
+            self.env['herbario.related.engine'].refresh_specimens(self.ids)
+        return res
 
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Override para registrar creación en el historial"""
-        if not vals.get('codigo_herbario'):
-            vals['codigo_herbario'] = self._get_next_code()
-        record = super(SpecimenRegistry, self).create(vals)
+        for vals in vals_list:
+            if not vals.get('codigo_herbario'):
+                vals['codigo_herbario'] = self._get_next_code()
+        records = super(SpecimenRegistry, self).create(vals_list)
+        records._assign_taxon()
+        Taxon = self.env['herbario.taxon'].sudo()
+        Taxon._apply_contributions({}, Taxon._specimen_contributions(records.ids))
         
-        # Registrar creación en history_log
-        self.env['herbario.history.log'].create({
-            'specimen_id': record.id,
-            'entity_type': 'specimen',
-            'entity_id': record.id,
-            'action_type': 'created',
-            'field_modified': None,
-            'old_value': None,
-            'new_value': f'Espécimen creado: {record.nombre_cientifico}',
-            'user_id': self.env.user.id,
-            'user_name': self.env.user.name,
-        })
+        # Registrar creación en history_log (buffer de la transacción)
+        self.env['herbario.history.log']._buffer_entries([
+            record._prepare_history_vals(
+                'created',
+                new_value=f'Espécimen creado: {record.nombre_cientifico}',
+            )
+            for record in records
+        ])
+        self.env['herbario.search.engine'].refresh_documents(records.ids)
+        self.env['herbario.statistics.cube'].refresh_specimens(records.ids)
+        self.env['herbario.related.engine'].refresh_specimens(records.ids)
+        self.env['herbario.page.cache']._invalidate_specimens(records)
         
-        return record
+        return records
 
     def unlink(self):
         """Override para registrar eliminación en el historial"""
-        for record in self:
-            self.env['herbario.history.log'].create({
-                'specimen_id': record.id,
-                'entity_type': 'specimen',
-                'entity_id': record.id,
-                'action_type': 'deleted',
-                'field_modified': None,
-                'old_value': f'Código: {record.codigo_herbario}',
-                'new_value': None,
-                'user_id': self.env.user.id,
-                'user_name': self.env.user.name,
-            })
-        return super(SpecimenRegistry, self).unlink()
+        self.env['herbario.history.log']._buffer_entries([
+            record._prepare_history_vals(
+                'deleted',
+                old_value=f'Código: {record.codigo_herbario}',
+            )
+            for record in self
+        ])
+        specimen_ids = self.ids
+        Taxon = self.env['herbario.taxon'].sudo()
+        taxon_before = Taxon._specimen_contributions(specimen_ids)
+        self.env['herbario.page.cache']._invalidate_specimens(self)
+        # Antes de borrar: las listas que los contienen se leen de la tabla de vecinos
+        self.env['herbario.related.engine'].refresh_specimens(specimen_ids)
+        res = super(SpecimenRegistry, self).unlink()
+        Taxon._apply_contributions(taxon_before, {})
+        self.env['herbario.statistics.cube'].refresh_specimens(specimen_ids)
+        # El historial del espécimen se borra en cascada
+        self.env['herbario.history.log']._clear_statistics_cache()
+        return res
 
     def action_generate_qr(self):
         """Acción para generar código QR"""
@@ -0,0 +1,252 @@
+from odoo import models, api
+from odoo.tools import split_every
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Ancho de las franjas altitudinales (m.s.n.m.)
+ALTITUDE_BAND_SIZE = 500
+
+# Dimensiones del cubo (columnas comunes a la tabla de hechos y la de agregados)
+CUBE_DIMENSIONS = ['familia', 'genero', 'especie', 'provincia', 'year', 'altitude_band']
+CUBE_MEASURES = ['specimen_count', 'site_count', 'image_count']
+
+# Campos cuyo cambio altera la contribución de un espécimen al cubo
+STATS_SPECIMEN_FIELDS = ['familia', 'genero', 'especie', 'es_publico', 'status']
+STATS_SITE_FIELDS = ['specimen_id', 'provincia', 'fecha_recoleccion', 'altitud', 'is_primary']
+STATS_IMAGE_FIELDS = ['specimen_id', 'deleted_at']
+
+REFRESH_BATCH_SIZE = 1000
+STATS_REFRESH_KEY = 'herbario.statistics.cube.refresh'
+
+
+class HerbarioStatisticsCube(models.AbstractModel):
+    _name = 'herbario.statistics.cube'
+    _description = 'Cubo de Estadísticas del Herbario'
+
+    # ==================== ESTRUCTURAS EN BASE DE DATOS ====================
+
+    def init(self):
+        """
+        Crea la tabla de hechos (una fila por ubicación de cada espécimen público)
+        y la tabla de agregados por familia/género/especie/provincia/año/franja
+        """
+        cr = self.env.cr
+        cr.execute("""
+            CREATE TABLE IF NOT EXISTS herbario_stats_fact (
+                specimen_id integer NOT NULL,
+                site_id integer,
+                familia varchar,
+                genero varchar,
+                especie varchar,
+                provincia varchar,
+                year integer,
+                altitude_band integer,
+                specimen_count integer NOT NULL DEFAULT 0,
+                site_count integer NOT NULL DEFAULT 0,
+                image_count integer NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS herbario_stats_fact_specimen_id_idx
+                ON herbario_stats_fact (specimen_id);
+
+            CREATE TABLE IF NOT EXISTS herbario_stats_cube (
+                familia varchar,
+                genero varchar,
+                especie varchar,
+                provincia varchar,
+                year integer,
+                altitude_band integer,
+                specimen_count integer NOT NULL DEFAULT 0,
+                site_count integer NOT NULL DEFAULT 0,
+                image_count integer NOT NULL DEFAULT 0
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS herbario_stats_cube_dimensions_uniq
+                ON herbario_stats_cube (familia, genero, especie, provincia, year, altitude_band)
+                NULLS NOT DISTINCT;
+        """)
+        # Primera instalación o actualización desde una versión sin cubo
+        cr.execute("SELECT to_regclass('herbario_collection_site') IS NOT NULL AND to_regclass('herbario_image') IS NOT NULL")
+        if cr.fetchone()[0]:
+            cr.execute("SELECT NOT EXISTS (SELECT 1 FROM herbario_stats_fact) AND EXISTS (SELECT 1 FROM herbario_specimen)")
+            if cr.fetchone()[0]:
+                self.rebuild()
+
+    def _fact_select_sql(self, where):
+        """SELECT de los hechos actuales; ``where`` filtra sobre el alias ``s`` (herbario_specimen)"""
+        return f"""
+            SELECT s.id,
+                   cs.id,
+                   s.familia,
+                   s.genero,
+                   s.especie,
+                   cs.provincia,
+                   extract(year FROM cs.fecha_recoleccion)::integer,
+                   (NULLIF(cs.altitud, 0) / {ALTITUDE_BAND_SIZE}) * {ALTITUDE_BAND_SIZE},
+                   -- El espécimen y sus imágenes se cuentan una sola vez, en su ubicación principal
+                   CASE WHEN coalesce(cs.rank, 1) = 1 THEN 1 ELSE 0 END,
+                   CASE WHEN cs.id IS NULL THEN 0 ELSE 1 END,
+                   CASE WHEN coalesce(cs.rank, 1) = 1 THEN img.image_count ELSE 0 END
+              FROM herbario_specimen s
+         LEFT JOIN LATERAL (
+                    SELECT site.id, site.provincia, site.fecha_recoleccion, site.altitud,
+                           row_number() OVER (ORDER BY site.is_primary DESC NULLS LAST, site.id) AS rank
+                      FROM herbario_collection_site site
+                     WHERE site.specimen_id = s.id
+                   ) cs ON TRUE
+        CROSS JOIN LATERAL (
+                    SELECT count(*) AS image_count
+                      FROM herbario_image i
+                     WHERE i.specimen_id = s.id AND i.deleted_at IS NULL
+                   ) img
+             WHERE s.es_publico AND s.status = 'activo' AND {where}
+        """
+
+    # ==================== ACTUALIZACIÓN ====================
+
+    @api.model
+    def rebuild(self):
+        """Reconstruye hechos y agregados desde cero"""
+        self.env.flush_all()
+        cr = self.env.cr
+        dimensions = ', '.join(CUBE_DIMENSIONS)
+        measures = ', '.join(CUBE_MEASURES)
+        cr.execute("TRUNCATE herbario_stats_fact, herbario_stats_cube")
+        cr.execute(f"""
+            INSERT INTO herbario_stats_fact (specimen_id, site_id, {dimensions}, {measures})
+            {self._fact_select_sql('TRUE')}
+        """)
+        cr.execute(f"""
+            INSERT INTO herbario_stats_cube ({dimensions}, {measures})
+            SELECT {dimensions}, sum(specimen_count), sum(site_count), sum(image_count)
+              FROM herbario_stats_fact
+          GROUP BY {dimensions}
+        """)
+        _logger.info("[HerbarioStats] Cubo de estadísticas reconstruido")
+
+    @api.model
+    def refresh_specimens(self, specimen_ids):
+        """
+        Marca los especímenes para actualizar el cubo una sola vez, antes del commit
+
+        Las celdas del cubo son compartidas: actualizarlas en cada escritura
+        alarga los bloqueos sobre ellas durante toda la transacción.
+        """
+        specimen_ids = {specimen_id for specimen_id in specimen_ids if specimen_id}
+        if not specimen_ids:
+            return
+        data = self.env.cr.precommit.data
+        pending = data.get(STATS_REFRESH_KEY)
+        if pending is None:
+            pending = data[STATS_REFRESH_KEY] = set()
+            self.env.cr.precommit.add(self._flush_refresh)
+        pending.update(specimen_ids)
+
+    @api.model
+    def _flush_refresh(self):
+        """
+        Actualiza incrementalmente el cubo para los especímenes pendientes
+
+        Se resta la contribución anterior de cada espécimen (sus filas en la tabla
+        de hechos), se insertan los hechos actuales y se suma su contribución; las
+        celdas que quedan vacías se eliminan.
+        """
+        pending = self.env.cr.precommit.data.pop(STATS_REFRESH_KEY, None)
+        if not pending:
+            return
+        specimen_ids = sorted(pending)
+        self.env.flush_all()
+        cr = self.env.cr
+        dimensions = ', '.join(CUBE_DIMENSIONS)
+        measures = ', '.join(CUBE_MEASURES)
+        same_cell = ' AND '.join(f'c.{dim} IS NOT DISTINCT FROM delta.{dim}' for dim in CUBE_DIMENSIONS)
+        for batch_ids in split_every(REFRESH_BATCH_SIZE, specimen_ids):
+            batch_ids = tuple(batch_ids)
+            cr.execute(f"""
+                WITH old AS (
+                    DELETE FROM herbario_stats_fact WHERE specimen_id IN %s
+                    RETURNING {dimensions}, {measures}
+                ), delta AS (
+                    SELECT {dimensions}, sum(specimen_count) AS specimen_count,
+                           sum(site_count) AS site_count, sum(image_count) AS image_count
+                      FROM old
+                  GROUP BY {dimensions}
+                )
+                UPDATE herbario_stats_cube c
+                   SET specimen_count = c.specimen_count - delta.specimen_count,
+                       site_count = c.site_count - delta.site_count,
+                       image_count = c.image_count - delta.image_count
+                  FROM delta
+                 WHERE {same_cell}
+            """, [batch_ids])
+            cr.execute(f"""
+                WITH new AS (
+                    INSERT INTO herbario_stats_fact (specimen_id, site_id, {dimensions}, {measures})
+                    {self._fact_select_sql('s.id IN %s')}
+                    RETURNING {dimensions}, {measures}
+                )
+                INSERT INTO herbario_stats_cube ({dimensions}, {measures})
+                SELECT {dimensions}, sum(specimen_count), sum(site_count), sum(image_count)
+                  FROM new
+              GROUP BY {dimensions}
+                    ON CONFLICT ({dimensions}) DO UPDATE
+                   SET specimen_count = herbario_stats_cube.specimen_count + EXCLUDED.specimen_count,
+                       site_count = herbario_stats_cube.site_count + EXCLUDED.site_count,
+                       image_count = herbario_stats_cube.image_count + EXCLUDED.image_count
+            """, [batch_ids])
+        cr.execute("DELETE FROM herbario_stats_cube WHERE specimen_count <= 0 AND site_count <= 0")
+
+    # ==================== CONSULTAS ====================
+
+    @api.model
+    def get_summary(self, top=10):
+        """
+        Totales y distribuciones del portal público en una sola consulta
+
+        Los GROUPING SETS agregan el cubo (unas pocas filas por combinación de
+        taxón y lugar) por familia, provincia, año y franja altitudinal, más la
+        fila de totales.
+        """
+        # Cambios de esta misma transacción aún no aplicados
+        self._flush_refresh()
+        self.env.cr.execute("""
+            SELECT GROUPING(familia, provincia, year, altitude_band) AS grouping_id,
+                   familia, provincia, year, altitude_band,
+                   sum(specimen_count), sum(site_count), sum(image_count),
+                   count(DISTINCT familia), count(DISTINCT genero), count(DISTINCT especie)
+              FROM herbario_stats_cube
+          GROUP BY GROUPING SETS ((familia), (provincia), (year), (altitude_band), ())
+        """)
+        summary = {
+            'stats': {
+                'total_specimens': 0, 'total_families': 0, 'total_genera': 0,
+                'total_species': 0, 'total_locations': 0, 'total_images': 0,
+            },
+            'families': [], 'provinces': [], 'years': [], 'altitude_bands': [],
+        }
+        # El bit más alto de GROUPING() corresponde a la primera columna
+        for (grouping_id, familia, provincia, year, altitude_band, specimens, sites, images,
+             families, genera, species) in self.env.cr.fetchall():
+            if grouping_id == 0b1111:
+                summary['stats'].update({
+                    'total_specimens': specimens,
+                    'total_families': families,
+                    'total_genera': genera,
+                    'total_species': species,
+                    'total_locations': sites,
+                    'total_images': images,
+                })
+            elif grouping_id == 0b0111 and familia and specimens:
+                summary['families'].append((familia, specimens))
+            elif grouping_id == 0b1011 and provincia and sites:
+                summary['provinces'].append((provincia, sites))
+            elif grouping_id == 0b1101 and year and sites:
+                summary['years'].append((year, sites))
+            elif grouping_id == 0b1110 and altitude_band is not None and sites:
+                summary['altitude_bands'].append((
+                    f'{altitude_band}-{altitude_band + ALTITUDE_BAND_SIZE}', sites))
+
+        summary['families'] = sorted(summary['families'], key=lambda x: x[1], reverse=True)[:top]
+        summary['provinces'] = sorted(summary['provinces'], key=lambda x: x[1], reverse=True)[:top]
+        summary['years'].sort()
+        summary['altitude_bands'].sort(key=lambda x: int(x[0].split('-')[0]))
+        return summary
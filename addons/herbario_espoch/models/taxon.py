@@ -0,0 +1,349 @@
+from odoo import models, fields, api
+from collections import defaultdict
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Niveles del árbol taxonómico, de la raíz a las hojas
+TAXON_RANKS = ['family', 'genus', 'species']
+
+# Campos de herbario.specimen que cambian su taxón o si se cuenta
+TAXON_SPECIMEN_FIELDS = ['familia', 'nombre_cientifico', 'es_publico', 'status']
+TAXON_IMAGE_FIELDS = ['specimen_id', 'deleted_at']
+
+# Diferencias de contadores de la transacción en cr.precommit.data
+TAXON_DELTA_KEY = 'herbario.taxon.count.delta'
+# Diferencias pendientes que el cron suma al árbol por sentencia
+TAXON_FOLD_BATCH_SIZE = 5000
+
+
+class HerbarioTaxon(models.Model):
+    _name = 'herbario.taxon'
+    _description = 'Taxón del Herbario'
+    _parent_store = True
+    _rec_name = 'complete_name'
+    _order = 'complete_name'
+
+    name = fields.Char(string='Nombre', required=True, index=True)
+    rank = fields.Selection([
+        ('family', 'Familia'),
+        ('genus', 'Género'),
+        ('species', 'Especie'),
+    ], string='Rango', required=True, index=True)
+    parent_id = fields.Many2one('herbario.taxon', string='Taxón Superior', index=True, ondelete='restrict')
+    parent_path = fields.Char(index=True, unaccent=False)
+    child_ids = fields.One2many('herbario.taxon', 'parent_id', string='Taxones Inferiores')
+    complete_name = fields.Char(
+        string='Nombre Completo',
+        compute='_compute_complete_name',
+        store=True,
+        recursive=True
+    )
+    specimen_ids = fields.One2many('herbario.specimen', 'taxon_id', string='Especímenes')
+
+    # Contadores del subárbol (especímenes públicos y activos), mantenidos al escribir
+    specimen_count = fields.Integer(string='Especímenes', readonly=True)
+    image_count = fields.Integer(string='Imágenes', readonly=True)
+
+    def init(self):
+        """
+        Unicidad por nivel y padre, cola de diferencias de los contadores;
+        construye el árbol de los especímenes existentes
+        """
+        cr = self.env.cr
+        cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS herbario_taxon_parent_rank_name_uniq
+                ON herbario_taxon (parent_id, rank, name) NULLS NOT DISTINCT;
+            CREATE TABLE IF NOT EXISTS herbario_taxon_count_delta (
+                id bigserial PRIMARY KEY,
+                taxon_id integer NOT NULL REFERENCES herbario_taxon (id) ON DELETE CASCADE,
+                specimens integer NOT NULL,
+                images integer NOT NULL
+            );
+        """)
+        cr.execute("SELECT EXISTS (SELECT 1 FROM herbario_specimen WHERE taxon_id IS NULL AND familia IS NOT NULL)")
+        if cr.fetchone()[0]:
+            self.env['herbario.specimen'].with_context(active_test=False).search([
+                ('taxon_id', '=', False), ('familia', '!=', False),
+            ])._assign_taxon()
+            self.rebuild_counts()
+
+    @api.depends('name', 'rank', 'parent_id.complete_name')
+    def _compute_complete_name(self):
+        for taxon in self:
+            if not taxon.parent_id:
+                taxon.complete_name = taxon.name
+            elif taxon.rank == 'species':
+                # Binomio: "Familia / Género especie"
+                taxon.complete_name = f'{taxon.parent_id.complete_name} {taxon.name}'
+            else:
+                taxon.complete_name = f'{taxon.parent_id.complete_name} / {taxon.name}'
+
+    # ==================== ÁRBOL ====================
+
+    @api.model
+    def _read_nodes(self, rank, keys):
+        """``{(parent_id, nombre): id}`` de los taxones del nivel que ya existen"""
+        existing = self.search_read([
+            ('rank', '=', rank),
+            ('name', 'in', list({name for _parent_id, name in keys})),
+            ('parent_id', 'in', list({parent_id for parent_id, _name in keys})),
+        ], ['parent_id', 'name'])
+        nodes = {(taxon['parent_id'] and taxon['parent_id'][0], taxon['name']): taxon['id'] for taxon in existing}
+        return {key: taxon_id for key, taxon_id in nodes.items() if key in keys}
+
+    @api.model
+    def _get_or_create_nodes(self, rank, keys):
+        """
+        ``{(parent_id, nombre): id}`` de los taxones del nivel, creando los que falten
+
+        Los que faltan se insertan con ON CONFLICT DO NOTHING sobre la restricción
+        de unicidad: si otra transacción crea el mismo taxón a la vez no hay error
+        de clave duplicada y su fila se lee después. ``parent_path`` y
+        ``complete_name`` de los insertados se completan como lo haría ``create``.
+        """
+        if not keys:
+            return {}
+        nodes = self._read_nodes(rank, keys)
+        missing = sorted((key for key in keys if key not in nodes), key=lambda key: (key[0] or 0, key[1]))
+        if not missing:
+            return nodes
+        self.env.cr.execute("""
+            INSERT INTO herbario_taxon (rank, parent_id, name, specimen_count, image_count,
+                                        create_uid, create_date, write_uid, write_date)
+                 SELECT %(rank)s, nullif(m.parent_id, 0), m.name, 0, 0,
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                   FROM unnest(%(parent_ids)s::integer[], %(names)s::varchar[]) AS m(parent_id, name)
+            ON CONFLICT (parent_id, rank, name) DO NOTHING
+              RETURNING id
+        """, {
+            'rank': rank,
+            'uid': self.env.uid,
+            'parent_ids': [parent_id or 0 for parent_id, _name in missing],
+            'names': [name for _parent_id, name in missing],
+        })
+        created = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if created:
+            created._parent_store_create()
+            self.env.add_to_compute(self._fields['complete_name'], created)
+        nodes.update(self._read_nodes(rank, set(missing)))
+        return nodes
+
+    @api.model
+    def _get_or_create_paths(self, paths):
+        """
+        Taxón más específico de cada ``(familia, genero, especie)``
+
+        Se resuelve nivel por nivel con una búsqueda y un ``create`` por nivel para
+        todas las rutas a la vez.
+        """
+        paths = {tuple((value or '').strip() for value in path) for path in paths}
+        paths = {path for path in paths if path[0]}
+        families = self._get_or_create_nodes('family', {(False, familia) for familia, _g, _e in paths})
+        genera = self._get_or_create_nodes('genus', {
+            (families[(False, familia)], genero) for familia, genero, _e in paths if genero
+        })
+        species = self._get_or_create_nodes('species', {
+            (genera[(families[(False, familia)], genero)], especie)
+            for familia, genero, especie in paths if genero and especie
+        })
+
+        result = {}
+        for familia, genero, especie in paths:
+            taxon_id = families[(False, familia)]
+            if genero:
+                taxon_id = genera[(taxon_id, genero)]
+                if especie:
+                    taxon_id = species[(taxon_id, especie)]
+            result[(familia, genero, especie)] = taxon_id
+        return result
+
+    # ==================== CONTADORES ====================
+
+    @api.model
+    def _specimen_contributions(self, specimen_ids):
+        """
+        ``{espécimen: (taxón, imágenes)}`` de los especímenes que cuentan en el árbol
+
+        Se llama antes y después de un cambio; la diferencia se aplica con
+        ``_apply_contributions``.
+        """
+        specimen_ids = [specimen_id for specimen_id in specimen_ids if specimen_id]
+        if not specimen_ids:
+            return {}
+        self.env['herbario.specimen'].flush_model(['taxon_id', 'es_publico', 'status'])
+        self.env['herbario.image'].flush_model(['specimen_id', 'deleted_at'])
+        self.env.cr.execute("""
+            SELECT s.id, s.taxon_id,
+                   (SELECT count(*) FROM herbario_image i WHERE i.specimen_id = s.id AND i.deleted_at IS NULL)
+              FROM herbario_specimen s
+             WHERE s.id IN %s AND s.taxon_id IS NOT NULL AND s.es_publico AND s.status = 'activo'
+        """, [tuple(specimen_ids)])
+        return {specimen_id: (taxon_id, images) for specimen_id, taxon_id, images in self.env.cr.fetchall()}
+
+    @api.model
+    def _apply_contributions(self, before, after):
+        """
+        Acumula la diferencia entre dos ``_specimen_contributions``
+
+        Las diferencias se consolidan por taxón en la transacción y se insertan
+        antes del commit en la cola ``herbario_taxon_count_delta`` (solo
+        inserciones: las ediciones simultáneas de una misma familia no compiten
+        por su fila); el cron las suma al taxón y sus ancestros.
+        """
+        data = self.env.cr.precommit.data
+        deltas = data.get(TAXON_DELTA_KEY)
+        if deltas is None:
+            deltas = data[TAXON_DELTA_KEY] = defaultdict(lambda: [0, 0])
+            self.env.cr.precommit.add(self._flush_count_deltas)
+        for contributions, sign in ((before, -1), (after, 1)):
+            for taxon_id, images in contributions.values():
+                deltas[taxon_id][0] += sign
+                deltas[taxon_id][1] += sign * images
+
+    @api.model
+    def _flush_count_deltas(self):
+        """Inserta las diferencias de la transacción en la cola y avisa al cron"""
+        deltas = self.env.cr.precommit.data.pop(TAXON_DELTA_KEY, None) or {}
+        deltas = {taxon_id: delta for taxon_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        taxon_ids = sorted(deltas)
+        self.env.cr.execute("""
+            INSERT INTO herbario_taxon_count_delta (taxon_id, specimens, images)
+                 SELECT * FROM unnest(%s::integer[], %s::integer[], %s::integer[])
+        """, [taxon_ids, [deltas[i][0] for i in taxon_ids], [deltas[i][1] for i in taxon_ids]])
+        cron = self.env.ref('herbario_espoch.ir_cron_herbario_taxon_counts', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _fold_count_deltas(self, limit=TAXON_FOLD_BATCH_SIZE):
+        """
+        Suma un lote de la cola a los contadores en una sola sentencia
+
+        Cada taxón y ancestro se actualiza una vez por lote. Devuelve el número de
+        diferencias consumidas.
+        """
+        self.flush_model(['parent_path', 'specimen_count', 'image_count'])
+        self.env.cr.execute("""
+            WITH claimed AS (
+                DELETE FROM herbario_taxon_count_delta
+                 WHERE id IN (
+                        SELECT id
+                          FROM herbario_taxon_count_delta
+                      ORDER BY id
+                         LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                       )
+             RETURNING taxon_id, specimens, images
+            ), node_deltas AS (
+                SELECT ancestor.id, sum(c.specimens) AS specimens, sum(c.images) AS images
+                  FROM claimed c
+                  JOIN herbario_taxon n ON n.id = c.taxon_id
+            CROSS JOIN LATERAL unnest(string_to_array(trim(BOTH '/' FROM n.parent_path), '/')::integer[]) AS ancestor(id)
+              GROUP BY ancestor.id
+            ), updated AS (
+                UPDATE herbario_taxon t
+                   SET specimen_count = t.specimen_count + d.specimens,
+                       image_count = t.image_count + d.images
+                  FROM node_deltas d
+                 WHERE t.id = d.id AND (d.specimens <> 0 OR d.images <> 0)
+            )
+            SELECT count(*) FROM claimed
+        """, [limit])
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _cron_fold_counts(self, batch_size=TAXON_FOLD_BATCH_SIZE, auto_commit=True):
+        """Vacía la cola de diferencias de los contadores del árbol"""
+        total = 0
+        while True:
+            count = self._fold_count_deltas(batch_size)
+            total += count
+            if auto_commit:
+                self.env.cr.commit()
+            if count < batch_size:
+                break
+        self.invalidate_model(['specimen_count', 'image_count'])
+        return total
+
+    @api.model
+    def rebuild_counts(self):
+        """
+        Recalcula los contadores de todo el árbol
+
+        Descarta las diferencias de la cola que ya ve: el recálculo las incluye.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("DELETE FROM herbario_taxon_count_delta")
+        self.env.cr.execute("""
+            WITH direct AS (
+                SELECT s.taxon_id, count(*) AS specimens, coalesce(sum(img.images), 0) AS images
+                  FROM herbario_specimen s
+            CROSS JOIN LATERAL (
+                        SELECT count(*) AS images
+                          FROM herbario_image i
+                         WHERE i.specimen_id = s.id AND i.deleted_at IS NULL
+                       ) img
+                 WHERE s.taxon_id IS NOT NULL AND s.es_publico AND s.status = 'activo'
+              GROUP BY s.taxon_id
+            ), subtree AS (
+                SELECT ancestor.id, sum(d.specimens) AS specimens, sum(d.images) AS images
+                  FROM direct d
+                  JOIN herbario_taxon n ON n.id = d.taxon_id
+            CROSS JOIN LATERAL unnest(string_to_array(trim(BOTH '/' FROM n.parent_path), '/')::integer[]) AS ancestor(id)
+              GROUP BY ancestor.id
+            )
+            UPDATE herbario_taxon t
+               SET specimen_count = coalesce(subtree.specimens, 0),
+                   image_count = coalesce(subtree.images, 0)
+              FROM herbario_taxon t2
+         LEFT JOIN subtree ON subtree.id = t2.id
+             WHERE t.id = t2.id
+        """)
+        self.invalidate_model(['specimen_count', 'image_count'])
+        _logger.info("[HerbarioTaxon] Contadores del árbol taxonómico recalculados")
+
+    # ==================== CONSULTAS ====================
+
+    @api.model
+    def _facet_counts(self, facet, filters, limit):
+        """
+        Valores de la faceta familia o género leídos del árbol
+
+        Solo es posible sin otros filtros (para el género se admite la familia:
+        son los hijos de su nodo); si no, devuelve None y la faceta se cuenta
+        sobre los especímenes.
+        """
+        others = {key for key, value in filters.items() if value and key != facet}
+        if facet == 'familia' and not others:
+            domain = [('rank', '=', 'family')]
+        elif facet == 'genero' and others <= {'familia'}:
+            domain = [('rank', '=', 'genus')]
+            if filters.get('familia'):
+                domain += [('parent_id.name', '=', filters['familia'])]
+        else:
+            return None
+        groups = self._read_group(
+            domain + [('specimen_count', '>', 0)], ['name'], ['specimen_count:sum'],
+            order='specimen_count:sum desc, name', limit=limit,
+        )
+        return dict(groups)
+
+    @api.model
+    def get_family_names(self, with_images=False):
+        """Familias con especímenes públicos (o con imágenes publicadas), por nombre"""
+        count_field = 'image_count' if with_images else 'specimen_count'
+        return self.search([('rank', '=', 'family'), (count_field, '>', 0)], order='name').mapped('name')
+
+    def action_view_specimens(self):
+        """Especímenes del taxón y de sus taxones inferiores"""
+        self.ensure_one()
+        return {
+            'name': f'Especímenes de {self.complete_name}',
+            'type': 'ir.actions.act_window',
+            'res_model': 'herbario.specimen',
+            'view_mode': 'tree,form',
+            'domain': [('taxon_id', 'child_of', self.id)],
+        }
@@ -0,0 +1,247 @@
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+from odoo.tools import config
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+_logger = logging.getLogger(__name__)
+
+# Tamaño máximo aceptado por bloque (el cliente puede enviar bloques menores)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Tamaño máximo de un archivo subido por bloques
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# Bloque de lectura/escritura en disco
+UPLOAD_IO_BLOCK = 64 * 1024
+# Sesiones sin actividad durante este tiempo se eliminan junto a su archivo temporal
+UPLOAD_EXPIRATION_HOURS = 24
+# Sesiones con hash incremental retenido por proceso
+UPLOAD_HASH_CACHE_SIZE = 256
+
+# Hash incremental por token: ``{token: (bytes_hasheados, sha1, sha256)}``. El
+# estado de hashlib no se puede guardar en la base de datos, así que vive en el
+# proceso que recibe los bloques; si uno llega a otro worker la cadena se pierde
+# y los hashes se calculan de una pasada al completar.
+_running_hashes = {}
+_running_hashes_lock = threading.Lock()
+
+
+def _pop_running_hashes(token, offset):
+    """Hashes acumulados hasta ``offset``, o None si la cadena se interrumpió"""
+    with _running_hashes_lock:
+        state = _running_hashes.pop(token, None)
+    if state and state[0] == offset:
+        return state[1], state[2]
+    if offset == 0:
+        return hashlib.sha1(), hashlib.sha256()
+    return None
+
+
+def _peek_running_hashes(token, offset):
+    """Como ``_pop_running_hashes`` pero sin retirar el estado (se libera al confirmar)"""
+    with _running_hashes_lock:
+        state = _running_hashes.get(token)
+    if state and state[0] == offset:
+        return state[1], state[2]
+    return None
+
+
+def _store_running_hashes(token, offset, hashes):
+    with _running_hashes_lock:
+        _running_hashes[token] = (offset, *hashes)
+        while len(_running_hashes) > UPLOAD_HASH_CACHE_SIZE:
+            _running_hashes.pop(next(iter(_running_hashes)))
+
+
+class HerbarioUploadSession(models.Model):
+    _name = 'herbario.upload.session'
+    _description = 'Sesión de Subida por Bloques'
+    _order = 'id desc'
+    _rec_name = 'filename'
+
+    token = fields.Char(
+        string='Token',
+        required=True,
+        index=True,
+        copy=False,
+        readonly=True,
+        default=lambda self: uuid.uuid4().hex
+    )
+    user_id = fields.Many2one(
+        'res.users',
+        string='Usuario',
+        required=True,
+        index=True,
+        default=lambda self: self.env.user
+    )
+    state = fields.Selection([
+        ('uploading', 'Subiendo'),
+        ('completed', 'Completada'),
+    ], string='Estado', default='uploading', required=True, index=True)
+
+    # Datos de la imagen que se creará al completar
+    specimen_id = fields.Many2one(
+        'herbario.specimen',
+        string='Espécimen',
+        required=True,
+        ondelete='cascade'
+    )
+    filename = fields.Char(string='Nombre Original', required=True)
+    description = fields.Char(string='Descripción')
+    image_type = fields.Selection([
+        ('general', 'General'),
+        ('flower', 'Flor'),
+        ('fruit', 'Fruto'),
+        ('leaf', 'Hoja'),
+    ], string='Tipo de Imagen', default='general', required=True)
+
+    # Progreso
+    total_size = fields.Integer(string='Tamaño Total (bytes)', required=True)
+    received_size = fields.Integer(string='Bytes Recibidos', default=0, readonly=True)
+    chunk_count = fields.Integer(string='Bloques Recibidos', default=0, readonly=True)
+    last_chunk_at = fields.Datetime(string='Último Bloque', readonly=True)
+    image_id = fields.Many2one('herbario.image', string='Imagen Creada', readonly=True)
+
+    _sql_constraints = [
+        ('token_unique', 'UNIQUE(token)', 'El token de subida debe ser único.'),
+    ]
+
+    @api.constrains('total_size')
+    def _check_total_size(self):
+        for record in self:
+            if record.total_size <= 0 or record.total_size > UPLOAD_MAX_SIZE:
+                raise ValidationError('El tamaño del archivo no es válido o supera el máximo permitido.')
+
+    @api.model
+    def _get_upload_dir(self):
+        """Directorio de archivos temporales, compartido por todos los workers"""
+        upload_dir = os.path.join(config['data_dir'], 'herbario_uploads', self.env.cr.dbname)
+        os.makedirs(upload_dir, exist_ok=True)
+        return upload_dir
+
+    def _get_temp_path(self):
+        self.ensure_one()
+        return os.path.join(self._get_upload_dir(), f'{self.token}.part')
+
+    def _lock(self):
+        """Serializa los bloques concurrentes de una misma sesión"""
+        self.ensure_one()
+        self.env.cr.execute("SELECT id FROM herbario_upload_session WHERE id = %s FOR UPDATE", [self.id])
+
+    def _get_status(self):
+        self.ensure_one()
+        return {
+            'token': self.token,
+            'state': self.state,
+            'total_size': self.total_size,
+            'received_size': self.received_size,
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'image_id': self.image_id.id or False,
+        }
+
+    def append_chunk(self, offset, stream, length, checksum=None):
+        """
+        Escribe un bloque en el archivo temporal leyendo el cuerpo por partes
+
+        ``offset`` debe coincidir con los bytes ya recibidos; un bloque repetido
+        (reintento del cliente tras un corte) se ignora. Si se indica ``checksum``
+        se verifica el SHA-256 del bloque mientras se escribe.
+        """
+        self.ensure_one()
+        self._lock()
+        if self.state != 'uploading':
+            raise ValidationError('La sesión de subida ya fue completada.')
+        if offset + length <= self.received_size:
+            return self._get_status()
+        if offset != self.received_size:
+            raise ValidationError(f'Desplazamiento inesperado: se esperaba {self.received_size}.')
+        if length > UPLOAD_CHUNK_SIZE or offset + length > self.total_size:
+            raise ValidationError('El bloque excede el tamaño permitido.')
+
+        temp_path = self._get_temp_path()
+        running = _pop_running_hashes(self.token, offset)
+        sha256 = hashlib.sha256()
+        written = 0
+        with open(temp_path, 'r+b' if os.path.exists(temp_path) else 'wb') as temp_file:
+            temp_file.seek(offset)
+            while written < length:
+                data = stream.read(min(UPLOAD_IO_BLOCK, length - written))
+                if not data:
+                    break
+                sha256.update(data)
+                if running:
+                    running[0].update(data)
+                    running[1].update(data)
+                temp_file.write(data)
+                written += len(data)
+            if written != length or (checksum and checksum.lower() != sha256.hexdigest()):
+                # Bloque incompleto o corrupto: se descarta y el cliente lo reenvía
+                temp_file.truncate(offset)
+                raise ValidationError('El bloque recibido está incompleto o su checksum no coincide.')
+            temp_file.truncate(offset + length)
+        if running:
+            _store_running_hashes(self.token, offset + length, running)
+
+        self.write({
+            'received_size': offset + length,
+            'chunk_count': self.chunk_count + 1,
+            'last_chunk_at': fields.Datetime.now(),
+        })
+        return self._get_status()
+
+    def complete(self):
+        """
+        Crea la imagen a partir del archivo temporal sin cargarlo en memoria
+
+        El archivo temporal se enlaza en el filestore
+        (``herbario.image._create_from_file``) con los hashes acumulados al
+        recibir los bloques; el archivo y los hashes se liberan solo tras el
+        commit, para que un reintento de la transacción pueda completarla. La
+        imagen se crea como el usuario de la sesión, con sus reglas de registro.
+        """
+        self.ensure_one()
+        self._lock()
+        if self.state == 'completed':
+            return self._get_status()
+        if self.received_size != self.total_size:
+            raise ValidationError('La subida aún no ha recibido todos los bloques.')
+
+        running = _peek_running_hashes(self.token, self.total_size)
+        hashes = running and {'sha1': running[0].hexdigest(), 'sha256': running[1].hexdigest()}
+        temp_path = self._get_temp_path()
+        image = self.env['herbario.image'].with_user(self.user_id)._create_from_file({
+            'specimen_id': self.specimen_id.id,
+            'filename_original': self.filename,
+            'description': self.description,
+            'image_type': self.image_type,
+        }, temp_path, self.total_size, hashes=hashes)
+
+        self.write({'state': 'completed', 'image_id': image.id})
+        token = self.token
+
+        def cleanup():
+            _pop_running_hashes(token, None)
+            try:
+                os.unlink(temp_path)
+            except OSError as e:
+                _logger.warning("[HerbarioUpload] No se pudo eliminar %s: %s", temp_path, e)
+        self.env.cr.postcommit.add(cleanup)
+        return self._get_status()
+
+    @api.model
+    def _cron_cleanup_sessions(self):
+        """Elimina sesiones abandonadas o completadas y sus archivos temporales"""
+        limit_date = fields.Datetime.now() - timedelta(hours=UPLOAD_EXPIRATION_HOURS)
+        sessions = self.search([('write_date', '<', limit_date)])
+        for session in sessions:
+            _pop_running_hashes(session.token, None)
+            temp_path = session._get_temp_path()
+            if os.path.exists(temp_path):
+                try:
+                    os.unlink(temp_path)
+                except OSError as e:
+                    _logger.warning("[HerbarioUpload] No se pudo eliminar %s: %s", temp_path, e)
+        sessions.unlink()
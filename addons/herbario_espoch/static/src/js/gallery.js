@@ -57,8 +57,10 @@
             createLightboxModal();
 
             images = Array.from(galleryItems).map(item => {
+                const img = item.querySelector('img');
                 return {
-                    src: item.querySelector('img').src,
+                    src: img.dataset.fullSrc || img.src,
+                    tiles: img.dataset.tilesSrc || '',
                     title: item.dataset.title || '',
                     family: item.dataset.family || '',
                     url: item.dataset.url || '#'
@@ -101,7 +103,8 @@
             const modal = document.getElementById('herbario-lightbox');
             const image = images[currentImageIndex];
             
-            modal.querySelector('.herbario-lightbox-image').src = image.src;
+            const lightboxImage = modal.querySelector('.herbario-lightbox-image');
+            showImageOrTiles(lightboxImage.parentElement, lightboxImage, image.src, image.tiles, image.title);
             modal.querySelector('.herbario-lightbox-title').textContent = image.title;
             modal.querySelector('.herbario-lightbox-family').textContent = image.family;
             modal.querySelector('.herbario-lightbox-counter').textContent = `${currentImageIndex + 1} / ${images.length}`;
@@ -113,6 +116,173 @@
             }
         }
 
+        // ==================== MODALES DE IMAGEN ====================
+        // La variante completa solo se descarga al abrir el modal; si la imagen
+        // tiene pirámide de teselas se muestra el visor de zoom en su lugar
+        function initImageModals() {
+            document.querySelectorAll('img[data-full-src][data-target]').forEach(img => {
+                img.addEventListener('click', function() {
+                    const modalBody = document.querySelector(this.dataset.target + ' .modal-body');
+                    if (!modalBody) return;
+                    const modalImage = modalBody.querySelector('img');
+                    showImageOrTiles(modalBody, modalImage, this.dataset.fullSrc, this.dataset.tilesSrc, this.alt);
+                });
+            });
+        }
+
+        function showImageOrTiles(container, imageElement, src, tilesSrc, alt) {
+            let viewerElement = container.querySelector('.herbario-zoom-viewer');
+            if (viewerElement) {
+                viewerElement.remove();
+            }
+            if (tilesSrc) {
+                imageElement.style.display = 'none';
+                viewerElement = document.createElement('div');
+                viewerElement.className = 'herbario-zoom-viewer';
+                imageElement.insertAdjacentElement('afterend', viewerElement);
+                fetch(tilesSrc)
+                    .then(response => response.json())
+                    .then(info => new DeepZoomViewer(viewerElement, info))
+                    .catch(() => {
+                        viewerElement.remove();
+                        imageElement.style.display = '';
+                        imageElement.src = src;
+                    });
+            } else {
+                imageElement.style.display = '';
+                imageElement.src = src;
+                imageElement.alt = alt || '';
+            }
+        }
+
+        // ==================== VISOR DE ZOOM POR TESELAS ====================
+        // Solo se descargan las teselas del nivel adecuado que caen en la ventana visible
+        class DeepZoomViewer {
+            constructor(element, info) {
+                this.element = element;
+                this.info = info;
+                this.tiles = new Map();
+                this.fitToView();
+                this.bindEvents();
+                this.render();
+            }
+
+            // Mientras el modal se anima el visor puede medir 0 px: se reajusta
+            // al terminar de mostrarse y cuando cambia el tamaño de la ventana
+            refit() {
+                if (!this.element.isConnected) return;
+                this.fitToView();
+                this.render();
+            }
+
+            fitToView() {
+                const width = this.element.clientWidth || 1;
+                const height = this.element.clientHeight || 1;
+                this.minScale = Math.min(width / this.info.width, height / this.info.height);
+                this.scale = this.minScale;
+                this.offsetX = (width - this.info.width * this.scale) / 2;
+                this.offsetY = (height - this.info.height * this.scale) / 2;
+            }
+
+            bindEvents() {
+                const modal = this.element.closest('.modal');
+                if (modal) {
+                    modal.addEventListener('shown.bs.modal', () => this.refit());
+                }
+                const onResize = () => {
+                    if (!this.element.isConnected) {
+                        window.removeEventListener('resize', onResize);
+                        return;
+                    }
+                    this.refit();
+                };
+                window.addEventListener('resize', onResize);
+
+                this.element.addEventListener('wheel', e => {
+                    e.preventDefault();
+                    const rect = this.element.getBoundingClientRect();
+                    this.zoomAt(e.clientX - rect.left, e.clientY - rect.top, e.deltaY < 0 ? 1.25 : 0.8);
+                }, { passive: false });
+
+                let dragStart = null;
+                this.element.addEventListener('pointerdown', e => {
+                    dragStart = { x: e.clientX, y: e.clientY, offsetX: this.offsetX, offsetY: this.offsetY };
+                    this.element.setPointerCapture(e.pointerId);
+                });
+                this.element.addEventListener('pointermove', e => {
+                    if (!dragStart) return;
+                    this.offsetX = dragStart.offsetX + e.clientX - dragStart.x;
+                    this.offsetY = dragStart.offsetY + e.clientY - dragStart.y;
+                    this.render();
+                });
+                this.element.addEventListener('pointerup', () => { dragStart = null; });
+                this.element.addEventListener('dblclick', e => {
+                    const rect = this.element.getBoundingClientRect();
+                    this.zoomAt(e.clientX - rect.left, e.clientY - rect.top, 2);
+                });
+            }
+
+            zoomAt(x, y, factor) {
+                const newScale = Math.min(Math.max(this.scale * factor, this.minScale), 2);
+                const ratio = newScale / this.scale;
+                this.offsetX = x - (x - this.offsetX) * ratio;
+                this.offsetY = y - (y - this.offsetY) * ratio;
+                this.scale = newScale;
+                this.render();
+            }
+
+            render() {
+                const info = this.info;
+                const tileSize = info.tile_size;
+                // Nivel cuya resolución es la más cercana por encima de la escala actual
+                const level = Math.min(info.max_level, Math.max(0, info.max_level + Math.ceil(Math.log2(this.scale))));
+                const levelScale = Math.pow(2, level - info.max_level);
+                const levelWidth = Math.ceil(info.width * levelScale);
+                const levelHeight = Math.ceil(info.height * levelScale);
+                const displayTile = tileSize / levelScale * this.scale;
+
+                const viewWidth = this.element.clientWidth;
+                const viewHeight = this.element.clientHeight;
+                const firstCol = Math.max(0, Math.floor(-this.offsetX / displayTile));
+                const firstRow = Math.max(0, Math.floor(-this.offsetY / displayTile));
+                const lastCol = Math.min(Math.ceil(levelWidth / tileSize) - 1, Math.floor((viewWidth - this.offsetX) / displayTile));
+                const lastRow = Math.min(Math.ceil(levelHeight / tileSize) - 1, Math.floor((viewHeight - this.offsetY) / displayTile));
+
+                const visible = new Set();
+                for (let row = firstRow; row <= lastRow; row++) {
+                    for (let col = firstCol; col <= lastCol; col++) {
+                        const key = `${level}/${col}/${row}`;
+                        visible.add(key);
+                        let tile = this.tiles.get(key);
+                        if (!tile) {
+                            tile = document.createElement('img');
+                            tile.className = 'herbario-zoom-tile';
+                            tile.draggable = false;
+                            tile.src = info.tile_url
+                                .replace('{level}', level)
+                                .replace('{col}', col)
+                                .replace('{row}', row);
+                            this.element.appendChild(tile);
+                            this.tiles.set(key, tile);
+                        }
+                        const tileWidth = Math.min(tileSize, levelWidth - col * tileSize);
+                        const tileHeight = Math.min(tileSize, levelHeight - row * tileSize);
+                        tile.style.left = `${this.offsetX + col * displayTile}px`;
+                        tile.style.top = `${this.offsetY + row * displayTile}px`;
+                        tile.style.width = `${tileWidth / tileSize * displayTile}px`;
+                        tile.style.height = `${tileHeight / tileSize * displayTile}px`;
+                    }
+                }
+
+                this.tiles.forEach((tile, key) => {
+                    if (!visible.has(key)) {
+                        tile.remove();
+                        this.tiles.delete(key);
+                    }
+                });
+            }
+        }
+
         // ==================== LAZY LOADING DE IMÁGENES ====================
         function initLazyLoading() {
             const lazyImages = document.querySelectorAll('img[data-src]');
@@ -203,6 +373,7 @@
 
         // Inicializar todo
         initGallery();
+        initImageModals();
         initLazyLoading();
         adjustGalleryLayout();
         animateGalleryItems();
@@ -258,6 +429,22 @@ style.textContent = `
         box-shadow: 0 10px 40px rgba(0, 0, 0, 0.5);
     }
     
+    .herbario-zoom-viewer {
+        position: relative;
+        width: 100%;
+        height: 75vh;
+        overflow: hidden;
+        cursor: grab;
+        touch-action: none;
+        background: #111;
+    }
+    
+    .herbario-zoom-tile {
+        position: absolute;
+        max-width: none;
+        user-select: none;
+    }
+    
     .herbario-lightbox-close {
         position: absolute;
         top: 20px;
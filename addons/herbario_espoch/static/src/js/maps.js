@@ -13,24 +13,6 @@
         }
 
         function initializeMap() {
-            // Obtener datos de ubicaciones desde el elemento data
-            const mapData = document.getElementById('herbario-map-data');
-            let locations = [];
-            
-            if (mapData) {
-                try {
-                    locations = JSON.parse(mapData.textContent);
-                } catch (e) {
-                    console.error('Error al parsear datos del mapa:', e);
-                    return;
-                }
-            }
-
-            if (locations.length === 0) {
-                mapContainer.innerHTML = '<div class="herbario-map-empty">No hay ubicaciones con coordenadas GPS disponibles.</div>';
-                return;
-            }
-
             // Centro de Ecuador por defecto
             const defaultCenter = [-1.8312, -78.1834];
             const defaultZoom = 7;
@@ -44,55 +26,98 @@
                 maxZoom: 18
             }).addTo(map);
 
-            // Crear cluster de marcadores
-            let markers = L.markerClusterGroup({
-                spiderfyOnMaxZoom: true,
-                showCoverageOnHover: false,
-                zoomToBoundsOnClick: true
-            });
-
-            // Agregar marcadores
-            locations.forEach(function(location) {
-                if (location.lat && location.lng) {
-                    const marker = L.marker([location.lat, location.lng]);
-                    
-                    // Popup con información
-                    const popupContent = `
-                        <div class="herbario-map-popup">
-                            <h4 class="herbario-map-popup-title">${location.name}</h4>
-                            <p class="herbario-map-popup-location">
-                                <strong>Localidad:</strong> ${location.locality}<br>
-                                <strong>Provincia:</strong> ${location.provincia}
-                            </p>
-                            <p class="herbario-map-popup-coords">
-                                <small>Lat: ${location.lat.toFixed(6)}, Lng: ${location.lng.toFixed(6)}</small>
-                            </p>
-                        </div>
-                    `;
-                    
-                    marker.bindPopup(popupContent);
-                    markers.addLayer(marker);
+            // Grupos y puntos del área visible, agrupados en el servidor
+            const markers = L.layerGroup().addTo(map);
+            let clusters = [];
+            let selectedProvince = '';
+            let heatLayer = null;
+            let requestCounter = 0;
+            let moveTimeout = null;
+
+            function loadClusters() {
+                const bounds = map.getBounds();
+                const params = new URLSearchParams({
+                    bbox: [
+                        Math.max(bounds.getWest(), -180), Math.max(bounds.getSouth(), -85),
+                        Math.min(bounds.getEast(), 180), Math.min(bounds.getNorth(), 85)
+                    ].map(value => value.toFixed(6)).join(','),
+                    zoom: map.getZoom()
+                });
+                if (selectedProvince) {
+                    params.set('provincia', selectedProvince);
                 }
-            });
-
-            map.addLayer(markers);
+                // Solo se dibuja la respuesta de la última petición
+                const currentRequest = ++requestCounter;
+                fetch('/herbario/api/map/clusters?' + params.toString())
+                    .then(response => response.json())
+                    .then(function(data) {
+                        if (currentRequest !== requestCounter) {
+                            return;
+                        }
+                        clusters = data.clusters || [];
+                        renderClusters();
+                    })
+                    .catch(function(e) {
+                        console.error('Error al cargar las ubicaciones del mapa:', e);
+                    });
+            }
 
-            // Ajustar vista para mostrar todos los marcadores
-            if (locations.length > 0) {
-                const bounds = markers.getBounds();
-                if (bounds.isValid()) {
-                    map.fitBounds(bounds, { padding: [50, 50] });
+            function renderClusters() {
+                markers.clearLayers();
+                clusters.forEach(function(item) {
+                    if (item.count > 1) {
+                        const size = item.count < 10 ? 'small' : (item.count < 100 ? 'medium' : 'large');
+                        const marker = L.marker([item.lat, item.lng], {
+                            icon: L.divIcon({
+                                html: `<div><span>${item.count}</span></div>`,
+                                className: `herbario-map-cluster herbario-map-cluster-${size}`,
+                                iconSize: L.point(40, 40)
+                            })
+                        });
+                        // Al hacer clic se acerca el mapa para separar el grupo
+                        marker.on('click', function() {
+                            map.setView([item.lat, item.lng], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+                        });
+                        markers.addLayer(marker);
+                    } else {
+                        const marker = L.marker([item.lat, item.lng]);
+                        marker.bindPopup(`
+                            <div class="herbario-map-popup">
+                                <h4 class="herbario-map-popup-title">${escapeHtml(item.name)}</h4>
+                                <p class="herbario-map-popup-location">
+                                    <strong>Localidad:</strong> ${escapeHtml(item.locality)}<br>
+                                    <strong>Provincia:</strong> ${escapeHtml(item.provincia)}
+                                </p>
+                                <p class="herbario-map-popup-coords">
+                                    <small>Lat: ${item.lat.toFixed(6)}, Lng: ${item.lng.toFixed(6)}</small>
+                                </p>
+                                <a href="${item.url}" class="herbario-map-popup-link">Ver espécimen</a>
+                            </div>
+                        `);
+                        markers.addLayer(marker);
+                    }
+                });
+                if (heatLayer) {
+                    heatLayer.setLatLngs(clusters.map(item => [item.lat, item.lng, item.count]));
                 }
             }
 
+            map.on('moveend', function() {
+                clearTimeout(moveTimeout);
+                moveTimeout = setTimeout(loadClusters, 250);
+            });
+            loadClusters();
+
             // ==================== CONTROLES ADICIONALES ====================
             
             // Control de pantalla completa
-            L.control.fullscreen({
-                position: 'topleft',
-                title: 'Ver en pantalla completa',
-                titleCancel: 'Salir de pantalla completa'
-            }).addTo(map);
+            if (L.control.fullscreen) {
+                L.control.fullscreen({
+                    position: 'topleft',
+                    title: 'Ver en pantalla completa',
+                    titleCancel: 'Salir de pantalla completa'
+                }).addTo(map);
+            }
 
             // Control de escala
             L.control.scale({
@@ -105,55 +130,19 @@
             const provinceFilter = document.getElementById('herbario-map-province-filter');
             if (provinceFilter) {
                 provinceFilter.addEventListener('change', function() {
-                    const selectedProvince = this.value;
-                    
-                    markers.clearLayers();
-                    
-                    const filteredLocations = selectedProvince 
-                        ? locations.filter(loc => loc.provincia === selectedProvince)
-                        : locations;
-                    
-                    filteredLocations.forEach(function(location) {
-                        if (location.lat && location.lng) {
-                            const marker = L.marker([location.lat, location.lng]);
-                            const popupContent = `
-                                <div class="herbario-map-popup">
-                                    <h4 class="herbario-map-popup-title">${location.name}</h4>
-                                    <p class="herbario-map-popup-location">
-                                        <strong>Localidad:</strong> ${location.locality}<br>
-                                        <strong>Provincia:</strong> ${location.provincia}
-                                    </p>
-                                </div>
-                            `;
-                            marker.bindPopup(popupContent);
-                            markers.addLayer(marker);
-                        }
-                    });
-                    
-                    map.addLayer(markers);
-                    
-                    if (filteredLocations.length > 0) {
-                        const bounds = markers.getBounds();
-                        if (bounds.isValid()) {
-                            map.fitBounds(bounds, { padding: [50, 50] });
-                        }
-                    }
+                    selectedProvince = this.value;
+                    loadClusters();
                 });
             }
 
             // ==================== MAPA DE CALOR ====================
             const heatmapToggle = document.getElementById('herbario-map-heatmap-toggle');
-            let heatLayer = null;
             
             if (heatmapToggle && typeof L.heatLayer !== 'undefined') {
                 heatmapToggle.addEventListener('change', function() {
                     if (this.checked) {
-                        // Crear capa de calor
-                        const heatData = locations
-                            .filter(loc => loc.lat && loc.lng)
-                            .map(loc => [loc.lat, loc.lng, 1]);
-                        
-                        heatLayer = L.heatLayer(heatData, {
+                        // Capa de calor ponderada por el tamaño de cada grupo
+                        heatLayer = L.heatLayer(clusters.map(item => [item.lat, item.lng, item.count]), {
                             radius: 25,
                             blur: 15,
                             maxZoom: 17,
@@ -186,6 +175,12 @@
             }
         }
 
+        function escapeHtml(value) {
+            const div = document.createElement('div');
+            div.textContent = value || '';
+            return div.innerHTML;
+        }
+
         // ==================== MAPA EN DETALLE DE ESPÉCIMEN ====================
         const detailMapContainer = document.getElementById('herbario-detail-map');
         
@@ -260,20 +255,9 @@
         }
 
         function loadLeafletPlugins() {
-            // Leaflet MarkerCluster
-            const clusterCSS = document.createElement('link');
-            clusterCSS.rel = 'stylesheet';
-            clusterCSS.href = 'https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.css';
-            document.head.appendChild(clusterCSS);
-
-            const clusterJS = document.createElement('script');
-            clusterJS.src = 'https://unpkg.com/leaflet.markercluster@1.5.3/dist/leaflet.markercluster.js';
-            clusterJS.onload = function() {
-                // Reinicializar mapas después de cargar plugins
-                if (mapContainer) initializeMap();
-                if (detailMapContainer) initializeDetailMap();
-            };
-            document.head.appendChild(clusterJS);
+            // La agrupación de marcadores se hace en el servidor; no se requieren plugins
+            if (mapContainer) initializeMap();
+            if (detailMapContainer) initializeDetailMap();
         }
 
     });
@@ -333,6 +317,33 @@ style.textContent = `
         color: white;
     }
     
+    .herbario-map-cluster {
+        background: rgba(90, 140, 111, 0.4);
+        border-radius: 50%;
+    }
+
+    .herbario-map-cluster div {
+        width: 30px;
+        height: 30px;
+        margin: 5px;
+        border-radius: 50%;
+        background: #2d5f3f;
+        color: white;
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        font-size: 0.8rem;
+        font-weight: bold;
+    }
+
+    .herbario-map-cluster-medium div {
+        background: #1b6f4a;
+    }
+
+    .herbario-map-cluster-large div {
+        background: #1b3a2d;
+    }
+
     .leaflet-container {
         font-family: 'Roboto', Arial, sans-serif;
     }